@@ -0,0 +1,115 @@
+"""Admission control: caps on connections, waiting players, engine games and spectators.
+
+A connection is counted from the moment it is accepted. Past the connection
+cap it is refused on the spot: it gets one BUSY line and is closed, without a
+thread or a session. The other caps are checked when the client answers the
+welcome prompt, the first point at which the server knows what it wants:
+
+* "P" is refused while the matchmaking queue holds ``waiting`` players,
+* "E" is refused while ``engines`` games against the engine are going on,
+* "S" is refused while ``spectators`` connections are spectating,
+* all three are refused once fewer than ``reserve`` connections are left, which
+  keeps that many free for "R": players resuming a game already in progress
+  are only ever refused at the hard connection cap.
+
+A refused client gets "BUSY:<seconds> <reason>" telling it when to retry;
+the delay is jittered so refused clients do not all come back at once.
+"""
+
+import random
+import threading
+
+import metrics
+
+DEFAULT_LIMITS = {
+    "connections": 5000,  # Open client connections, including ones still at the welcome prompt
+    "waiting": 1000,  # Players in the matchmaking queue
+    "engines": 500,  # Games against the engine
+    "spectators": 4000,  # Connections spectating or picking a game to spectate
+    "reserve": 250,  # Connections only resuming players may take
+}
+BACKLOG = 1024  # listen() backlog; the kernel caps it at net.core.somaxconn
+ACCEPT_BATCH = 64  # Connections accepted per wakeup of the threaded accept loop
+RETRY_AFTER = 5.0  # Seconds a refused client is told to wait, before jitter
+
+MESSAGES = {
+    "connections": "Server is full.",
+    "waiting": "Too many players are waiting for a game.",
+    "engines": "Too many games against the engine.",
+    "spectators": "Too many spectators.",
+    "resources": "Server is out of resources.",
+}
+
+rejected = {
+    reason: metrics.registry.counter(
+        "chess_admission_rejected_total", "Clients told the server is busy.", {"reason": reason}
+    )
+    for reason in MESSAGES
+}
+
+
+class Admission:
+    """Connection and spectator counts of this process, checked against the limits."""
+
+    def __init__(self, limits=None, retry_after=RETRY_AFTER):
+        self.limits = dict(DEFAULT_LIMITS if limits is None else limits)
+        self.retry_after_s = retry_after
+        self.lock = threading.Lock()
+        self.connections = 0
+        self.spectators = 0
+
+    def connect(self, force=False):
+        """Counts a new connection. Returns False, counting nothing, if the server is full.
+
+        ``force`` counts it regardless, for connections another worker already admitted.
+        """
+        with self.lock:
+            if not force and self.connections >= self.limits["connections"]:
+                full = True
+            else:
+                full = False
+                self.connections += 1
+        if full:
+            rejected["connections"].inc()
+        return not full
+
+    def disconnect(self):
+        with self.lock:
+            self.connections -= 1
+
+    def admit(self, choice, waiting, engine_games=0):
+        """None if a client answering the welcome prompt with choice may go on, else why not.
+
+        An admitted "S" is counted as a spectator until spectator_left().
+        """
+        if choice not in ("P", "E", "S"):
+            return None
+        limits = self.limits
+        with self.lock:
+            if self.connections > limits["connections"] - limits["reserve"]:
+                reason = "connections"
+            elif choice == "P" and waiting >= limits["waiting"]:
+                reason = "waiting"
+            elif choice == "E" and engine_games >= limits["engines"]:
+                reason = "engines"
+            elif choice == "S" and self.spectators >= limits["spectators"]:
+                reason = "spectators"
+            else:
+                if choice == "S":
+                    self.spectators += 1
+                return None
+        rejected[reason].inc()
+        return reason
+
+    def spectator_adopted(self):
+        """Counts a spectator another worker admitted and passed on."""
+        with self.lock:
+            self.spectators += 1
+
+    def spectator_left(self):
+        with self.lock:
+            self.spectators -= 1
+
+    def retry_after(self):
+        """Whole seconds a refused client should wait: RETRY_AFTER to twice that."""
+        return max(1, round(self.retry_after_s * random.uniform(1.0, 2.0)))
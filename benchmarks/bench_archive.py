@@ -0,0 +1,109 @@
+"""Archive write cost on the game thread, archive size, and PGN export speed.
+
+Archives N finished games through game_archive.Archive the way the server
+does, reporting what the game thread pays per game (only a queue put) and how
+long the writer thread takes to get everything on disk. It then streams the
+archive back out as PGN and reports the export rate and the peak memory of
+the export, which should not grow with the number of games.
+
+    python benchmarks/bench_archive.py --games 100000 --export 20000
+"""
+
+import argparse
+import io
+import os
+import random
+import resource
+import sys
+import tempfile
+import time
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+import chess  # noqa: E402
+
+import game_archive  # noqa: E402
+
+DISTINCT_GAMES = 200  # Random move lists reused across game IDs
+
+
+def random_games(plies, seed):
+    rng = random.Random(seed)
+    games = []
+    while len(games) < DISTINCT_GAMES:
+        board = chess.Board()
+        while board.ply() < plies and not board.is_game_over():
+            board.push(rng.choice(list(board.legal_moves)))
+        games.append(list(board.move_stack))
+    return games
+
+
+class CountingWriter(io.TextIOBase):
+    def __init__(self):
+        self.chars = 0
+
+    def write(self, text):
+        self.chars += len(text)
+        return len(text)
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.splitlines()[0])
+    parser.add_argument("--games", type=int, default=100000)
+    parser.add_argument("--plies", type=int, default=80)
+    parser.add_argument("--export", type=int, default=20000, help="games to export as PGN")
+    parser.add_argument("--seed", type=int, default=1)
+    args = parser.parse_args()
+    move_lists = random_games(args.plies, args.seed)
+
+    with tempfile.TemporaryDirectory() as directory:
+        archive = game_archive.Archive(directory)
+        archive.open()
+        put_s = 0.0
+        start = time.perf_counter()
+        for index in range(args.games):
+            moves = list(move_lists[index % DISTINCT_GAMES])  # The server copies the move stack
+            before = time.perf_counter()
+            archive.game_finished(
+                f"{index:08x}", "127.0.0.1:50000", "127.0.0.1:50001", "1/2-1/2",
+                "Stalemate! It's a draw.", "5+0", moves,
+            )
+            put_s += time.perf_counter() - before
+        while archive.archived < args.games:
+            time.sleep(0.01)
+        written_s = time.perf_counter() - start
+        size = sum(
+            os.path.getsize(os.path.join(directory, name)) for name in os.listdir(directory)
+        )
+        print(
+            f"archived {args.games} games: {put_s / args.games * 1e6:.2f} us on the game thread, "
+            f"on disk after {written_s:.2f}s, {size / args.games:.0f} bytes per game with index"
+        )
+
+        start = time.perf_counter()
+        found = sum(1 for _ in game_archive.find(directory, player="127.0.0.1:50001"))
+        print(f"index scan by player: {found} games in {time.perf_counter() - start:.2f}s")
+
+        rss_before = resource.getrusage(resource.RUSAGE_SELF).ru_maxrss
+        out = CountingWriter()
+        start = time.perf_counter()
+        exported = 0
+        for number in range(archive.segment_number + 1):
+            for game in game_archive.read_segment(game_archive.segment_path(directory, number)):
+                out.write(game.pgn())
+                exported += 1
+                if exported == args.export:
+                    break
+            if exported == args.export:
+                break
+        export_s = time.perf_counter() - start
+        rss_after = resource.getrusage(resource.RUSAGE_SELF).ru_maxrss
+        print(
+            f"exported {exported} games as PGN in {export_s:.2f}s "
+            f"({exported / export_s:.0f} games/s, {out.chars / 1e6:.1f} MB), "
+            f"peak RSS grew {(rss_after - rss_before) / 1024:.1f} MB"
+        )
+
+
+if __name__ == "__main__":
+    main()
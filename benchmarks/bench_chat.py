@@ -0,0 +1,131 @@
+"""Move delivery during a chat storm: chat broadcast per line vs coalesced at low priority.
+
+Sets up one game watched by N spectators over loopback TCP. Each round posts
+a burst of chat lines and then broadcasts a move, and the spectators read
+until they have the move. "per-line" sends every line with broadcast(), as
+the server used to; "coalesced" posts them to the game's ChatRoom and
+flushes once, the way the ChatFlusher does each interval. Reports the time
+until every spectator has the move, the time until they have everything, and
+the bytes and CHAT frames each (v2) spectator received.
+
+    python benchmarks/bench_chat.py --spectators 10 100 --lines 50
+"""
+
+import argparse
+import os
+import resource
+import socket
+import sys
+import time
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+import chat  # noqa: E402
+import chess_server  # noqa: E402
+import protocol  # noqa: E402
+from event_log import log  # noqa: E402
+
+
+def tcp_pairs(count):
+    listener = socket.socket()
+    listener.bind(("127.0.0.1", 0))
+    listener.listen(count)
+    pairs = []
+    for _ in range(count):
+        peer = socket.create_connection(listener.getsockname())
+        sock, _ = listener.accept()
+        pairs.append((sock, peer))
+    listener.close()
+    return pairs
+
+
+def read_round(peers, expected, start):
+    """Reads each peer until it has ``expected`` bytes. Returns (move seconds, all seconds, CHAT frames)."""
+    move_at = 0.0
+    chats = 0
+    for peer in peers:
+        buffer = bytearray()
+        received = 0
+        while received < expected:
+            data = peer.recv(65536)
+            received += len(data)
+            buffer += data
+            while True:
+                frame = protocol.pop_frame(buffer)
+                if frame is None:
+                    break
+                if frame[0] == protocol.BOARD:
+                    move_at = max(move_at, time.perf_counter() - start)
+                elif frame[0] == protocol.CHAT:
+                    chats += 1
+    return move_at, time.perf_counter() - start, chats / len(peers)
+
+
+def run(count, lines, rounds, coalesced):
+    pairs = tcp_pairs(count + 1)
+    conns = [chess_server.SocketConnection(sock) for sock, _ in pairs]
+    for conn in conns:
+        conn.protocol_version = 2
+    peers = [peer for _, peer in pairs[1:]]
+    sender = conns[0]
+    game_id = f"chat{count:04d}"
+    game = {
+        "players": {"white": sender, "black": None},
+        "spectators": tuple(conns[1:]),
+        "lock": chess_server.new_game_lock(),
+    }
+    chess_server.active_games = {game_id: game}
+    texts = [f"message {i} in a bursty chat storm" for i in range(lines)]
+    name = "White(127.0.0.1:50000)"
+    move = protocol.board("rnbqkbnr/pppppppp/8/8/4P3/8/PPPP1PPP/RNBQKBNR b KQkq - 0 1")
+    if coalesced:
+        expected = len(protocol.chat_lines([f"{name}: {text}" for text in texts]).encode(2))
+    else:
+        expected = sum(len(protocol.chat(f"{name}: {text}").encode(2)) for text in texts)
+    expected += len(move.encode(2))
+    results = []
+    for _ in range(rounds):
+        game["chat"] = chat.ChatRoom()
+        start = time.perf_counter()
+        with game["lock"]:
+            if coalesced:
+                for text in texts:
+                    game["chat"].post(sender, name, text)
+            else:
+                for text in texts:
+                    chess_server.broadcast(game_id, protocol.chat(f"{name}: {text}"), exclude_conn=sender)
+        if coalesced:
+            chess_server.flush_chat(game_id)
+        with game["lock"]:
+            chess_server.broadcast(game_id, move, exclude_conn=sender)
+        results.append(read_round(peers, expected, start))
+    for conn in conns:
+        conn.close()
+    for peer in peers:
+        peer.close()
+    results.sort()
+    move_s, all_s, chats = results[len(results) // 2]  # Median round by move latency
+    return move_s, all_s, expected, chats
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.splitlines()[0])
+    parser.add_argument("--spectators", type=int, nargs="+", default=[10, 100, 500])
+    parser.add_argument("--lines", type=int, default=50, help="chat lines per burst (at most chat.HISTORY_SIZE)")
+    parser.add_argument("--rounds", type=int, default=20)
+    args = parser.parse_args()
+    log.configure(level="off")
+    soft, hard = resource.getrlimit(resource.RLIMIT_NOFILE)
+    resource.setrlimit(resource.RLIMIT_NOFILE, (hard, hard))
+    lines = min(args.lines, chat.HISTORY_SIZE)
+    print(f"{'spectators':>10} {'mode':>10} {'move ms':>8} {'all ms':>8} {'bytes':>7} {'CHATs':>6}")
+    for count in args.spectators:
+        for mode in ("per-line", "coalesced"):
+            move_s, all_s, size, chats = run(count, lines, args.rounds, mode == "coalesced")
+            print(
+                f"{count:>10} {mode:>10} {move_s * 1000:>8.2f} {all_s * 1000:>8.2f} {size:>7} {chats:>6.0f}"
+            )
+
+
+if __name__ == "__main__":
+    main()
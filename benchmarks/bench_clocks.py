@@ -0,0 +1,60 @@
+"""Clock bookkeeping per move with 1k to 100k running clocks.
+
+Starts N timed games on one FlagScheduler, then plays moves in random games:
+each move presses the game's clock and schedules its new flag-fall deadline,
+which is what the server does under the game's lock. The cost per move
+should grow with log N, not N. It also times a pass of the scheduler that
+finds the games whose flag has fallen.
+
+    python benchmarks/bench_clocks.py --games 1000 10000 100000
+"""
+
+import argparse
+import os
+import random
+import sys
+import time
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+import game_clock  # noqa: E402
+
+
+def run(games, moves, rng):
+    scheduler = game_clock.FlagScheduler()
+    clocks = []
+    now = 0.0
+    for game_id in range(games):
+        clock = game_clock.new_clock(rng.choice(("1+0", "3+2", "5+0", "15+10")))
+        clock.start("white", now + rng.random() * 60)
+        scheduler.schedule(game_id, clock.deadline())
+        clocks.append(clock)
+    picks = [rng.randrange(games) for _ in range(moves)]
+    start = time.perf_counter()
+    for game_id in picks:
+        now += 0.001
+        clock = clocks[game_id]
+        if clock.running is not None and clock.press(clock.running, max(now, clock.turn_started)):
+            scheduler.schedule(game_id, clock.deadline())
+    per_move = (time.perf_counter() - start) / moves
+    heap_size = len(scheduler.heap)
+    start = time.perf_counter()
+    flagged = scheduler.expired(now + 120)  # Every clock with under two minutes left
+    expire_s = time.perf_counter() - start
+    return per_move, heap_size, len(flagged), expire_s
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.splitlines()[0])
+    parser.add_argument("--games", type=int, nargs="+", default=[1000, 10000, 100000])
+    parser.add_argument("--moves", type=int, default=200000)
+    parser.add_argument("--seed", type=int, default=1)
+    args = parser.parse_args()
+    print(f"{'games':>8} {'us/move':>8} {'heap':>8} {'flagged':>8} {'expire ms':>10}")
+    for games in args.games:
+        per_move, heap_size, flagged, expire_s = run(games, args.moves, random.Random(args.seed))
+        print(f"{games:>8} {per_move * 1e6:>8.2f} {heap_size:>8} {flagged:>8} {expire_s * 1000:>10.1f}")
+
+
+if __name__ == "__main__":
+    main()
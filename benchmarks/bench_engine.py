@@ -0,0 +1,181 @@
+"""Games against the engine: how long its replies take, and that nothing else waits for them.
+
+Starts a server, then plays N games against the engine at once. Each client
+plays random legal moves as White and times the engine's replies, from its
+own MOVE to the engine's DELTA. Meanwhile a lobby connection sends a PING
+every quarter second (within the rate limits); its round trip shows whether
+searches hold up the server's I/O, which they must not, as they run in the
+engine's worker processes. "fair" is the slowest game's mean reply over the
+fastest's: the engine's queue serves games in turn, so it should stay close
+to 1.
+
+    python benchmarks/bench_engine.py --games 1 8 32 --depth 4 --time 1 --mode asyncio
+"""
+
+import argparse
+import asyncio
+import os
+import random
+import statistics
+import subprocess
+import sys
+import time
+
+sys.path.insert(0, os.path.dirname(os.path.abspath(__file__)))
+
+import chess  # noqa: E402
+
+import stress_games  # noqa: E402 (also puts the repository on sys.path)
+
+import protocol  # noqa: E402
+
+
+def percentile(values, fraction):
+    values = sorted(values)
+    return values[min(len(values) - 1, int(len(values) * fraction))]
+
+
+async def play(port, choice, plies, seed, replies, outcomes):
+    """One game as White against the engine, up to plies plies; appends its reply times."""
+    rng = random.Random(seed)
+    reader, writer = await asyncio.open_connection("127.0.0.1", port)
+    await reader.readuntil(stress_games.WELCOME)
+    writer.write(choice.encode() + b"\n")
+    board = chess.Board()
+    buffer = bytearray()
+    sent_at = None
+    times = []
+    try:
+        while True:
+            data = await reader.read(65536)
+            if not data:
+                outcomes.append("disconnected")
+                return
+            buffer += data
+            while True:
+                frame = protocol.pop_frame(buffer)
+                if frame is None:
+                    break
+                opcode, payload = frame
+                if opcode == protocol.SNAPSHOT:
+                    board = chess.Board(payload.split(" ", 1)[1])
+                elif opcode == protocol.DELTA:
+                    board.push_uci(payload.split(" ")[1])
+                    if sent_at is not None and board.turn == chess.WHITE:
+                        times.append(time.perf_counter() - sent_at)
+                        sent_at = None
+                elif opcode == protocol.GAME_OVER:
+                    outcomes.append(payload)
+                    return
+                elif opcode in (protocol.INVALID_MOVE, protocol.ERROR, protocol.BUSY):
+                    outcomes.append(f"rejected: {payload}")
+                    return
+                else:
+                    continue
+                if board.turn == chess.WHITE and sent_at is None and opcode != protocol.GAME_OVER:
+                    if len(board.move_stack) >= plies:
+                        outcomes.append("ok")
+                        return
+                    move = rng.choice(list(board.legal_moves))
+                    sent_at = time.perf_counter()
+                    writer.write(protocol.encode_frame(protocol.MOVE, move.uci()))
+    finally:
+        writer.close()
+        replies.append(times)
+
+
+async def ping(port, interval, stop, round_trips):
+    """Pings the server from the lobby until stop is set."""
+    reader, writer = await asyncio.open_connection("127.0.0.1", port)
+    await reader.readuntil(stress_games.WELCOME)
+    writer.write(b"S v2 lobby\n")
+    buffer = bytearray()
+    try:
+        while not stop.is_set():
+            sent_at = time.perf_counter()
+            writer.write(protocol.encode_frame(protocol.PING, "bench"))
+            while True:
+                frame = protocol.pop_frame(buffer)
+                if frame is not None:
+                    if frame[0] == protocol.PONG:
+                        break
+                    continue
+                data = await reader.read(65536)
+                if not data:
+                    return
+                buffer += data
+            round_trips.append(time.perf_counter() - sent_at)
+            await asyncio.sleep(interval)
+    finally:
+        writer.close()
+
+
+async def run_level(port, games, choice, plies):
+    replies = []
+    outcomes = []
+    round_trips = []
+    stop = asyncio.Event()
+    pinger = asyncio.create_task(ping(port, 0.25, stop, round_trips))
+    await asyncio.sleep(0.1)
+    start = time.perf_counter()
+    await asyncio.gather(*(play(port, choice, plies, seed, replies, outcomes) for seed in range(games)))
+    elapsed = time.perf_counter() - start
+    stop.set()
+    await pinger
+    return replies, outcomes, round_trips, elapsed
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.splitlines()[0])
+    parser.add_argument("--games", type=int, nargs="+", default=[1, 8, 32])
+    parser.add_argument("--depth", type=int, default=4)
+    parser.add_argument("--time", type=float, default=1.0, help="seconds per engine move")
+    parser.add_argument("--plies", type=int, default=20, help="plies per game")
+    parser.add_argument("--engine-workers", type=int, default=0)
+    parser.add_argument("--mode", choices=("threads", "asyncio"), default="asyncio")
+    parser.add_argument("--port", type=int, default=65432)
+    args = parser.parse_args()
+
+    server = subprocess.Popen(
+        [
+            sys.executable, os.path.join(stress_games.ROOT, "chess_server.py"), "--mode", args.mode,
+            "--port", str(args.port),
+            "--engine-workers", str(args.engine_workers), "--max-engine-games", str(max(args.games)),
+        ],
+        stdout=subprocess.DEVNULL,
+        stderr=subprocess.DEVNULL,
+    )
+    choice = f"E v2 delta depth={args.depth} time={args.time} color=white"
+    failed = False
+    try:
+        stress_games.wait_for_port(args.port)
+        print(
+            f"{'games':>6} {'reply p50':>10} {'reply p99':>10} {'fair':>6} "
+            f"{'ping p50':>9} {'ping max':>9} {'moves/s':>8}  result"
+        )
+        for games in args.games:
+            replies, outcomes, round_trips, elapsed = asyncio.run(
+                run_level(args.port, games, choice, args.plies)
+            )
+            # Games may also end early, e.g. when the engine mates
+            bad = [o for o in outcomes if o == "disconnected" or o.startswith(("rejected", "The engine failed"))]
+            failed |= bool(bad)
+            flat = [reply for times in replies for reply in times]
+            means = [statistics.mean(times) for times in replies if times]
+            if not flat:
+                print(f"{games:>6} no engine replies: {bad[:1]}")
+                continue
+            print(
+                f"{games:>6} {statistics.median(flat) * 1000:>8.0f}ms {percentile(flat, 0.99) * 1000:>8.0f}ms "
+                f"{max(means) / min(means):>6.2f} {statistics.median(round_trips) * 1000:>7.2f}ms "
+                f"{max(round_trips) * 1000:>7.2f}ms {len(flat) / elapsed:>8.1f}  "
+                + ("ok" if not bad else f"{len(bad)} bad: {bad[0]}")
+            )
+    finally:
+        server.terminate()
+        server.wait()
+    sys.exit(1 if failed else 0)
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,135 @@
+"""Hot restart with many live connections: how long clients are paused.
+
+Starts a server with --handoff, connects N players in pairs so every one of
+them is in a game, and starts a second server with --takeover. The pause is
+from the old process stopping to the new one serving, read from the two
+servers' logs; "handed" is the old process's part of it, from stopping until
+the new one answers "ready". Afterwards every player sends a chat line and
+must get its echo over the same connection it had before the restart.
+
+    python benchmarks/bench_hot_restart.py --connections 1000 10000 --mode asyncio
+"""
+
+import argparse
+import asyncio
+import json
+import os
+import resource
+import subprocess
+import sys
+import tempfile
+import time
+
+sys.path.insert(0, os.path.dirname(os.path.abspath(__file__)))
+
+import stress_games  # noqa: E402
+
+
+async def join(port):
+    reader, writer = await asyncio.open_connection("127.0.0.1", port)
+    await reader.readuntil(stress_games.WELCOME)
+    writer.write(b"P\n")
+    while True:
+        line = await reader.readline()
+        if not line or line.startswith(b"BUSY:"):
+            raise RuntimeError(f"Server refused a player: {line!r}")
+        if line.startswith(b"INFO:You are "):
+            break
+    return reader, writer
+
+
+async def echo(reader, writer):
+    """True if a chat line sent now is echoed back."""
+    writer.write(b"CHAT:still here\n")
+    try:
+        while True:
+            line = await reader.readline()
+            if not line:
+                return False
+            if line.startswith(b"CHAT:You: still here"):
+                return True
+    except OSError:
+        return False
+
+
+async def echo_all(clients):
+    return await asyncio.gather(*(echo(reader, writer) for reader, writer in clients))
+
+
+async def connect_all(port, count):
+    clients = []
+    for start in range(0, count, 500):  # In waves, to stay within the listen backlog
+        clients += await asyncio.gather(*(join(port) for _ in range(start, min(count, start + 500))))
+    return clients
+
+
+def find_record(path, msg, timeout=30.0):
+    """The first record with msg in the log at path, polling until it shows up."""
+    deadline = time.monotonic() + timeout
+    while time.monotonic() < deadline:
+        if os.path.exists(path):
+            with open(path) as f:
+                for line in f:
+                    record = json.loads(line)
+                    if record.get("msg") == msg:
+                        return record
+        time.sleep(0.1)
+    raise RuntimeError(f"No {msg!r} record in {path}")
+
+
+def run(count, mode, port, directory):
+    handoff = os.path.join(directory, "handoff")
+    old_log = os.path.join(directory, f"old-{count}.log")
+    new_log = os.path.join(directory, f"new-{count}.log")
+    common = [
+        "--mode", mode, "--port", str(port), "--max-connections", str(count + 100), "--max-waiting", str(count),
+        "--resume-reserve", "0", "--handoff", handoff,
+    ]
+    server = os.path.join(stress_games.ROOT, "chess_server.py")
+    old = subprocess.Popen(
+        [sys.executable, server, *common, "--log-file", old_log],
+        stdout=subprocess.DEVNULL, stderr=subprocess.DEVNULL,
+    )
+    new = None
+    loop = asyncio.new_event_loop()
+    try:
+        stress_games.wait_for_port(port)
+        clients = loop.run_until_complete(connect_all(port, count))
+        new = subprocess.Popen(
+            [sys.executable, server, *common, "--takeover", handoff, "--log-file", new_log],
+            stdout=subprocess.DEVNULL, stderr=subprocess.DEVNULL,
+        )
+        old.wait(timeout=60)  # Polling its long log meanwhile would steal CPU from the handoff
+        frozen = find_record(old_log, "handing over")
+        handed = find_record(old_log, "handed over")
+        took = find_record(new_log, "took over")
+        echoed = loop.run_until_complete(echo_all(clients))
+        for _, writer in clients:
+            writer.close()
+    finally:
+        loop.close()
+        for process in (old, new):
+            if process is not None and process.poll() is None:
+                process.terminate()
+                process.wait()
+    return took["ts"] - frozen["ts"], handed["seconds"], handed["games"], sum(echoed)
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.splitlines()[0])
+    parser.add_argument("--connections", type=int, nargs="+", default=[100, 1000, 5000])
+    parser.add_argument("--mode", choices=("threads", "asyncio"), default="asyncio")
+    parser.add_argument("--port", type=int, default=65432)
+    args = parser.parse_args()
+    soft, hard = resource.getrlimit(resource.RLIMIT_NOFILE)
+    resource.setrlimit(resource.RLIMIT_NOFILE, (hard, hard))
+
+    print(f"{'connections':>11} {'games':>6} {'pause ms':>9} {'handed ms':>10} {'still here':>11}")
+    with tempfile.TemporaryDirectory() as directory:
+        for count in args.connections:
+            pause, handed, games, echoed = run(count - count % 2, args.mode, args.port, directory)
+            print(f"{count:>11} {games:>6} {pause * 1000:>9.1f} {handed * 1000:>10.1f} {echoed:>11}")
+
+
+if __name__ == "__main__":
+    main()
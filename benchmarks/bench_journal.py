@@ -0,0 +1,113 @@
+"""Journal write throughput and crash-recovery time for many live games.
+
+Appends the creation and moves of N games to a fresh journal the way the
+server does (one record per move, group-committed by the writer thread),
+then measures how long a restarting server takes to read the journal back
+into active_games, both straight after the appends and after compaction.
+Boards are replayed lazily, so the cost of replaying one game on first use
+is reported separately.
+
+    python benchmarks/bench_journal.py --games 100000 --plies 40
+"""
+
+import argparse
+import os
+import random
+import sys
+import tempfile
+import time
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+import chess  # noqa: E402
+
+import chess_server  # noqa: E402
+import game_journal  # noqa: E402
+
+DISTINCT_GAMES = 200  # Random move lists reused across game IDs
+
+
+def random_games(plies, seed):
+    rng = random.Random(seed)
+    games = []
+    while len(games) < DISTINCT_GAMES:
+        board = chess.Board()
+        moves = []
+        while len(moves) < plies and not board.is_game_over():
+            move = rng.choice(list(board.legal_moves))
+            board.push(move)
+            moves.append(move.uci())
+        if len(moves) == plies:
+            games.append(moves)
+    return games
+
+
+def fresh_server():
+    chess_server.active_games = {}
+    chess_server.lobby_index = chess_server.lobby.LobbyIndex(lambda *args: None)
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.splitlines()[0])
+    parser.add_argument("--games", type=int, default=100000)
+    parser.add_argument("--plies", type=int, default=40)
+    parser.add_argument("--seed", type=int, default=1)
+    args = parser.parse_args()
+    move_lists = random_games(args.plies, args.seed)
+    addr = ("127.0.0.1", 50000)
+    tokens = {"white": "t" * 32, "black": "t" * 32}
+
+    with tempfile.TemporaryDirectory() as directory:
+        path = os.path.join(directory, "games.journal")
+        journal = game_journal.Journal(path)
+        journal.open()
+        start = time.perf_counter()
+        game_ids = [f"{index:08x}" for index in range(args.games)]
+        for game_id in game_ids:
+            journal.game_started(game_id, "5+0", addr, addr, tokens)
+        # Interleave the games' moves, as concurrent games would
+        for ply in range(args.plies):
+            for index, game_id in enumerate(game_ids):
+                journal.move_played(game_id, move_lists[index % DISTINCT_GAMES][ply])
+        appended_s = time.perf_counter() - start
+        journal.sync()
+        synced_s = time.perf_counter() - start
+        records = journal.appended
+        print(
+            f"appended {records} records in {appended_s:.2f}s "
+            f"({appended_s / records * 1e6:.2f} us each), durable after {synced_s:.2f}s "
+            f"in {journal.batches} fsyncs"
+        )
+        size = os.path.getsize(path)
+
+        # Recovery straight from the appended records (no compaction since startup)
+        uncompacted = os.path.join(directory, "uncompacted.journal")
+        with open(uncompacted, "w") as f:
+            for game_id in game_ids:
+                f.write(f"C {game_id} 5+0 127.0.0.1:50000 127.0.0.1:50000 {'t' * 32} {'t' * 32}\n")
+            for ply in range(args.plies):
+                for index, game_id in enumerate(game_ids):
+                    f.write(f"M {game_id} {move_lists[index % DISTINCT_GAMES][ply]}\n")
+        for label, source in (("uncompacted", uncompacted), ("compacted", path)):
+            fresh_server()
+            start = time.perf_counter()
+            recovered = chess_server.recover_games(source)
+            recover_s = time.perf_counter() - start
+            print(
+                f"recover {label:<11} {os.path.getsize(source) / 1e6:8.1f} MB "
+                f"{len(chess_server.active_games):>8} games in {recover_s:.2f}s"
+            )
+            assert len(chess_server.active_games) == args.games
+        print(f"journal after compaction: {os.path.getsize(path) / 1e6:.1f} MB (was {size / 1e6:.1f} MB)")
+
+        sample = list(chess_server.active_games.values())[:1000]
+        start = time.perf_counter()
+        for game in sample:
+            game["board"]
+        replay_s = time.perf_counter() - start
+        print(f"first use of a recovered game: {replay_s / len(sample) * 1000:.2f} ms (board replay)")
+        recovered.sync()
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,95 @@
+"""Lobby listing cost with many live games, with and without the index.
+
+Registers N games with the lobby index the way the server does, then times
+one page of the lobby (first page, a page deep into the list, and filtered
+by status and time control) against building the old full listing by walking
+the registry. It also times index updates and how fast a subscriber's deltas
+are produced while games start and end.
+
+    python benchmarks/bench_lobby.py --games 100000
+"""
+
+import argparse
+import os
+import sys
+import time
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+import lobby  # noqa: E402
+
+TIME_CONTROLS = ("1+0", "3+2", "5+0", "10+5", "untimed")
+
+
+class CountingPublisher:
+    def __init__(self):
+        self.messages = 0
+
+    def __call__(self, subscribers, messages, delta=None):
+        self.messages += len(subscribers) * len(messages)
+
+
+def timed(fn, repeat):
+    start = time.perf_counter()
+    for _ in range(repeat):
+        fn()
+    return (time.perf_counter() - start) / repeat
+
+
+def full_listing(games):
+    # What the "S" choice did before the index: walk and format every game
+    text = "Active Games:\n"
+    for gid, g in games.items():
+        text += f"  ID: {gid} - White: {g['white']} vs Black: {g['black']} ({g['status']})\n"
+    return text
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.splitlines()[0])
+    parser.add_argument("--games", type=int, default=100000)
+    parser.add_argument("--subscribers", type=int, default=100)
+    args = parser.parse_args()
+
+    publisher = CountingPublisher()
+    index = lobby.LobbyIndex(publisher)
+    registry = {}
+    start = time.perf_counter()
+    for number in range(args.games):
+        game_id = f"{number:08x}"
+        tc = TIME_CONTROLS[number % len(TIME_CONTROLS)]
+        status = "reconnecting" if number % 50 == 0 else "playing"
+        index.add(game_id, "127.0.0.1:50000", "127.0.0.1:50001", tc, status)
+        registry[game_id] = {"white": "127.0.0.1:50000", "black": "127.0.0.1:50001", "status": status}
+    add_s = time.perf_counter() - start
+    print(f"indexed {args.games} games: {add_s / args.games * 1e6:.2f} us per add")
+
+    first = index.page()
+    middle = lobby.format_cursor(index.entries[f"{args.games // 2:08x}"].key())
+    cases = (
+        ("first page", lambda: index.page()),
+        ("page from the middle", lambda: index.page(after=middle)),
+        ("status=reconnecting", lambda: index.page(status="reconnecting")),
+        ("status=playing tc=5+0", lambda: index.page(status="playing", tc="5+0")),
+    )
+    for label, fn in cases:
+        print(f"{label:<24} {timed(fn, 200) * 1e6:9.1f} us")
+    print(f"{'full listing (before)':<24} {timed(lambda: full_listing(registry), 3) * 1e6:9.1f} us")
+    assert len(first["games"]) == lobby.PAGE_SIZE and first["total"] == args.games
+
+    # Churn with subscribers: one game ends and one starts per step
+    for number in range(args.subscribers):
+        index.subscribers = index.subscribers + (object(),)
+    steps = 10000
+    start = time.perf_counter()
+    for number in range(steps):
+        index.remove(f"{number:08x}")
+        index.add(f"n{number:07x}", "127.0.0.1:50000", "127.0.0.1:50001", "5+0")
+    churn_s = time.perf_counter() - start
+    print(
+        f"churn with {args.subscribers} subscribers: {churn_s / (2 * steps) * 1e6:.2f} us per change, "
+        f"{publisher.messages} deltas queued"
+    )
+
+
+if __name__ == "__main__":
+    main()
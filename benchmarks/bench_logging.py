@@ -0,0 +1,92 @@
+"""Moves per second with logging off, at the default level, and logging every command.
+
+Runs the stress_games.py workload (many concurrent games over protocol v2)
+against a fresh server for each logging setting and reports throughput and
+move latency, plus how many records the server wrote and dropped (read from
+its metrics endpoint). At debug level every command a player sends is
+logged, which used to be a synchronous print() on the move path.
+
+    python benchmarks/bench_logging.py --games 32 --mode threads
+"""
+
+import argparse
+import asyncio
+import os
+import statistics
+import subprocess
+import sys
+import tempfile
+import urllib.request
+
+sys.path.insert(0, os.path.dirname(os.path.abspath(__file__)))
+
+import stress_games  # noqa: E402
+
+SETTINGS = (
+    ("off", ["--log-level", "off"]),
+    ("info", ["--log-level", "info"]),
+    ("debug", ["--log-level", "debug"]),
+    ("debug 1/10", ["--log-level", "debug", "--log-sample", "game=10"]),
+)
+
+
+def scrape(port, names):
+    text = urllib.request.urlopen(f"http://127.0.0.1:{port}/metrics").read().decode()
+    values = {}
+    for line in text.splitlines():
+        name, _, value = line.partition(" ")
+        if name in names:
+            values[name] = float(value)
+    return values
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.splitlines()[0])
+    parser.add_argument("--games", type=int, default=32)
+    parser.add_argument("--rounds", type=int, default=3, help="workload runs per setting")
+    parser.add_argument("--mode", choices=("threads", "asyncio"), default="threads")
+    parser.add_argument("--port", type=int, default=65432)
+    parser.add_argument("--metrics-port", type=int, default=9109)
+    args = parser.parse_args()
+
+    print(f"{'logging':<12} {'plies/s':>9} {'p50 ms':>8} {'p99 ms':>8} {'written':>9} {'dropped':>8}")
+    with tempfile.TemporaryDirectory() as directory:
+        for label, flags in SETTINGS:
+            log_file = os.path.join(directory, label.replace(" ", "_").replace("/", "-") + ".log")
+            server = subprocess.Popen(
+                [
+                    sys.executable, os.path.join(stress_games.ROOT, "chess_server.py"),
+                    "--mode", args.mode, "--port", str(args.port), "--metrics-port", str(args.metrics_port),
+                    "--log-file", log_file, *flags,
+                ],
+                stdout=subprocess.DEVNULL,
+                stderr=subprocess.DEVNULL,
+            )
+            try:
+                stress_games.wait_for_port(args.port)
+                rates = []
+                latencies = []
+                for _ in range(args.rounds):
+                    round_latencies, _, elapsed = asyncio.run(
+                        stress_games.run_level(args.port, args.games)
+                    )
+                    rates.append(len(round_latencies) / elapsed)
+                    latencies.extend(round_latencies)
+                counts = scrape(
+                    args.metrics_port, ("chess_log_records_total", "chess_log_dropped_total")
+                )
+            finally:
+                server.terminate()
+                server.wait()
+            latencies.sort()
+            print(
+                f"{label:<12} {statistics.median(rates):>9.0f} "
+                f"{statistics.median(latencies) * 1000:>8.2f} "
+                f"{latencies[int(len(latencies) * 0.99) - 1] * 1000:>8.2f} "
+                f"{counts.get('chess_log_records_total', 0):>9.0f} "
+                f"{counts.get('chess_log_dropped_total', 0):>8.0f}"
+            )
+
+
+if __name__ == "__main__":
+    main()
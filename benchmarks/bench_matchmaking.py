@@ -0,0 +1,76 @@
+"""Matchmaking throughput under a lobby surge.
+
+Queues a burst of players with normally distributed ratings across all time
+controls, cancels a share of them (as if they disconnected), then runs
+pairing ticks until no more pairs can be made. Reports the cost of each step
+and the pairing rate a single tick sustains.
+
+    python benchmarks/bench_matchmaking.py --players 100000
+"""
+
+import argparse
+import os
+import random
+import sys
+import threading
+import time
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+import matchmaking  # noqa: E402
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.splitlines()[0])
+    parser.add_argument("--players", type=int, default=100000)
+    parser.add_argument("--cancel", type=float, default=0.1, help="share of players who leave")
+    parser.add_argument("--seed", type=int, default=1)
+    args = parser.parse_args()
+
+    rng = random.Random(args.seed)
+    games = []
+    matchmaker = matchmaking.Matchmaker(
+        threading.Lock(), lambda white, black, tc: games.append((white, black))
+    )
+    matchmaker.start = lambda: None  # Ticks are driven by hand below
+
+    start = time.perf_counter()
+    tickets = [
+        matchmaker.enqueue(
+            i,
+            int(rng.gauss(1500, 350)),
+            rng.choice(matchmaking.TIME_CONTROLS),
+        )
+        for i in range(args.players)
+    ]
+    enqueue_s = time.perf_counter() - start
+
+    start = time.perf_counter()
+    for ticket in rng.sample(tickets, int(args.players * args.cancel)):
+        matchmaker.cancel(ticket)
+    cancel_s = time.perf_counter() - start
+    cancelled = int(args.players * args.cancel)
+
+    start = time.perf_counter()
+    first_tick = time.perf_counter()
+    matchmaker.tick()
+    first_tick = time.perf_counter() - first_tick
+    first_games = len(games)
+    # Let the leftovers' spreads widen as if they had waited, one interval per tick
+    now = time.monotonic()
+    ticks = 1
+    while any(pool.size > 1 for pool in matchmaker.pools.values()) and ticks < 100:
+        now += matchmaking.WIDEN_INTERVAL
+        matchmaker.tick(now)
+        ticks += 1
+    pair_s = time.perf_counter() - start
+
+    print(f"players {args.players}, cancelled {cancelled}, games {len(games)}, left waiting {len(matchmaker)}")
+    print(f"enqueue      {enqueue_s / args.players * 1e6:8.2f} us/player")
+    print(f"cancel       {cancel_s / max(cancelled, 1) * 1e6:8.2f} us/player")
+    print(f"first tick   {first_tick * 1000:8.1f} ms, {first_games} games ({first_games * 2 / first_tick:,.0f} players paired/s)")
+    print(f"all {ticks:>3} ticks {pair_s * 1000:7.1f} ms")
+
+
+if __name__ == "__main__":
+    main()
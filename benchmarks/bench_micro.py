@@ -0,0 +1,317 @@
+"""Micro-benchmarks for the server's and the client's hot functions, with JSON baselines.
+
+Cases:
+
+* dispatch: ClientSession.receive() for MOVE (v1 line and v2 frame), CHAT
+  and QUIT commands in a live game, including decoding and the replies
+* move: Position.parse_move() for legal and illegal UCI, and a replayed game
+  through parse_move() + push(), which includes the game-over checks
+* board: board.fen(), board.is_game_over() and the Zobrist hash
+* broadcast: broadcast() to 1 to 1000 recipients over loopback TCP pairs,
+  both the caller's cost and the time until every peer has read the message
+* client: NetworkHandler._receive_until_closed() splitting v1 lines and
+  decoding v2 frames
+
+Each case reports the best of --rounds rounds, in nanoseconds per operation.
+--save writes the results as a JSON baseline; --compare reads one and flags
+every case that got more than --threshold slower, exiting 1 if any did.
+
+    python benchmarks/bench_micro.py --save baseline.json        # on main
+    python benchmarks/bench_micro.py --compare baseline.json     # on a branch
+"""
+
+import argparse
+import datetime
+import json
+import os
+import platform
+import queue
+import random
+import resource
+import socket
+import sys
+import time
+
+ROOT = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+sys.path.insert(0, ROOT)
+sys.path.insert(0, os.path.join(ROOT, "chess_client_gui"))  # The client uses flat imports
+
+import chess  # noqa: E402
+import chess.polyglot  # noqa: E402
+
+import chess_server  # noqa: E402
+import network_handler  # noqa: E402
+import protocol  # noqa: E402
+import termination  # noqa: E402
+from event_log import log  # noqa: E402
+
+MIN_ROUND = 0.05  # Seconds; loops are scaled up until one round takes at least this
+RECIPIENTS = (1, 10, 100, 1000)
+
+
+class FakeConn:
+    """Stands in for a connection: encodes what it is sent, as the real ones do, and drops it."""
+
+    def __init__(self, version=1, features=()):
+        self.protocol_version = version
+        self.features = set(features)
+
+    def send_message(self, message):
+        message.encode(self.protocol_version)
+
+
+class FakeSocket:
+    """Returns prepared chunks from recv(), then EOF."""
+
+    def __init__(self, chunks):
+        self.chunks = iter(chunks)
+
+    def recv(self, size):
+        return next(self.chunks, b"")
+
+
+class SelfTimed:
+    """Wraps a case function that returns the seconds to count, leaving out its setup or cleanup."""
+
+    def __init__(self, fn):
+        self.fn = fn
+
+
+def timed_round(fn, loops):
+    """Seconds for loops calls of fn."""
+    if isinstance(fn, SelfTimed):
+        return sum(fn.fn() for _ in range(loops))
+    start = time.perf_counter()
+    for _ in range(loops):
+        fn()
+    return time.perf_counter() - start
+
+
+def measure(fn, ops, rounds):
+    """Best time per operation, in ns, of fn() doing ops operations per call."""
+    loops = 1
+    while True:
+        elapsed = timed_round(fn, loops)
+        if elapsed >= MIN_ROUND:
+            break
+        loops *= 2 if elapsed * 10 > MIN_ROUND else 10
+    best = elapsed
+    for _ in range(rounds - 1):
+        best = min(best, timed_round(fn, loops))
+    return best / loops / ops * 1e9
+
+
+def random_game(seed, plies):
+    rng = random.Random(seed)
+    board = chess.Board()
+    while not board.is_game_over() and board.ply() < plies:
+        board.push(rng.choice(list(board.legal_moves)))
+    return [move.uci() for move in board.move_stack]
+
+
+def dispatch_cases():
+    # Limits that never bite, so the loop measures dispatch (rate check included), not drops
+    chess_server.RATE_LIMITS = {name: (1e12, 10**9) for name in chess_server.RATE_LIMITS}
+    white = chess_server.ClientSession(FakeConn(), ("127.0.0.1", 50000))
+    black = chess_server.ClientSession(FakeConn(), ("127.0.0.1", 50001))
+    chess_server.start_game(white, black, "5+0")
+    # Black moving on White's turn: parsed, dispatched, locked and refused, leaving the game as it is
+    move_v1 = b"MOVE:e7e5\n"
+    move_v2 = protocol.encode_frame(protocol.MOVE, "e7e5")
+    chat = b"CHAT:good luck, have fun\n"
+
+    def quit_and_rejoin():
+        white.receive(b"QUIT\n")
+        white.closed = white.left = False
+
+    yield "dispatch MOVE v1", lambda: black.receive(move_v1), 1
+    black._negotiate(2, {"delta"})
+    yield "dispatch MOVE v2", lambda: black.receive(move_v2), 1
+    yield "dispatch CHAT", lambda: white.receive(chat), 1
+    yield "dispatch QUIT", quit_and_rejoin, 1
+
+
+def move_cases():
+    moves = random_game(1, 80)
+    midgame = chess.Board()
+    for move in moves[:40]:
+        midgame.push_uci(move)
+    position = termination.Position(midgame.copy())
+    legal = moves[40]
+    illegal = "e1e8"
+
+    def replay():
+        game = termination.Position(chess.Board())
+        color = "white"
+        for move_uci in moves:
+            game.push(game.parse_move(move_uci), color)
+            color = "black" if color == "white" else "white"
+
+    yield "parse_move legal", lambda: position.parse_move(legal), 1
+    yield "parse_move illegal", lambda: position.parse_move(illegal), 1
+    yield f"replay {len(moves)} plies (per ply)", replay, len(moves)
+    yield "board.fen", midgame.fen, 1
+    yield "board.is_game_over", midgame.is_game_over, 1
+    yield "zobrist_hash", lambda: chess.polyglot.zobrist_hash(midgame), 1
+
+
+def tcp_pairs(count):
+    """count connected (server side, client side) loopback TCP socket pairs."""
+    listener = socket.socket()
+    listener.bind(("127.0.0.1", 0))
+    listener.listen(count)
+    pairs = []
+    for _ in range(count):
+        peer = socket.create_connection(listener.getsockname())
+        sock, _ = listener.accept()
+        pairs.append((sock, peer))
+    listener.close()
+    return pairs
+
+
+def broadcast_cases(recipients, wanted):
+    soft, hard = resource.getrlimit(resource.RLIMIT_NOFILE)
+    resource.setrlimit(resource.RLIMIT_NOFILE, (hard, hard))
+    for count in recipients:
+        if not wanted(f"broadcast {count} delivered") and not wanted(f"broadcast {count} call"):
+            continue  # Not worth opening the sockets
+        if 2 * count + 64 > hard:
+            print(f"skipping broadcast to {count}: needs {2 * count} file descriptors")
+            continue
+        pairs = tcp_pairs(count)
+        conns = [chess_server.SocketConnection(sock) for sock, _ in pairs]
+        peers = [peer for _, peer in pairs]
+        game_id = f"bench{count:04d}"
+        # One player; everyone else watches through the spectator fan-out
+        chess_server.active_games = {
+            game_id: {"players": {"white": conns[0], "black": None}, "spectators": tuple(conns[1:])}
+        }
+        message = protocol.chat("White(127.0.0.1:50000): good luck, have fun")
+        size = len(message.encode(1))
+
+        def deliver():
+            chess_server.broadcast(game_id, message)
+            for peer in peers:
+                received = 0
+                while received < size:
+                    received += len(peer.recv(size - received))
+
+        yield f"broadcast {count} delivered", deliver, 1
+        # The caller's cost alone; the peers are drained afterwards so nothing backs up
+        calls = max(1, 1000 // count)
+
+        def call():
+            start = time.perf_counter()
+            for _ in range(calls):
+                chess_server.broadcast(game_id, message)
+            spent = time.perf_counter() - start
+            for peer in peers:
+                received = 0
+                while received < size * calls:
+                    received += len(peer.recv(size * calls - received))
+            return spent
+
+        yield f"broadcast {count} call", SelfTimed(call), calls
+        for conn in conns:
+            conn.close()
+        for peer in peers:
+            peer.close()
+
+
+def client_cases():
+    lines = "\n".join(
+        f"DELTA:{seq} e2e4" if seq % 2 else f"CHAT:White(127.0.0.1:50000): message {seq}"
+        for seq in range(100)
+    )
+    v1_chunks = [lines.encode() + b"\n"] * 10
+    frames = b"".join(
+        protocol.encode_frame(protocol.DELTA, f"{seq} e2e4") if seq % 2
+        else protocol.encode_frame(protocol.CHAT, f"White(127.0.0.1:50000): message {seq}")
+        for seq in range(100)
+    )
+    v2_chunks = [frames[i:i + 4096] for i in range(0, len(frames), 4096)] * 10
+
+    def receive(version, chunks):
+        handler = network_handler.NetworkHandler(queue.SimpleQueue())
+        handler.protocol_version = version
+        handler.client_socket = FakeSocket(chunks)
+        handler._receive_until_closed()
+
+    yield "client receive v1 (per line)", lambda: receive(1, v1_chunks), 1000
+    yield "client receive v2 (per frame)", lambda: receive(2, v2_chunks), 1000
+
+
+def run(args):
+    def wanted(name):
+        return not args.filter or args.filter in name
+
+    results = {}
+    groups = (
+        dispatch_cases(), move_cases(), broadcast_cases(args.recipients, wanted), client_cases()
+    )
+    for group in groups:
+        for name, fn, ops in group:
+            if not wanted(name):
+                continue
+            results[name] = round(measure(fn, ops, args.rounds), 1)
+            print(f"{name:<34} {results[name]:>12.1f} ns")
+    return results
+
+
+def compare(baseline, results, threshold):
+    """Prints each case against the baseline. Returns the names of cases that got slower."""
+    slower = []
+    print(f"\n{'case':<34} {'baseline ns':>12} {'now ns':>12} {'change':>8}")
+    for name, now in results.items():
+        before = baseline.get(name)
+        if before is None:
+            print(f"{name:<34} {'-':>12} {now:>12.1f} {'new':>8}")
+            continue
+        change = now / before - 1
+        flag = ""
+        if change > threshold:
+            slower.append(name)
+            flag = "  SLOWER"
+        print(f"{name:<34} {before:>12.1f} {now:>12.1f} {change:>+8.1%}{flag}")
+    return slower
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.splitlines()[0])
+    parser.add_argument("--rounds", type=int, default=5, help="rounds per case; the best one counts")
+    parser.add_argument("--recipients", type=int, nargs="+", default=list(RECIPIENTS))
+    parser.add_argument("--filter", help="only cases whose name contains this")
+    parser.add_argument("--save", metavar="PATH", help="write the results as a JSON baseline")
+    parser.add_argument("--compare", metavar="PATH", help="compare against a saved baseline")
+    parser.add_argument(
+        "--threshold", type=float, default=0.10, help="slowdown that fails --compare (0.10 is 10%%)"
+    )
+    args = parser.parse_args()
+    log.configure(level="off")
+
+    results = run(args)
+    if args.save:
+        with open(args.save, "w") as f:
+            json.dump(
+                {
+                    "created": datetime.datetime.now().isoformat(timespec="seconds"),
+                    "python": platform.python_version(),
+                    "platform": platform.platform(),
+                    "unit": "ns per operation",
+                    "results": results,
+                },
+                f,
+                indent=2,
+            )
+            f.write("\n")
+    if args.compare:
+        with open(args.compare) as f:
+            baseline = json.load(f)
+        slower = compare(baseline["results"], results, args.threshold)
+        if slower:
+            print(f"\n{len(slower)} cases more than {args.threshold:.0%} slower than {args.compare}")
+            sys.exit(1)
+
+
+if __name__ == "__main__":
+    main()
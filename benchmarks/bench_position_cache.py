@@ -0,0 +1,154 @@
+"""Per-ply cost of the move path with and without the shared position cache.
+
+Plays many seeded games through termination.Position the way the server
+does: parse_move, push, and the FEN for legacy recipients after every ply.
+Each game opens with one of --openings book lines (drawn from a handful of
+first moves, so the lines share their early plies like real openings do) and
+goes on with random moves, up to --plies. "off" gives every game its own
+positions, "on" shares one PositionCache of --budget-mb between all of them.
+Both must agree with python-chess on every FEN and result. The two alternate
+for --repeat rounds and the best round counts, as timings here are noisy.
+
+Also reports the hit rate and, from tracemalloc, what an entry really costs
+against position_cache.ENTRY_BYTES.
+
+    python benchmarks/bench_position_cache.py --games 1000 --budget-mb 4
+"""
+
+import argparse
+import os
+import random
+import sys
+import time
+import tracemalloc
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+import chess  # noqa: E402
+
+import position_cache  # noqa: E402
+import termination  # noqa: E402
+
+BOOK_PLIES = 12
+BUCKETS = ((0, BOOK_PLIES), (BOOK_PLIES, 40), (40, 1000))
+
+
+def book(count, rng):
+    """count opening lines of BOOK_PLIES plies, branching out from a few first moves."""
+    lines = []
+    for _ in range(count):
+        board = chess.Board()
+        line = []
+        for ply in range(BOOK_PLIES):
+            moves = sorted(board.legal_moves, key=chess.Move.uci)
+            # Early plies choose among few moves, so lines share their start
+            move = moves[rng.randrange(min(len(moves), 2 + ply))]
+            board.push(move)
+            line.append(move.uci())
+        lines.append(line)
+    return lines
+
+
+def play(lines, games, plies, seed):
+    """Each game's moves: a book line, then random moves until it ends or reaches plies."""
+    rng = random.Random(seed)
+    result = []
+    for _ in range(games):
+        board = chess.Board()
+        moves = list(rng.choice(lines))
+        for move_uci in moves:
+            board.push_uci(move_uci)
+        while len(moves) < plies and not board.is_game_over():
+            move = rng.choice(list(board.legal_moves))
+            board.push(move)
+            moves.append(move.uci())
+        result.append(moves)
+    return result
+
+
+def run(games, cache):
+    sums = [0.0] * len(BUCKETS)
+    counts = [0] * len(BUCKETS)
+    results = []
+    for moves in games:
+        position = termination.Position(chess.Board(), cache)
+        result = None
+        for ply, move_uci in enumerate(moves):
+            color = "white" if ply % 2 == 0 else "black"
+            start = time.perf_counter()
+            result = position.push(position.parse_move(move_uci), color)
+            fen = position.fen()
+            seconds = time.perf_counter() - start
+            for index, (low, high) in enumerate(BUCKETS):
+                if low <= ply < high:
+                    sums[index] += seconds
+                    counts[index] += 1
+            if result:
+                break
+        results.append((result, fen))
+    return [sums[i] / counts[i] * 1e6 if counts[i] else float("inf") for i in range(len(BUCKETS))], results
+
+
+def entry_bytes(games, budget):
+    """Bytes allocated per cached entry while filling a cache from games."""
+    cache = position_cache.PositionCache(budget)
+    tracemalloc.start()
+    before = tracemalloc.get_traced_memory()[0]
+    run(games, cache)
+    after = tracemalloc.get_traced_memory()[0]
+    tracemalloc.stop()
+    return (after - before) / max(1, len(cache))
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.splitlines()[0])
+    parser.add_argument("--games", type=int, default=500)
+    parser.add_argument("--openings", type=int, default=50)
+    parser.add_argument("--plies", type=int, default=80)
+    parser.add_argument("--budget-mb", type=float, default=4.0)
+    parser.add_argument("--repeat", type=int, default=3)
+    parser.add_argument("--seed", type=int, default=1)
+    args = parser.parse_args()
+    budget = int(args.budget_mb * 2**20)
+
+    games = play(book(args.openings, random.Random(args.seed)), args.games, args.plies, args.seed)
+    expected = []
+    for moves in games:
+        board = chess.Board()
+        for move_uci in moves:
+            board.push_uci(move_uci)
+        expected.append(board.fen())
+    print(f"{args.games} games, {sum(map(len, games))} plies, {args.openings} openings")
+
+    off = on = [float("inf")] * len(BUCKETS)
+    for _ in range(args.repeat):
+        timings, off_results = run(games, None)
+        off = [min(pair) for pair in zip(off, timings)]
+        cache = position_cache.PositionCache(budget)
+        hits, misses, evictions = (
+            position_cache.hits.value(), position_cache.misses.value(), position_cache.evictions.value()
+        )
+        timings, on_results = run(games, cache)
+        on = [min(pair) for pair in zip(on, timings)]
+        hits = position_cache.hits.value() - hits
+        misses = position_cache.misses.value() - misses
+        evictions = position_cache.evictions.value() - evictions
+        if off_results != on_results or [fen for _, fen in on_results] != expected:
+            sys.exit("Cached and uncached play disagree")
+
+    print(f"{'plies':>10} {'off us':>8} {'on us':>8} {'speedup':>8}")
+    for (low, high), before, after in zip(BUCKETS, off, on):
+        if before != float("inf"):
+            print(f"{f'{low}-{high - 1}':>10} {before:>8.1f} {after:>8.1f} {before / after:>7.1f}x")
+    print(
+        f"hit rate {hits / (hits + misses):.1%}, {len(cache)} of {cache.capacity} entries, "
+        f"{evictions} evictions"
+    )
+    print(
+        f"{entry_bytes(games, budget):.0f} bytes per entry measured, "
+        f"{position_cache.ENTRY_BYTES} budgeted"
+    )
+
+
+if __name__ == "__main__":
+    main()
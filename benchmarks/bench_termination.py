@@ -0,0 +1,119 @@
+"""Per-move validation cost: separate python-chess checks vs termination.Position.
+
+Replays seeded random games (long ones, since random play mostly ends by the
+75-move rule or repetition) through both move paths and reports the average
+cost per move by game phase. "before" is the move path as it was: parse and
+check legality, push, then is_checkmate / is_stalemate / insufficient
+material / is_seventyfive_moves / is_fivefold_repetition. "after" is
+Position.parse_move plus Position.push. Both must agree on every result.
+
+    python benchmarks/bench_termination.py --games 20
+"""
+
+import argparse
+import os
+import random
+import sys
+import time
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+import chess  # noqa: E402
+
+import termination  # noqa: E402
+
+MAX_PLIES = 600
+BUCKETS = ((0, 100), (100, 200), (200, 400), (400, MAX_PLIES + 1))
+
+
+def random_game(seed):
+    rng = random.Random(seed)
+    board = chess.Board()
+    moves = []
+    while not board.is_game_over() and len(moves) < MAX_PLIES:
+        move = rng.choice(list(board.legal_moves))
+        board.push(move)
+        moves.append(move.uci())
+    return moves
+
+
+def before(moves):
+    board = chess.Board()
+    timings = []
+    result = None
+    for ply, move_uci in enumerate(moves):
+        color = "white" if ply % 2 == 0 else "black"
+        start = time.perf_counter()
+        move = board.parse_uci(move_uci)
+        if move in board.legal_moves:
+            board.push(move)
+            if board.is_checkmate():
+                result = f"Checkmate! Winner: {color}"
+            elif board.is_stalemate():
+                result = "Stalemate! It's a draw."
+            elif board.is_insufficient_material():
+                result = "Insufficient material! It's a draw."
+            elif board.is_seventyfive_moves():
+                result = "75-move rule! It's a draw."
+            elif board.is_fivefold_repetition():
+                result = "Fivefold repetition! It's a draw."
+        timings.append(time.perf_counter() - start)
+        if result:
+            break
+    return timings, result
+
+
+def after(moves):
+    position = termination.Position(chess.Board())
+    timings = []
+    result = None
+    for ply, move_uci in enumerate(moves):
+        color = "white" if ply % 2 == 0 else "black"
+        start = time.perf_counter()
+        move = position.parse_move(move_uci)
+        if move is not None:
+            result = position.push(move, color)
+        timings.append(time.perf_counter() - start)
+        if result:
+            break
+    return timings, result
+
+
+def bucket_means(all_timings):
+    sums = [0.0] * len(BUCKETS)
+    counts = [0] * len(BUCKETS)
+    for timings in all_timings:
+        for ply, seconds in enumerate(timings):
+            for index, (low, high) in enumerate(BUCKETS):
+                if low <= ply < high:
+                    sums[index] += seconds
+                    counts[index] += 1
+    return [(sums[i] / counts[i] * 1e6) if counts[i] else None for i in range(len(BUCKETS))]
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.splitlines()[0])
+    parser.add_argument("--games", type=int, default=20)
+    parser.add_argument("--seed", type=int, default=1)
+    args = parser.parse_args()
+
+    games = [random_game(args.seed + i) for i in range(args.games)]
+    print(f"{args.games} games, {sum(map(len, games))} plies, longest {max(map(len, games))}")
+    old_timings, new_timings = [], []
+    for moves in games:
+        old, old_result = before(moves)
+        new, new_result = after(moves)
+        if old_result != new_result:
+            sys.exit(f"Results differ: {old_result!r} vs {new_result!r}")
+        old_timings.append(old)
+        new_timings.append(new)
+
+    print(f"{'plies':>10} {'before us':>10} {'after us':>10} {'speedup':>8}")
+    for (low, high), old, new in zip(BUCKETS, bucket_means(old_timings), bucket_means(new_timings)):
+        if old is None:
+            continue
+        print(f"{f'{low}-{high - 1}':>10} {old:>10.1f} {new:>10.1f} {old / new:>7.1f}x")
+
+
+if __name__ == "__main__":
+    main()
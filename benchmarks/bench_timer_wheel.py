@@ -0,0 +1,67 @@
+"""Heartbeat bookkeeping cost as the number of connections grows.
+
+Simulates N connections that each receive traffic every few seconds (every
+receive pushes the connection's deadline) and a server that advances the
+wheel once per tick. Reports the cost of a deadline update and the average
+wheel work per tick. With all clients idle but alive, the per-tick work
+should grow with the number of deadlines that fall due, not with N.
+
+    python benchmarks/bench_timer_wheel.py --connections 1000 10000 100000
+"""
+
+import argparse
+import os
+import random
+import sys
+import time
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+import timer_wheel  # noqa: E402
+
+INTERVAL = 15.0  # Same default as the server's heartbeat interval
+SIMULATED_SECONDS = 60
+
+
+def run(connections, seed):
+    rng = random.Random(seed)
+    wheel = timer_wheel.TimerWheel(tick=1.0)
+    now = wheel.current * wheel.tick
+    for key in range(connections):
+        wheel.schedule(key, now + INTERVAL * rng.random())
+
+    touch_s = 0.0
+    touches = 0
+    advance_s = 0.0
+    expired = 0
+    for _ in range(SIMULATED_SECONDS):
+        now += wheel.tick
+        # A tenth of the connections send something during each second
+        active = rng.sample(range(connections), connections // 10)
+        start = time.perf_counter()
+        for key in active:
+            wheel.schedule(key, now + INTERVAL)
+        touch_s += time.perf_counter() - start
+        touches += len(active)
+        start = time.perf_counter()
+        due = wheel.advance(now)
+        advance_s += time.perf_counter() - start
+        expired += len(due)
+        for key in due:  # Pinged; they answer within the tick
+            wheel.schedule(key, now + INTERVAL)
+    return touch_s / touches * 1e6, advance_s / SIMULATED_SECONDS * 1000, expired / SIMULATED_SECONDS
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.splitlines()[0])
+    parser.add_argument("--connections", type=int, nargs="+", default=[1000, 10000, 100000])
+    parser.add_argument("--seed", type=int, default=1)
+    args = parser.parse_args()
+    print(f"{'connections':>12} {'update us':>10} {'tick ms':>9} {'due/tick':>9}")
+    for connections in args.connections:
+        touch_us, tick_ms, due = run(connections, args.seed)
+        print(f"{connections:>12} {touch_us:>10.2f} {tick_ms:>9.3f} {due:>9.1f}")
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,432 @@
+"""End-to-end load test: bot games and spectators against a fresh server.
+
+Starts chess_server.py, then drives PAIRS pairs of bots and SPECTATORS
+spectators over the real protocol (v2 with move deltas) for DURATION
+seconds. Bots play random legal moves with python-chess, or a scripted
+opening followed by random moves, waiting a random think time (0 to twice
+--think) before each one. A game that is still going after --max-plies is
+abandoned (the bot sends QUIT). Bots and spectators reconnect and start over
+whenever their game ends, so the load stays constant.
+
+Latency is move-to-broadcast: from the moment a bot sends MOVE to the moment
+the opponent (and, separately, a spectator) receives the DELTA for it. All
+clients run in this process, so they share one clock; it also means the
+figures include this process's own scheduling delay, which dominates once
+it is busy (watch its CPU alongside the server's).
+
+The report is JSON, printed and optionally written to --report, with moves
+per second, latency percentiles, games played, connection failures, and the
+server's peak RSS and CPU use (Linux, all worker processes). --max-p99-ms
+and --max-failures make the run exit non-zero when they are exceeded, for
+use as a pre-deploy check.
+
+Bots with little or no think time move faster than the server's
+per-connection rate limits allow; add "--rate-limit all=off --rate-limit
+move=off" to --server-args for those runs.
+
+Clients the server turns away with BUSY (admission control) wait as long as
+it asks and try again. They are reported as connections.busy, not as
+failures.
+
+    python benchmarks/load_test.py --pairs 200 --spectators 400 --duration 30 --think 0.2 \\
+        --server-args "--mode asyncio" --report load.json
+"""
+
+import argparse
+import asyncio
+import json
+import os
+import random
+import shlex
+import subprocess
+import sys
+import time
+
+ROOT = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+sys.path.insert(0, ROOT)
+sys.path.insert(0, os.path.dirname(os.path.abspath(__file__)))
+
+import chess  # noqa: E402
+
+import lobby  # noqa: E402
+import protocol  # noqa: E402
+import stress_games  # noqa: E402
+
+WELCOME = stress_games.WELCOME
+CONNECT_TIMEOUT = 10.0
+SAMPLE_INTERVAL = 0.5  # Seconds between server RSS/CPU samples
+SPECTATOR_IDLE = 3.0  # Seconds without a frame before a spectator moves on
+
+
+class Stats:
+    def __init__(self):
+        self.moves = 0
+        self.games_finished = 0
+        self.games_abandoned = 0
+        self.sent_at = {}  # (game_id, seq) -> perf_counter() when the move was sent
+        self.opponent_latencies = []
+        self.spectator_latencies = []
+        self.connections = 0
+        self.connect_failures = 0
+        self.dropped = 0  # Connections the server closed mid-game
+        self.rejected = 0  # Moves or sessions the server refused
+        self.busy = 0  # BUSY replies: shed by admission control, retried after the given delay
+        self.spectator_misses = 0  # Picked a game that ended before joining
+
+    def failures(self):
+        return self.connect_failures + self.dropped + self.rejected
+
+
+async def connect(host, port, choice, stats):
+    try:
+        reader, writer = await asyncio.wait_for(
+            asyncio.open_connection(host, port), CONNECT_TIMEOUT
+        )
+        await asyncio.wait_for(reader.readuntil(WELCOME), CONNECT_TIMEOUT)
+    except asyncio.IncompleteReadError as e:
+        if e.partial.startswith(b"BUSY:"):
+            await busy(stats, e.partial[5:].decode())
+        else:
+            stats.connect_failures += 1
+        return None, None
+    except (OSError, asyncio.TimeoutError):
+        stats.connect_failures += 1
+        return None, None
+    stats.connections += 1
+    writer.write(choice)
+    return reader, writer
+
+
+async def busy(stats, payload):
+    """Counts a BUSY reply and waits as long as it asked."""
+    stats.busy += 1
+    await asyncio.sleep(float(payload.split(" ", 1)[0]))
+
+
+async def frames(reader, idle=None):
+    """Decoded frames until EOF, or until nothing arrives for idle seconds."""
+    buffer = bytearray()
+    while True:
+        try:
+            data = await asyncio.wait_for(reader.read(65536), idle)
+        except asyncio.TimeoutError:
+            return
+        if not data:
+            return
+        buffer += data
+        while True:
+            frame = protocol.pop_frame(buffer)
+            if frame is None:
+                break
+            yield frame
+
+
+async def bot_game(args, stats, rng, deadline):
+    """Plays one game from matchmaking to game over. Returns False if the connection failed."""
+    reader, writer = await connect(args.host, args.port, b"P v2 delta\n", stats)
+    if reader is None:
+        return False
+    board = chess.Board()
+    color = None
+    game_id = None
+    moving = None  # Task thinking about and sending the next move
+    try:
+        async for opcode, payload in frames(reader):
+            if opcode == protocol.INFO and payload.startswith("You are "):
+                color = chess.WHITE if payload.startswith("You are White") else chess.BLACK
+                game_id = payload.split("Game ID: ", 1)[1].split(".", 1)[0]
+            elif opcode == protocol.SNAPSHOT:
+                board = chess.Board(payload.split(" ", 1)[1])
+            elif opcode == protocol.DELTA:
+                seq, uci = payload.split(" ")[:2]
+                board.push_uci(uci)
+                if board.turn != color:
+                    stats.moves += 1  # Counted once, by the mover
+                else:
+                    sent = stats.sent_at.get((game_id, int(seq)))
+                    if sent is not None:
+                        stats.opponent_latencies.append(time.perf_counter() - sent)
+            elif opcode == protocol.GAME_OVER:
+                stats.games_finished += 1
+                return True
+            elif opcode == protocol.INFO and payload.startswith("Opponent ("):
+                stats.games_abandoned += 1  # The opponent quit at --max-plies
+                return True
+            elif opcode in (protocol.INVALID_MOVE, protocol.ERROR):
+                stats.rejected += 1
+                return False
+            elif opcode == protocol.BUSY:
+                await busy(stats, payload)
+                return True
+            if color is None or board.turn != color or board.is_game_over():
+                continue
+            if moving is not None and not moving.done():
+                continue
+            if time.monotonic() > deadline or board.ply() >= args.max_plies:
+                stats.games_abandoned += 1
+                writer.write(protocol.encode_frame(protocol.QUIT))
+                return True
+            moving = asyncio.create_task(make_move(args, stats, rng, writer, board.copy(), game_id))
+        if time.monotonic() < deadline:
+            stats.dropped += 1
+        return False
+    except (OSError, protocol.ProtocolError):
+        stats.dropped += 1
+        return False
+    finally:
+        if moving is not None:
+            moving.cancel()
+        writer.close()
+
+
+async def make_move(args, stats, rng, writer, board, game_id):
+    if args.think > 0:
+        await asyncio.sleep(rng.uniform(0, 2 * args.think))
+    ply = board.ply()
+    if ply < len(args.script) and chess.Move.from_uci(args.script[ply]) in board.legal_moves:
+        move = args.script[ply]
+    else:
+        move = rng.choice(list(board.legal_moves)).uci()
+    stats.sent_at[(game_id, ply + 1)] = time.perf_counter()
+    writer.write(protocol.encode_frame(protocol.MOVE, move))
+
+
+async def bot(args, stats, seed, deadline):
+    rng = random.Random(seed)
+    while time.monotonic() < deadline:
+        if not await bot_game(args, stats, rng, deadline):
+            await asyncio.sleep(0.1)  # Back off after a failure
+
+
+async def spectate_once(args, stats, rng, deadline):
+    """Watches one game from the lobby until it ends. Returns False if the connection failed."""
+    reader, writer = await connect(args.host, args.port, b"S v2 delta lobby\n", stats)
+    if reader is None:
+        return False
+    game_id = None
+    games = []
+    listed = 0  # GAME lines the current page will have
+    try:
+        # A game whose player quits ends without a GAME_OVER for spectators
+        async for opcode, payload in frames(reader, idle=SPECTATOR_IDLE + 2 * args.think):
+            if opcode == protocol.LOBBY and game_id is None:
+                kind, _, rest = payload.partition(" ")
+                if kind == "PAGE":
+                    games = []
+                    listed = min(int(rest.split(" ")[1]), lobby.PAGE_SIZE)
+                    if not listed:
+                        await asyncio.sleep(0.2)  # No games yet
+                        writer.write(protocol.encode_frame(protocol.TEXT, "LIST"))
+                elif kind == "GAME":
+                    games.append(rest.split(" ", 1)[0])
+                if listed and len(games) == listed:
+                    game_id = rng.choice(games)
+                    writer.write(protocol.encode_frame(protocol.TEXT, game_id))
+            elif opcode == protocol.BUSY:
+                await busy(stats, payload)
+                return True
+            elif opcode == protocol.INFO and payload == "Invalid Game ID.":
+                stats.spectator_misses += 1  # The game ended while we picked it
+                return True
+            elif opcode == protocol.DELTA:
+                sent = stats.sent_at.get((game_id, int(payload.split(" ", 1)[0])))
+                if sent is not None:
+                    stats.spectator_latencies.append(time.perf_counter() - sent)
+            elif opcode == protocol.GAME_OVER:
+                return True
+            if time.monotonic() > deadline:
+                return True
+        if reader.at_eof() and time.monotonic() < deadline:
+            stats.dropped += 1
+            return False
+        return True  # Went quiet
+    except (OSError, protocol.ProtocolError):
+        stats.dropped += 1
+        return False
+    finally:
+        writer.close()
+
+
+async def spectator(args, stats, seed, deadline):
+    rng = random.Random(seed)
+    while time.monotonic() < deadline:
+        if not await spectate_once(args, stats, rng, deadline):
+            await asyncio.sleep(0.1)
+
+
+def server_pids(pid):
+    """The server process and its worker processes."""
+    pids = [pid]
+    for name in os.listdir("/proc"):
+        if name.isdigit():
+            try:
+                with open(f"/proc/{name}/stat") as f:
+                    fields = f.read().rsplit(")", 1)[1].split()
+            except OSError:
+                continue
+            if int(fields[1]) == pid:
+                pids.append(int(name))
+    return pids
+
+
+def sample(pids):
+    """(RSS bytes, CPU seconds) summed over pids, from /proc."""
+    rss = 0
+    cpu = 0.0
+    ticks = os.sysconf("SC_CLK_TCK")
+    for pid in pids:
+        try:
+            with open(f"/proc/{pid}/stat") as f:
+                fields = f.read().rsplit(")", 1)[1].split()
+        except OSError:
+            continue
+        cpu += (int(fields[11]) + int(fields[12])) / ticks  # utime + stime
+        rss += int(fields[21]) * os.sysconf("SC_PAGE_SIZE")
+    return rss, cpu
+
+
+async def monitor(pids, samples, deadline):
+    while time.monotonic() < deadline:
+        samples.append(sample(pids))
+        await asyncio.sleep(SAMPLE_INTERVAL)
+
+
+def percentiles(values):
+    if not values:
+        return None
+    values = sorted(values)
+
+    def at(fraction):
+        return round(values[min(len(values) - 1, int(len(values) * fraction))] * 1000, 3)
+
+    return {
+        "count": len(values),
+        "p50_ms": at(0.50),
+        "p99_ms": at(0.99),
+        "p999_ms": at(0.999),
+        "max_ms": round(values[-1] * 1000, 3),
+    }
+
+
+async def run(args, server_pid):
+    stats = Stats()
+    start = time.monotonic()
+    deadline = start + args.duration
+    tasks = []
+    for index in range(2 * args.pairs):
+        tasks.append(asyncio.create_task(bot(args, stats, args.seed + index, deadline)))
+        if args.ramp:
+            await asyncio.sleep(args.ramp / (2 * args.pairs))
+    for index in range(args.spectators):
+        tasks.append(
+            asyncio.create_task(spectator(args, stats, args.seed + 100000 + index, deadline))
+        )
+    samples = []
+    pids = server_pids(server_pid) if server_pid and os.path.isdir("/proc") else []
+    if pids:
+        tasks.append(asyncio.create_task(monitor(pids, samples, deadline)))
+    before = sample(pids) if pids else None
+    # Bots abandon their games at the deadline; anything still waiting is cancelled
+    await asyncio.wait(tasks, timeout=deadline - time.monotonic() + 1)
+    for task in tasks:
+        task.cancel()
+    elapsed = time.monotonic() - start
+    after = sample(pids) if pids else None
+    server = None
+    if pids:
+        server = {
+            "processes": len(pids),
+            "rss_mb_peak": round(max(rss for rss, _ in samples + [after]) / 2**20, 1),
+            "rss_mb_end": round(after[0] / 2**20, 1),
+            "cpu_seconds": round(after[1] - before[1], 2),
+            "cpu_percent": round((after[1] - before[1]) / elapsed * 100, 1),
+        }
+    return {
+        "config": {
+            "pairs": args.pairs,
+            "spectators": args.spectators,
+            "duration_s": args.duration,
+            "think_s": args.think,
+            "max_plies": args.max_plies,
+            "script": args.script,
+            "server_args": args.server_args,
+        },
+        "elapsed_s": round(elapsed, 2),
+        "moves": stats.moves,
+        "moves_per_s": round(stats.moves / args.duration, 1),
+        "latency": {
+            "opponent": percentiles(stats.opponent_latencies),
+            "spectator": percentiles(stats.spectator_latencies),
+        },
+        "games": {"finished": stats.games_finished, "abandoned": stats.games_abandoned},
+        "connections": {
+            "opened": stats.connections,
+            "connect_failures": stats.connect_failures,
+            "dropped": stats.dropped,
+            "rejected": stats.rejected,
+            "busy": stats.busy,
+            "spectator_misses": stats.spectator_misses,
+        },
+        "failures": stats.failures(),
+        "server": server,
+    }
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.splitlines()[0])
+    parser.add_argument("--pairs", type=int, default=50, help="bot pairs playing at once")
+    parser.add_argument("--spectators", type=int, default=50)
+    parser.add_argument("--duration", type=float, default=20.0, help="seconds")
+    parser.add_argument("--think", type=float, default=0.1, help="mean seconds before each bot move")
+    parser.add_argument("--max-plies", type=int, default=120, help="abandon games longer than this")
+    parser.add_argument(
+        "--script", default="", help="opening played before random moves, e.g. 'e2e4 e7e5 g1f3'"
+    )
+    parser.add_argument("--ramp", type=float, default=2.0, help="seconds over which bots connect")
+    parser.add_argument("--seed", type=int, default=1)
+    parser.add_argument("--host", default="127.0.0.1")
+    parser.add_argument("--port", type=int, default=65432)
+    parser.add_argument(
+        "--server-args", default="", help="extra chess_server.py options, e.g. '--workers 4'"
+    )
+    parser.add_argument("--report", metavar="PATH", help="also write the JSON report here")
+    parser.add_argument("--max-p99-ms", type=float, help="fail if opponent p99 latency is higher")
+    parser.add_argument("--max-failures", type=int, help="fail if more connections fail")
+    args = parser.parse_args()
+    args.script = args.script.split()
+
+    server = subprocess.Popen(
+        [
+            sys.executable, os.path.join(ROOT, "chess_server.py"),
+            "--host", args.host, "--port", str(args.port), "--log-level", "warning",
+            *shlex.split(args.server_args),
+        ],
+        stdout=subprocess.DEVNULL,
+        stderr=subprocess.DEVNULL,
+    )
+    try:
+        stress_games.wait_for_port(args.port)
+        time.sleep(0.5)  # Let workers, if any, start listening too
+        report = asyncio.run(run(args, server.pid))
+    finally:
+        server.terminate()
+        server.wait()
+
+    text = json.dumps(report, indent=2)
+    print(text)
+    if args.report:
+        with open(args.report, "w") as f:
+            f.write(text + "\n")
+    failed = []
+    opponent = report["latency"]["opponent"]
+    if args.max_p99_ms is not None and (opponent is None or opponent["p99_ms"] > args.max_p99_ms):
+        failed.append(f"opponent p99 above {args.max_p99_ms} ms")
+    if args.max_failures is not None and report["failures"] > args.max_failures:
+        failed.append(f"{report['failures']} failures, more than {args.max_failures}")
+    if failed:
+        print("FAILED: " + "; ".join(failed), file=sys.stderr)
+        sys.exit(1)
+
+
+if __name__ == "__main__":
+    main()
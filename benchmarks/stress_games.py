@@ -0,0 +1,182 @@
+"""Stress test: many concurrent games must not slow each other down.
+
+Starts a chess server, then plays GAMES games at once over protocol v2 with
+move deltas. Every game shuffles its knights until fivefold repetition ends
+it (16 plies), so each game also exercises the game-over path. The report
+shows the per-move round trip (mover sends MOVE, mover sees its own DELTA)
+for each level of concurrency. With per-game locking the latency stays
+close to the single-game figure while total throughput rises; with one
+global lock every game would queue behind every other.
+
+The run fails (exit 1) if any game ends wrongly, or if games contend:
+
+* p50 at a level is more than --max-slowdown times (10 by default) the p50
+  of the first --games level. Clients, server and games share the machine's
+  CPUs, so some rise is expected; 64 games on one core come in around 6x.
+* More than --max-contended (5% by default) of the game-lock acquisitions
+  during a level of several games had to wait, read from the server's
+  metrics. Only the two players of a game and its timers share a game's
+  lock, so this stays near zero; with one lock for every game it is about a
+  quarter. This is the check that catches a shared lock even on a single
+  core, where latency alone barely moves.
+
+    python benchmarks/stress_games.py --games 1 8 32 64 --mode threads
+"""
+
+import argparse
+import asyncio
+import os
+import statistics
+import subprocess
+import sys
+import time
+import urllib.request
+
+ROOT = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+sys.path.insert(0, ROOT)
+
+import protocol  # noqa: E402
+
+SHUFFLE = ["g1f3", "g8f6", "f3g1", "f6g8"] * 4  # Fivefold repetition after the last ply
+WELCOME = b"(P) or Spectate (S)? "
+
+
+async def play(port, latencies, outcomes):
+    reader, writer = await asyncio.open_connection("127.0.0.1", port)
+    await reader.readuntil(WELCOME)
+    writer.write(b"P v2 delta\n")
+    buffer = bytearray()
+    color = None
+    sent_at = None
+    try:
+        while True:
+            data = await reader.read(65536)
+            if not data:
+                outcomes.append("disconnected")
+                return
+            buffer += data
+            while True:
+                frame = protocol.pop_frame(buffer)
+                if frame is None:
+                    break
+                opcode, payload = frame
+                ply = None
+                if opcode == protocol.INFO and payload.startswith("You are "):
+                    color = 0 if payload.startswith("You are White") else 1
+                elif opcode == protocol.SNAPSHOT:
+                    ply = int(payload.split(" ", 1)[0])
+                elif opcode == protocol.DELTA:
+                    ply = int(payload.split(" ", 1)[0])
+                    if sent_at is not None and ply % 2 != color:
+                        latencies.append(time.perf_counter() - sent_at)
+                        sent_at = None
+                elif opcode == protocol.GAME_OVER:
+                    outcomes.append(payload)
+                    return
+                elif opcode in (protocol.INVALID_MOVE, protocol.ERROR):
+                    outcomes.append(f"rejected: {payload}")
+                    return
+                if ply is not None and ply < len(SHUFFLE) and ply % 2 == color:
+                    sent_at = time.perf_counter()
+                    writer.write(protocol.encode_frame(protocol.MOVE, SHUFFLE[ply]))
+    finally:
+        writer.close()
+
+
+async def run_level(port, games):
+    latencies = []
+    outcomes = []
+    tasks = []
+    for _ in range(games):
+        # Join pairwise so the server pairs the two clients with each other
+        tasks.append(asyncio.create_task(play(port, latencies, outcomes)))
+        tasks.append(asyncio.create_task(play(port, latencies, outcomes)))
+        await asyncio.sleep(0.005)
+    start = time.perf_counter()
+    await asyncio.gather(*tasks)
+    elapsed = time.perf_counter() - start
+    return latencies, outcomes, elapsed
+
+
+def wait_for_port(port, timeout=10.0):
+    deadline = time.monotonic() + timeout
+    while time.monotonic() < deadline:
+        try:
+            import socket
+
+            socket.create_connection(("127.0.0.1", port), timeout=0.2).close()
+            return
+        except OSError:
+            time.sleep(0.1)
+    raise RuntimeError(f"Server did not start on port {port}")
+
+
+def game_lock_counts(metrics_port):
+    """(acquisitions, contended acquisitions) of game locks so far, from the server's metrics."""
+    text = urllib.request.urlopen(f"http://127.0.0.1:{metrics_port}/metrics").read().decode()
+    counts = {}
+    for line in text.splitlines():
+        name, _, value = line.rpartition(" ")
+        if name in ('chess_lock_acquisitions_total{lock="game"}', 'chess_lock_wait_seconds_count{lock="game"}'):
+            counts[name.partition("{")[0]] = float(value)
+    return counts["chess_lock_acquisitions_total"], counts["chess_lock_wait_seconds_count"]
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.splitlines()[0])
+    parser.add_argument("--games", type=int, nargs="+", default=[1, 8, 32, 64])
+    parser.add_argument("--mode", choices=("threads", "asyncio"), default="threads")
+    parser.add_argument("--port", type=int, default=65432)
+    parser.add_argument("--metrics-port", type=int, default=9110)
+    parser.add_argument(
+        "--max-slowdown", type=float, default=10.0, help="fail if p50 exceeds this multiple of the first level's"
+    )
+    parser.add_argument(
+        "--max-contended", type=float, default=0.05, help="fail if this fraction of game-lock acquisitions waited"
+    )
+    args = parser.parse_args()
+
+    server = subprocess.Popen(
+        [
+            sys.executable, os.path.join(ROOT, "chess_server.py"), "--mode", args.mode,
+            "--port", str(args.port), "--metrics-port", str(args.metrics_port),
+        ],
+        stdout=subprocess.DEVNULL,
+        stderr=subprocess.DEVNULL,
+    )
+    failed = False
+    try:
+        wait_for_port(args.port)
+        print(f"{'games':>6} {'plies/s':>9} {'p50 ms':>8} {'p99 ms':>8} {'slowdown':>9} {'waited':>7}  result")
+        baseline = None
+        for games in args.games:
+            acquired, waited = game_lock_counts(args.metrics_port)
+            latencies, outcomes, elapsed = asyncio.run(run_level(args.port, games))
+            acquired_now, waited_now = game_lock_counts(args.metrics_port)
+            contended = (waited_now - waited) / max(1.0, acquired_now - acquired)
+            expected = "Fivefold repetition! It's a draw."
+            problems = [o for o in outcomes if o != expected]
+            if len(outcomes) != 2 * games:
+                problems.append(f"{2 * games - len(outcomes)} players never finished")
+            latencies.sort()
+            p50 = statistics.median(latencies) * 1000
+            p99 = latencies[int(len(latencies) * 0.99) - 1] * 1000
+            baseline = baseline or p50
+            slowdown = p50 / baseline
+            if slowdown > args.max_slowdown:
+                problems.append(f"p50 {slowdown:.1f}x the {args.games[0]}-game level's")
+            if games > 1 and contended > args.max_contended:
+                problems.append(f"{contended:.0%} of game-lock acquisitions waited")
+            failed |= bool(problems)
+            print(
+                f"{games:>6} {len(latencies) / elapsed:>9.0f} {p50:>8.2f} {p99:>8.2f} {slowdown:>8.1f}x "
+                f"{contended:>7.1%}  " + ("ok" if not problems else f"{len(problems)} bad: {problems[0]}")
+            )
+    finally:
+        server.terminate()
+        server.wait()
+    sys.exit(1 if failed else 0)
+
+
+if __name__ == "__main__":
+    main()
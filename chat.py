@@ -0,0 +1,130 @@
+"""Per-game chat: a ring of recent lines, and coalesced low-priority delivery.
+
+Posting a line does not send anything. The line joins the game's history
+and its pending list, and the game is marked on the ChatFlusher; once per
+FLUSH_INTERVAL the flusher hands each marked game to the server, which sends
+everything pending as one CHAT message per recipient (one frame in v2, the
+lines back to back in v1). A burst of chat therefore costs each recipient
+one write per interval however many lines it carries.
+
+Chat is queued in the connection's low-priority lane (see fanout.Outbox):
+it is written only after the BOARD/TURN/DELTA traffic queued before it, and
+dropped rather than queued for recipients that are already behind.
+
+The history keeps the last HISTORY_SIZE lines, so spectators who join late
+and players who come back after a dropped connection get the conversation so
+far in their join burst.
+"""
+
+import collections
+import threading
+import time
+
+import metrics
+from event_log import log
+
+HISTORY_SIZE = 50  # Lines kept per game for late joiners; also the most one flush carries
+FLUSH_INTERVAL = 0.05  # Seconds pending chat waits to be coalesced
+
+posted = metrics.registry.counter("chess_chat_messages_total", "Chat lines posted by players.")
+flushes = metrics.registry.counter(
+    "chess_chat_flushes_total", "Coalesced chat messages sent, one per game per flush."
+)
+
+
+class ChatRoom:
+    """One game's chat. Caller holds the game's lock."""
+
+    __slots__ = ("history", "pending", "seq", "delivered", "away")
+
+    def __init__(self, size=HISTORY_SIZE):
+        self.history = collections.deque(maxlen=size)  # (seq, line), oldest first
+        self.pending = collections.deque(maxlen=size)  # (sender conn, line, sender's echo)
+        self.seq = 0  # Of the latest line posted
+        self.delivered = 0  # Of the latest line flushed
+        self.away = {}  # Color -> delivered when that player dropped
+
+    def post(self, sender, name, text):
+        """Adds a line from sender. Returns True if the room had nothing pending."""
+        text = text.replace("\n", " ")  # A line is one line, whatever the client framed
+        line = f"{name}: {text}"
+        self.seq += 1
+        self.history.append((self.seq, line))
+        self.pending.append((sender, line, f"You: {text}"))
+        posted.inc()
+        return len(self.pending) == 1
+
+    def take(self):
+        """The pending (sender, line, echo) entries, which now count as delivered."""
+        pending = list(self.pending)
+        self.pending.clear()
+        self.delivered = self.seq
+        return pending
+
+    def replay(self, after=0):
+        """Delivered lines with a seq above ``after``; pending ones still go out with the next flush."""
+        return [line for seq, line in self.history if after < seq <= self.delivered]
+
+    def mark_away(self, color):
+        self.away[color] = self.delivered
+
+    def missed(self, color):
+        """Delivered lines a returning player has not seen."""
+        return self.replay(self.away.pop(color, self.delivered))
+
+
+class ChatFlusher:
+    """Games with pending chat, handed to a callback FLUSH_INTERVAL after the first line."""
+
+    def __init__(self, interval=FLUSH_INTERVAL):
+        self.interval = interval
+        self.dirty = set()
+        self.lock = threading.Lock()
+        self.wake = None  # Called when the first game is marked after a flush
+
+    def mark(self, key):
+        with self.lock:
+            first = not self.dirty
+            self.dirty.add(key)
+        if first and self.wake is not None:
+            self.wake()
+
+    def _fire(self, on_flush):
+        with self.lock:
+            keys, self.dirty = self.dirty, set()
+        for key in keys:
+            try:
+                sent = on_flush(key)
+            except Exception as e:
+                log.error("chat", "flush failed", key=key, error=repr(e))
+            else:
+                if sent:
+                    flushes.inc()
+
+    def run(self, on_flush):
+        """Calls on_flush(key) for marked keys from a daemon thread; it returns True if it sent anything."""
+        marked = threading.Event()
+
+        def loop():
+            while True:
+                marked.wait()
+                marked.clear()
+                time.sleep(self.interval)  # Let the burst build up
+                self._fire(on_flush)
+
+        self.wake = marked.set
+        if self.dirty:
+            marked.set()  # Marked before the flusher ran, e.g. by a hot restart
+        thread = threading.Thread(target=loop, daemon=True)
+        thread.start()
+        return thread
+
+    def run_on_loop(self, loop, on_flush):
+        """Like run(), with a timer on an asyncio event loop."""
+
+        def arm():
+            loop.call_later(self.interval, self._fire, on_flush)
+
+        self.wake = lambda: loop.call_soon_threadsafe(arm)
+        if self.dirty:
+            arm()
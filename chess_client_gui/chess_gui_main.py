@@ -1,6 +1,7 @@
 import tkinter as tk
 from tkinter import scrolledtext, simpledialog, messagebox
 import queue
+import time
 import chess
 import constants
 from gui_board import GuiBoard
@@ -23,6 +24,8 @@ class ChessApp:
         self.is_my_turn = False
         self.game_over = False
         self.last_move_uci_for_board = None  # Store 'e2e4'
+        self.clock = None  # (white s, black s, running color or None) from the last CLOCK
+        self.clock_synced_at = 0.0  # time.monotonic() when it arrived
 
         # --- UI Elements ---
         # Top Info Panel
@@ -61,6 +64,14 @@ class ChessApp:
             fg=constants.TEXT_COLOR,
         )
         self.game_id_label.pack(side=tk.LEFT, padx=5)
+        self.clock_label = tk.Label(
+            self.info_frame,
+            text="",
+            font=constants.FONT_INFO,
+            bg=constants.BACKGROUND_COLOR,
+            fg=constants.TEXT_COLOR,
+        )
+        self.clock_label.pack(side=tk.RIGHT, padx=5)
 
         # Chessboard
         self.gui_board = GuiBoard(
@@ -94,6 +105,7 @@ class ChessApp:
         self.master.protocol("WM_DELETE_WINDOW", self._on_closing_window)
         self._connect_and_init()
         self.process_message_queue()
+        self._tick_clock()
 
     def _connect_and_init(self):
         if self.network_handler.connect(constants.HOST, constants.PORT):
@@ -249,16 +261,18 @@ class ChessApp:
         if command.startswith("Welcome! Play (P) or Spectate (S)?"):
             # This initial prompt could be handled via a simpledialog or a more integrated UI later
             choice = simpledialog.askstring(
-                "Game Choice", command.split("!", 1)[1].strip(), parent=self.master
+                "Game Choice",
+                command.split("!", 1)[1].strip() + " (E plays the computer)",
+                parent=self.master,
             )
-            if choice and choice.upper() in ["P", "S"]:
-                self.network_handler.send_message(choice.upper())
+            if choice and choice.upper() in ["P", "E", "S"]:
+                self.network_handler.send_choice(choice.upper())
                 if choice.upper() == "S":
                     self.player_side = "spectator"
                     self.player_side_label.config(text="Side: Spectator")
                     self.status_label.config(text="Spectating - Choose Game")
             else:
-                self.network_handler.send_message("P")  # Default to Play
+                self.network_handler.send_choice("P")  # Default to Play
                 self.log_message("Defaulted to Play mode.")
 
         elif command.startswith("INFO:You are White."):
@@ -281,6 +295,11 @@ class ChessApp:
             self.status_label.config(text="Game starting!")
             self.log_message(f"You are Black (Game ID: {self.game_id}). Game starting!")
 
+        elif command.startswith("INFO:Resumed game"):
+            # Back after a dropped connection; any missed moves follow
+            self.log_message(command.split("INFO:", 1)[1].strip())
+            self._set_turn_from_board()
+
         elif command.startswith("INFO:Active Games:"):  # For spectator choosing
             self.log_message(command)  # Show the list in chat/log
             spec_game_id = simpledialog.askstring(
@@ -300,28 +319,25 @@ class ChessApp:
             self.last_move_uci_for_board = None  # Clear after using it
 
         elif command.startswith("TURN:"):
-            self.current_server_turn = command.split(":")[1].lower()
-            self.turn_label.config(
-                text=f"Turn: {self.current_server_turn.capitalize()}"
-            )
-            self.is_my_turn = (self.player_side == self.current_server_turn) and (
-                self.player_side != "spectator"
-            )
-
-            if self.game_over:
-                return  # Don't update status if game already flagged as over
-
-            if self.is_my_turn:
-                self.status_label.config(text="Your Turn!")
-                self.master.bell()  # Audible notification
-            elif self.player_side != "spectator":
-                self.status_label.config(
-                    text=f"Opponent's Turn ({self.current_server_turn.capitalize()})"
-                )
-            else:  # Spectator
-                self.status_label.config(
-                    text=f"Live: {self.current_server_turn.capitalize()}'s turn"
-                )
+            self._set_turn(command.split(":")[1].lower())
+
+        elif command.startswith("SNAPSHOT:"):  # e.g. SNAPSHOT:12 <fen>
+            seq, fen = command.split(":", 1)[1].split(" ", 1)
+            if self.gui_board.load_snapshot(int(seq), fen):
+                self._set_turn_from_board()
+
+        elif command.startswith("DELTA:"):  # e.g. DELTA:13 e7e5 [zobrist hex]
+            fields = command.split(":", 1)[1].split()
+            seq, move_uci = int(fields[0]), fields[1]
+            checksum = int(fields[2], 16) if len(fields) > 2 else None
+            mover = "white" if self.gui_board.board_state.turn == chess.WHITE else "black"
+            if self.gui_board.apply_move(seq, move_uci, checksum):
+                self.log_message(f"Move {move_uci} by {mover} was valid.")
+                if not self.gui_board.board_state.is_game_over():
+                    self._set_turn_from_board()
+            else:
+                self.log_message("Board out of sync with server, requesting a resync.")
+                self.network_handler.send_message("RESYNC")
 
         elif (
             command.startswith("INFO:Move ") and " was valid." in command
@@ -335,6 +351,16 @@ class ChessApp:
                 pass  # Failed to parse, no big deal for this particular info
             self.log_message(command.split("INFO:")[1].strip())
 
+        elif command.startswith("CLOCK:"):  # e.g. CLOCK:295000 300000 b
+            white_ms, black_ms, running = command.split(":", 1)[1].split()
+            self.clock = (
+                int(white_ms) / 1000,
+                int(black_ms) / 1000,
+                constants.COLOR_NAMES.get(running),
+            )
+            self.clock_synced_at = time.monotonic()
+            self._draw_clock()
+
         elif command.startswith("INVALID_MOVE:"):
             reason = command.split(":", 1)[1]
             self.log_message(f"Server: {reason}")
@@ -347,9 +373,9 @@ class ChessApp:
                 self.status_label.config(text="Your Turn (Invalid Move). Try again.")
 
         elif command.startswith("CHAT:"):
-            self.log_message(
-                command.split("CHAT:")[1].strip()
-            )  # Server prepends sender info
+            # Server prepends sender info; a v2 frame may carry several lines
+            for line in command.split(":", 1)[1].split("\n"):
+                self.log_message(line.strip())
 
         elif command.startswith("GAME_OVER:"):
             result = command.split(":", 1)[1]
@@ -359,8 +385,16 @@ class ChessApp:
             self.turn_label.config(text="-")
             self.game_over = True
             self.is_my_turn = False
+            if self.clock:
+                self._draw_clock()
+                self.clock = self.clock[:2] + (None,)  # Stop counting down
             messagebox.showinfo("Game Over", result, parent=self.master)
 
+        elif command.startswith("BUSY:"):
+            retry_after, _, reason = command.split(":", 1)[1].partition(" ")
+            self.log_message(f"Server busy: {reason} Try again in {retry_after}s.")
+            self.status_label.config(text="Server busy. Try again later.")
+
         elif command.startswith("INFO:"):  # Catch-all for other info
             self.log_message(command.split("INFO:", 1)[1].strip())
             if "Opponent disconnected" in command:
@@ -371,6 +405,50 @@ class ChessApp:
             elif "Spectating Game ID" in command:
                 self.status_label.config(text=command.split("INFO:", 1)[1].strip())
 
+    def _set_turn_from_board(self):
+        self._set_turn(
+            "white" if self.gui_board.board_state.turn == chess.WHITE else "black"
+        )
+
+    def _set_turn(self, turn):
+        self.current_server_turn = turn
+        self.turn_label.config(text=f"Turn: {self.current_server_turn.capitalize()}")
+        self.is_my_turn = (self.player_side == self.current_server_turn) and (
+            self.player_side != "spectator"
+        )
+
+        if self.game_over:
+            return  # Don't update status if game already flagged as over
+
+        if self.is_my_turn:
+            self.status_label.config(text="Your Turn!")
+            self.master.bell()  # Audible notification
+        elif self.player_side != "spectator":
+            self.status_label.config(
+                text=f"Opponent's Turn ({self.current_server_turn.capitalize()})"
+            )
+        else:  # Spectator
+            self.status_label.config(
+                text=f"Live: {self.current_server_turn.capitalize()}'s turn"
+            )
+
+    def _tick_clock(self):
+        # The server only sends the clock when it changes hands; count down locally in between
+        if self.clock and self.clock[2]:
+            self._draw_clock()
+        self.master.after(constants.CLOCK_REFRESH_MS, self._tick_clock)
+
+    def _draw_clock(self):
+        white, black, running = self.clock
+        elapsed = time.monotonic() - self.clock_synced_at
+        if running == "white":
+            white = max(0.0, white - elapsed)
+        elif running == "black":
+            black = max(0.0, black - elapsed)
+        self.clock_label.config(
+            text=f"White {format_clock(white)}  Black {format_clock(black)}"
+        )
+
     def log_message(self, message):
         self.log_text_area.config(state=tk.NORMAL)
         self.log_text_area.insert(tk.END, message + "\n")
@@ -407,6 +485,14 @@ class ChessApp:
             self.master.destroy()
 
 
+def format_clock(seconds):
+    """m:ss, with tenths under ten seconds."""
+    if seconds < 10:
+        return f"0:{seconds:04.1f}"
+    minutes, seconds = divmod(int(seconds), 60)
+    return f"{minutes}:{seconds:02d}"
+
+
 if __name__ == "__main__":
     root = tk.Tk()
     app = ChessApp(root)
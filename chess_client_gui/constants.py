@@ -5,6 +5,46 @@ import chess
 HOST = "127.0.0.1"
 PORT = 65432
 
+# --- Protocol ---
+PROTOCOL_VERSION = 2  # Highest wire protocol version this client speaks
+# Version 2 frame opcodes (keep in sync with the server's protocol.py)
+OP_TEXT = 0x00
+OP_MOVE = 0x04
+OP_CHAT = 0x05
+OP_QUIT = 0x0A
+OP_PING = 0x0D
+OP_PONG = 0x0E
+OPCODE_NAMES = {
+    0x01: "INFO",
+    0x02: "BOARD",
+    0x03: "TURN",
+    0x04: "MOVE",
+    0x05: "CHAT",
+    0x06: "GAME_OVER",
+    0x07: "INVALID_MOVE",
+    0x08: "YOUR_TURN",
+    0x09: "ERROR",
+    0x0A: "QUIT",
+    0x0B: "SNAPSHOT",
+    0x0C: "DELTA",
+    0x0D: "PING",
+    0x0E: "PONG",
+    0x0F: "LOBBY",
+    0x10: "CLOCK",
+    0x11: "BUSY",
+}
+# Optional features requested with protocol v2: move deltas instead of full
+# boards, heartbeats (the network handler answers the server's pings), and
+# resumable sessions (the network handler reconnects after a dropped connection)
+PROTOCOL_FEATURES = ("delta", "hb", "resume")
+RECONNECT_FIRST_DELAY = 0.5  # Seconds before the first reconnect attempt; doubles each time
+RECONNECT_MAX_DELAY = 15.0
+RECONNECT_ATTEMPTS = 8
+COLOR_NAMES = {"w": "white", "b": "black"}
+TIME_CONTROL = None  # e.g. "5+0" to be matched for a game with clocks; None plays untimed
+ENGINE_DEPTH = None  # Search depth of the computer opponent, 1 to 8; None leaves it to the server
+CLOCK_REFRESH_MS = 100  # How often the running clock is redrawn between server updates
+
 # --- GUI Constants ---
 SQUARE_SIZE = 60
 BOARD_SIZE_PX = 8 * SQUARE_SIZE
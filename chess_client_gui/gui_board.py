@@ -1,6 +1,7 @@
 import tkinter as tk
 from PIL import Image, ImageTk
 import chess
+import chess.polyglot
 import constants
 
 
@@ -16,6 +17,7 @@ class GuiBoard(tk.Canvas):
             main_app_callback  # To send move/click info to main app
         )
         self.board_state = chess.Board()  # Internal python-chess board
+        self.seq = 0  # Moves applied since the start of the game (delta stream)
         self.player_color_perspective = chess.WHITE  # Default, can be changed
         self.selected_square_uci = None  # e.g., "e2"
         self.legal_moves_for_selected = []  # List of UCI strings for to-squares
@@ -55,6 +57,36 @@ class GuiBoard(tk.Canvas):
         except ValueError:
             print(f"Error: Invalid FEN received: {fen}")
 
+    def load_snapshot(self, seq, fen):
+        """Replaces the position with a server snapshot taken after ``seq`` moves."""
+        try:
+            self.board_state = chess.Board(fen)
+        except ValueError:
+            print(f"Error: Invalid FEN received: {fen}")
+            return False
+        self.seq = seq
+        self.last_move_squares = []
+        self.draw_board_and_pieces()
+        return True
+
+    def apply_move(self, seq, move_uci, checksum=None):
+        """Plays one move from the delta stream. Returns False if the board is out of sync."""
+        if seq != self.seq + 1:
+            return False
+        try:
+            move = chess.Move.from_uci(move_uci)
+        except ValueError:
+            return False
+        if move not in self.board_state.legal_moves:
+            return False
+        self.board_state.push(move)
+        self.seq = seq
+        if checksum is not None and chess.polyglot.zobrist_hash(self.board_state) != checksum:
+            return False
+        self.last_move_squares = [move.from_square, move.to_square]
+        self.draw_board_and_pieces()
+        return True
+
     def set_player_perspective(self, color_is_white):
         self.player_color_perspective = chess.WHITE if color_is_white else chess.BLACK
         self.draw_board_and_pieces()  # Redraw if perspective changes
@@ -1,5 +1,58 @@
+import random
 import socket
 import threading
+import constants
+
+
+def encode_frame(opcode, payload=""):
+    """Builds a protocol v2 frame: opcode, varint payload length, UTF-8 payload."""
+    data = payload.encode()
+    length = len(data)
+    header = bytearray((opcode,))
+    while True:
+        byte = length & 0x7F
+        length >>= 7
+        if length:
+            header.append(byte | 0x80)
+        else:
+            header.append(byte)
+            break
+    return bytes(header) + data
+
+
+def pop_frame(buffer):
+    """Removes and returns (opcode, payload) from the front of buffer, or None if incomplete."""
+    length = 0
+    shift = 0
+    pos = 1
+    while True:
+        if pos >= len(buffer):
+            return None
+        byte = buffer[pos]
+        length |= (byte & 0x7F) << shift
+        pos += 1
+        if not byte & 0x80:
+            break
+        shift += 7
+    end = pos + length
+    if len(buffer) < end:
+        return None
+    opcode = buffer[0]
+    payload = bytes(buffer[pos:end]).decode(errors="replace")
+    del buffer[:end]
+    return opcode, payload
+
+
+def frame_to_line(opcode, payload):
+    """Translates a v2 frame into the text line the GUI already understands."""
+    if opcode == constants.OP_TEXT:
+        return payload
+    if opcode == 0x03:  # TURN
+        return f"TURN:{constants.COLOR_NAMES.get(payload, payload)}"
+    if opcode == constants.OP_MOVE:  # Accepted move: "<uci> <w|b>"
+        move_uci, color = payload.split(" ", 1)
+        return f"INFO:Move {move_uci} by {constants.COLOR_NAMES.get(color, color)} was valid."
+    return f"{constants.OPCODE_NAMES.get(opcode, 'INFO')}:{payload}"
 
 
 class NetworkHandler:
@@ -8,13 +61,25 @@ class NetworkHandler:
         self.receive_thread = None
         self.stop_threads = False
         self.message_queue = message_queue  # Queue to send messages to the GUI thread
+        self.protocol_version = 1  # Switches to 2 once negotiated in send_choice
+        self.server_versions = (1,)  # Filled in from the server's HELLO line
+        self.server_address = None
+        self.resume_token = None  # From the game handshake; cleared once the game is over
+        self.last_seq = -1  # Seq of the last SNAPSHOT/DELTA received, sent when resuming
+        self.resuming = False  # Answer the next welcome prompt with a resume request
+        self.stop_event = threading.Event()  # Cuts a reconnect backoff short on close
+        self.retry_after = 0.0  # Seconds a BUSY reply asked us to wait before reconnecting
 
     def connect(self, host, port):
         try:
             self.client_socket = socket.socket(socket.AF_INET, socket.SOCK_STREAM)
             self.client_socket.connect((host, port))
             self.message_queue.put(("LOG", f"Connected to server at {host}:{port}"))
+            self.server_address = (host, port)
             self.stop_threads = False
+            self.stop_event.clear()
+            self.protocol_version = 1
+            self.server_versions = (1,)
             self.receive_thread = threading.Thread(
                 target=self._receive_loop, daemon=True
             )
@@ -30,43 +95,170 @@ class NetworkHandler:
             return False
 
     def _receive_loop(self):
+        while True:
+            reason = self._receive_until_closed()
+            if self.stop_threads:
+                break
+            # A dropped game connection is resumed; anything else ends here
+            if not self.resume_token or not self._reconnect():
+                self.message_queue.put(("DISCONNECTED", reason))
+                break
+
+        if not self.stop_threads:  # If loop exited unexpectedly
+            self.message_queue.put(("LOG", "Receive thread stopped unexpectedly."))
+        else:
+            self.message_queue.put(("LOG", "Receive thread terminated normally."))
+
+    def _receive_until_closed(self):
+        """Reads from the current socket until it closes. Returns why it closed."""
+        frame_buffer = bytearray()  # Partial v2 frames carried between reads
         while not self.stop_threads:
             try:
-                message = self.client_socket.recv(4096).decode()
-                if not message:
-                    self.message_queue.put(("DISCONNECTED", "Received empty message."))
-                    break
+                data = self.client_socket.recv(4096)
+                if not data:
+                    return "Received empty message."
+                if self.protocol_version >= 2:
+                    frame_buffer += data
+                    while True:
+                        frame = pop_frame(frame_buffer)
+                        if frame is None:
+                            break
+                        if frame[0] == constants.OP_PING:
+                            # Heartbeat: answered here, never shown to the GUI
+                            self._send_bytes(encode_frame(constants.OP_PONG, frame[1]))
+                            continue
+                        line = frame_to_line(*frame)
+                        self._track_session(line)
+                        self.message_queue.put(("SERVER_MSG", line))
+                    continue
+                message = data.decode()
                 for line in message.strip().split("\n"):
-                    if line:
+                    if line.startswith("HELLO:"):
+                        self._handle_hello(line)
+                    elif line.startswith("PING:"):
+                        self._send_bytes(("PONG:" + line[5:] + "\n").encode())
+                    elif line.startswith("Welcome!") and self.resuming:
+                        self.resuming = False
+                        self._send_resume()
+                    elif line:
+                        self._track_session(line)
                         self.message_queue.put(("SERVER_MSG", line))
             except ConnectionResetError:
-                self.message_queue.put(("DISCONNECTED", "Connection reset by server."))
-                break
+                return "Connection reset by server."
             except socket.timeout:  # If timeout is set on socket
                 continue
             except socket.error as e:
-                if not self.stop_threads:  # Avoid error if we initiated stop
-                    self.message_queue.put(("DISCONNECTED", f"Socket error: {e}"))
-                break  # Critical error
+                return f"Socket error: {e}"
             except Exception as e:
                 if not self.stop_threads:
                     self.message_queue.put(
                         ("LOG", f"Error receiving data: {e}")
                     )  # Log non-critical
-                # Decide if this should break or continue
-                break
+                return f"Error receiving data: {e}"
+        return "Connection closed."
 
-        if not self.stop_threads:  # If loop exited unexpectedly
-            self.message_queue.put(("LOG", "Receive thread stopped unexpectedly."))
-        else:
-            self.message_queue.put(("LOG", "Receive thread terminated normally."))
+    def _track_session(self, line):
+        """Remembers what a reconnect needs: the resume token and the last move seq."""
+        if line.startswith(("SNAPSHOT:", "DELTA:")):
+            self.last_seq = int(line.split(":", 1)[1].split(" ", 1)[0])
+        elif line.startswith("INFO:You are ") and "Resume token: " in line:
+            self.resume_token = line.split("Resume token: ", 1)[1].rstrip(".")
+            self.last_seq = -1
+        elif line.startswith("GAME_OVER:"):
+            self.resume_token = None  # Nothing left to resume
+        elif line.startswith("BUSY:"):
+            try:
+                self.retry_after = float(line[5:].split(" ", 1)[0])
+            except ValueError:
+                self.retry_after = constants.RECONNECT_MAX_DELAY
+
+    def _reconnect(self):
+        """Reconnects with exponential backoff. Returns False if the server stayed away."""
+        delay = constants.RECONNECT_FIRST_DELAY
+        for attempt in range(1, constants.RECONNECT_ATTEMPTS + 1):
+            wait = delay * random.uniform(0.8, 1.2)  # Jitter, so clients do not return in lockstep
+            wait = max(wait, self.retry_after)  # The server said it was busy
+            self.retry_after = 0.0
+            self.message_queue.put(
+                ("LOG", f"Connection lost. Reconnecting in {wait:.1f}s (attempt {attempt})...")
+            )
+            if self.stop_event.wait(wait):
+                return False  # Closed by the user meanwhile
+            try:
+                new_socket = socket.create_connection(self.server_address, timeout=5)
+                new_socket.settimeout(None)
+            except OSError:
+                delay = min(delay * 2, constants.RECONNECT_MAX_DELAY)
+                continue
+            old_socket, self.client_socket = self.client_socket, new_socket
+            try:
+                old_socket.close()
+            except (OSError, AttributeError):
+                pass
+            self.protocol_version = 1  # The prompt arrives as text again
+            self.server_versions = (1,)
+            self.resuming = True
+            self.message_queue.put(("LOG", "Reconnected, resuming the game..."))
+            return True
+        return False
+
+    def _send_resume(self):
+        options = [f"token={self.resume_token}", f"seq={self.last_seq}"]
+        if constants.PROTOCOL_VERSION >= 2 and 2 in self.server_versions:
+            self.protocol_version = 2
+            options = ["v2", *constants.PROTOCOL_FEATURES] + options
+        self._send_bytes(f"R {' '.join(options)}\n".encode())
+
+    def _handle_hello(self, line):
+        # e.g. HELLO:proto=1,2
+        for field in line.split(":", 1)[1].split(";"):
+            key, _, value = field.partition("=")
+            if key == "proto":
+                self.server_versions = tuple(int(v) for v in value.split(",") if v)
+
+    def send_choice(self, choice):
+        """Answers the lobby prompt, negotiating protocol v2 if the server offers it."""
+        if not self.client_socket or self.stop_threads:
+            return False
+        if constants.PROTOCOL_VERSION >= 2 and 2 in self.server_versions:
+            # Switch before sending so the reply is already parsed as frames
+            self.protocol_version = 2
+            options = ("v2",) + constants.PROTOCOL_FEATURES
+            if choice in ("P", "E") and constants.TIME_CONTROL:
+                options += (f"tc={constants.TIME_CONTROL}",)
+            if choice == "E" and constants.ENGINE_DEPTH:
+                options += (f"depth={constants.ENGINE_DEPTH}",)
+            return self._send_bytes(f"{choice} {' '.join(options)}\n".encode())
+        return self.send_message(choice)
 
     def send_message(self, message):
+        if self.protocol_version >= 2:
+            if message.startswith("MOVE:"):
+                data = encode_frame(constants.OP_MOVE, message.split(":", 1)[1])
+            elif message.startswith("CHAT:"):
+                data = encode_frame(constants.OP_CHAT, message.split(":", 1)[1])
+            elif message == "QUIT":
+                data = encode_frame(constants.OP_QUIT)
+            else:
+                data = encode_frame(constants.OP_TEXT, message)
+        else:
+            data = (message + "\n").encode()  # Newline lets the server split commands
+        return self._send_bytes(data)
+
+    def _send_bytes(self, data):
         if self.client_socket and not self.stop_threads:
             try:
-                self.client_socket.sendall(message.encode())
+                self.client_socket.sendall(data)
                 return True
             except socket.error as e:
+                if self.resume_token:
+                    # Let the receive thread notice the broken connection and resume
+                    self.message_queue.put(("LOG", f"Error sending message: {e}"))
+                    try:
+                        self.client_socket.shutdown(socket.SHUT_RDWR)
+                    except OSError:
+                        pass
+                    return False
                 self.message_queue.put(("DISCONNECTED", f"Error sending message: {e}"))
                 self.close_connection()  # Ensure connection is marked as closed
                 return False
@@ -74,6 +266,7 @@ class NetworkHandler:
 
     def close_connection(self):
         self.stop_threads = True
+        self.stop_event.set()
         if self.client_socket:
             try:
                 # self.client_socket.shutdown(socket.SHUT_RDWR) # More forceful
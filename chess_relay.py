@@ -0,0 +1,316 @@
+"""Spectator relay: fans one upstream subscription per game out to many viewers.
+
+A relay speaks the spectator half of the server protocol on its own port.
+When a viewer picks a game, the relay subscribes to it once upstream (as a
+v2 delta spectator that answers heartbeats) and keeps its own copy of the
+board, so every further viewer of that game is served from the relay without
+touching the origin server. The upstream can be the game server or another
+relay, so relays can be stacked into a tree when one level is not enough.
+"""
+
+import argparse
+import asyncio
+import collections
+import time
+
+import chess
+
+import chat
+import protocol
+import spectators
+import event_log
+import chess_server
+from chess_server import AsyncConnection
+from event_log import log
+from spectators import spectator_fanout
+
+HOST = "0.0.0.0"  # Viewers reach relays from outside, unlike the loopback-only game server
+PORT = 5556
+UPSTREAM = (chess_server.HOST, chess_server.PORT)
+MAX_VIEWERS = 2000  # Viewers served by one relay, across all games
+GAME_LIST_TTL = 1.0  # Seconds a game list fetched from upstream is reused
+RECV_SIZE = 1024
+WELCOME = b"(P) or Spectate (S)? "
+
+feeds = {}  # game_id -> RelayFeed
+viewer_count = 0
+game_list_cache = (0.0, None)  # (fetched at, INFO text or None)
+
+
+async def _open_upstream(choice):
+    """Connects upstream and answers the lobby prompt."""
+    reader, writer = await asyncio.open_connection(*UPSTREAM)
+    await reader.readuntil(WELCOME)  # HELLO line and welcome prompt
+    writer.write(choice)
+    return reader, writer
+
+
+async def fetch_game_list():
+    """Returns the upstream "Active Games" text, or None if nothing is being played."""
+    global game_list_cache
+    fetched_at, text = game_list_cache
+    if time.monotonic() - fetched_at < GAME_LIST_TTL:
+        return text
+    reader, writer = await _open_upstream(b"S\n")
+    try:
+        data = b""
+        while not data.endswith(b": ") and b"No active games" not in data:
+            chunk = await reader.read(65536)
+            if not chunk:
+                break
+            data += chunk
+    finally:
+        writer.close()
+    text = data.decode(errors="replace")
+    text = text.split("INFO:", 1)[1] if text.startswith("INFO:Active Games") else None
+    game_list_cache = (time.monotonic(), text)
+    return text
+
+
+class RelayFeed:
+    """The relay's subscription to one game and the viewers that share it."""
+
+    def __init__(self, game_id):
+        self.game_id = game_id
+        self.board = chess.Board()
+        self.seq = None  # Set by the first SNAPSHOT
+        self.viewers = ()  # Immutable, replaced on join/leave like a game's spectators
+        self.ready = asyncio.Event()
+        self.picked = False
+        self.clock = None  # (white s, black s, running, time.monotonic()) of the last CLOCK
+        self.chat = collections.deque(maxlen=chat.HISTORY_SIZE)  # Recent chat lines for late joiners
+
+    def snapshot_messages(self, conn):
+        fen = self.board.fen()
+        if "delta" in conn.features:
+            messages = [protocol.snapshot(self.seq, fen)]
+        else:
+            turn = "white" if self.board.turn == chess.WHITE else "black"
+            messages = [protocol.board(fen), protocol.turn(turn)]
+        if self.clock is not None:
+            white, black, running, received = self.clock
+            spent = time.monotonic() - received  # The running side's time kept going since
+            if running == "white":
+                white = max(0.0, white - spent)
+            elif running == "black":
+                black = max(0.0, black - spent)
+            messages.append(protocol.clock(white, black, running))
+        return messages
+
+    async def run(self):
+        try:
+            reader, writer = await _open_upstream(b"S v2 delta hb\n")
+        except (OSError, asyncio.IncompleteReadError) as e:
+            log.warning("relay", "could not subscribe", game=self.game_id, error=str(e))
+            self.ready.set()
+            return
+        buffer = bytearray()
+        try:
+            while True:
+                data = await reader.read(65536)
+                if not data:
+                    break
+                buffer += data
+                while True:
+                    frame = protocol.pop_frame(buffer)
+                    if frame is None:
+                        break
+                    if not self._handle_frame(writer, *frame):
+                        return
+        except (OSError, protocol.ProtocolError) as e:
+            log.warning("relay", "upstream failed", game=self.game_id, error=str(e))
+        finally:
+            writer.close()
+            feeds.pop(self.game_id, None)
+            self.ready.set()
+            # Close viewers after the fan-out has delivered what is already published
+            loop = asyncio.get_running_loop()
+            for conn in self.viewers:
+                loop.call_soon(conn.close)
+            log.info("relay", "feed closed", game=self.game_id)
+
+    def _handle_frame(self, writer, opcode, payload):
+        """Applies one upstream frame. Returns False once the subscription is over."""
+        if opcode == protocol.PING:
+            writer.write(protocol.encode_frame(protocol.PONG, payload))
+            return True
+        if not self.picked:
+            if opcode != protocol.INFO or not payload.startswith("Active Games"):
+                return False
+            writer.write(protocol.encode_frame(protocol.TEXT, self.game_id))
+            self.picked = True
+        elif self.seq is None and opcode != protocol.SNAPSHOT:
+            # Only "Spectating Game ID ..." is expected before the snapshot
+            return payload.startswith("Spectating")
+        elif opcode == protocol.SNAPSHOT:
+            seq, fen = payload.split(" ", 1)
+            self.board.set_fen(fen)
+            self.seq = int(seq)
+            self.ready.set()
+            turn = "white" if self.board.turn == chess.WHITE else "black"
+            legacy = [protocol.board(fen), protocol.turn(turn)]
+            spectator_fanout.publish(self.viewers, legacy, protocol.snapshot(self.seq, fen))
+        elif opcode == protocol.DELTA:
+            fields = payload.split(" ")
+            color = "white" if self.board.turn == chess.WHITE else "black"
+            self.board.push_uci(fields[1])
+            self.seq = int(fields[0])
+            legacy = [protocol.board(self.board.fen())]
+            if not self.board.is_game_over():
+                legacy.append(protocol.move_played(fields[1], color))
+                legacy.append(protocol.turn("black" if color == "white" else "white"))
+            # The upstream DELTA (checksum included) is passed on unchanged
+            spectator_fanout.publish(
+                self.viewers, legacy, protocol.Message(protocol.DELTA, payload)
+            )
+        elif opcode == protocol.CHAT:
+            lines = payload.split("\n")
+            self.chat.extend(lines)
+            spectator_fanout.publish(self.viewers, [protocol.chat_lines(lines)], low=True)
+        else:
+            if opcode == protocol.CLOCK:
+                white_ms, black_ms, running = payload.split(" ")
+                running = {"w": "white", "b": "black"}.get(running)
+                self.clock = (int(white_ms) / 1000, int(black_ms) / 1000, running, time.monotonic())
+            # INFO, CLOCK, GAME_OVER, ... are relayed as they are
+            spectator_fanout.publish(self.viewers, [protocol.Message(opcode, payload)])
+            if opcode == protocol.GAME_OVER:
+                return False  # The game is gone upstream; end the subscription
+        return True
+
+
+async def subscribe(game_id):
+    """Returns the live feed for game_id, starting the upstream subscription if needed."""
+    feed = feeds.get(game_id)
+    if feed is None:
+        feed = feeds[game_id] = RelayFeed(game_id)
+        asyncio.create_task(feed.run())
+    await feed.ready.wait()
+    return feed if feeds.get(game_id) is feed else None
+
+
+async def handle_viewer(reader, writer):
+    global viewer_count
+    addr = writer.get_extra_info("peername")
+    conn = AsyncConnection(writer)
+    decoder = protocol.LineDecoder()
+    state = "choice"
+    feed = None
+    counted = False
+    conn.send_message(protocol.hello())
+    conn.send_message(protocol.prompt("Welcome! Play (P) or Spectate (S)? "))
+    try:
+        while True:
+            await writer.drain()
+            data = await reader.read(RECV_SIZE)
+            if not data:
+                break
+            decoder.feed(data)
+            command = decoder.pop()
+            while command is not None and state != "closed":
+                if state == "choice":
+                    choice, options = protocol.parse_choice(command)
+                    conn.protocol_version = protocol.negotiated_version(options)
+                    conn.features = protocol.negotiated_features(options)
+                    if conn.protocol_version >= 2:
+                        decoder = protocol.FrameDecoder(decoder.take_buffer())
+                    if choice != "S":
+                        conn.send_message(
+                            protocol.info("This is a spectator relay; connect to the game server to play.")
+                        )
+                        state = "closed"
+                    elif viewer_count >= MAX_VIEWERS:
+                        conn.send_message(protocol.info("Relay full. Try another relay."))
+                        state = "closed"
+                    else:
+                        games = await fetch_game_list()
+                        if games is None:
+                            conn.send_message(
+                                protocol.info("No active games to spectate. Try again later.")
+                            )
+                            state = "closed"
+                        else:
+                            conn.send_message(protocol.info(games, newline=False))
+                            state = "spectate_pick"
+                elif state == "spectate_pick":
+                    game_id = command.strip()
+                    feed = await subscribe(game_id) if game_id else None
+                    if feed is None:
+                        conn.send_message(protocol.info("Invalid Game ID."))
+                        state = "closed"
+                    elif viewer_count >= MAX_VIEWERS:
+                        conn.send_message(protocol.info("Relay full. Try another relay."))
+                        state = "closed"
+                    else:
+                        viewer_count += 1
+                        counted = True
+                        feed.viewers = spectators.add_spectator(feed.viewers, conn)
+                        conn.outbox.on_overflow = lambda: [
+                            message.encode(conn.protocol_version)
+                            for message in feed.snapshot_messages(conn)
+                        ]
+                        conn.send_message(
+                            protocol.info(f"Spectating Game ID {game_id}. Board updates will follow.")
+                        )
+                        for message in feed.snapshot_messages(conn):
+                            conn.send_message(message)
+                        if feed.chat:
+                            conn.send_message(protocol.chat_lines(feed.chat))
+                        state = "spectating"
+                        log.info("relay", "spectating", addr=addr, game=game_id)
+                elif command.strip().upper() == "RESYNC":
+                    for message in feed.snapshot_messages(conn):
+                        conn.send_message(message)
+                command = decoder.pop() if state != "closed" else None
+            if state == "closed":
+                break
+            await asyncio.sleep(0)
+    except (OSError, protocol.ProtocolError, asyncio.IncompleteReadError) as e:
+        log.warning("relay", "viewer connection failed", addr=addr, error=str(e))
+    finally:
+        if feed is not None and counted:
+            feed.viewers = spectators.remove_spectator(feed.viewers, conn)
+            viewer_count -= 1
+        conn.close()
+
+
+async def serve():
+    spectator_fanout.use_event_loop(asyncio.get_running_loop())
+    server = await asyncio.start_server(handle_viewer, HOST, PORT)
+    log.info("relay", "listening", host=HOST, port=PORT, upstream=f"{UPSTREAM[0]}:{UPSTREAM[1]}")
+    async with server:
+        await server.serve_forever()
+
+
+def parse_args():
+    parser = argparse.ArgumentParser(description="Spectator relay for the chess server.")
+    parser.add_argument(
+        "--upstream",
+        default=f"{UPSTREAM[0]}:{UPSTREAM[1]}",
+        help="host:port of the game server or of another relay",
+    )
+    parser.add_argument("--host", default=HOST, help="address viewers connect to")
+    parser.add_argument("--port", type=int, default=PORT)
+    parser.add_argument(
+        "--max-viewers",
+        type=int,
+        default=MAX_VIEWERS,
+        help="viewers this relay serves before turning new ones away",
+    )
+    parser.add_argument("--log-level", choices=tuple(event_log.LEVELS), default="info")
+    parser.add_argument("--log-file", metavar="PATH", help="write JSON-lines logs to PATH instead of stdout")
+    return parser.parse_args()
+
+
+if __name__ == "__main__":
+    args = parse_args()
+    host, _, port = args.upstream.rpartition(":")
+    UPSTREAM = (host or "127.0.0.1", int(port))
+    HOST = args.host
+    PORT = args.port
+    MAX_VIEWERS = args.max_viewers
+    log.configure(level=args.log_level, path=args.log_file)
+    try:
+        asyncio.run(serve())
+    except KeyboardInterrupt:
+        log.info("relay", "shutting down")
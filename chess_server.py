@@ -1,371 +1,2517 @@
+import admission
+import argparse
+import asyncio
+import chat
+import collections
+import contextlib
+import gc
+import os
+import secrets
+import selectors
 import socket
 import threading
+import time
 import chess
+import chess.polyglot
 import uuid
+import engine
+import event_log
+import fanout
+import game_archive
+import game_clock
+import game_journal
+import hot_restart
+import lobby
+import matchmaking
+import metrics
+import position_cache
+import protocol
+import rate_limit
+import spectators
+import termination
+import timer_wheel
+import worker_cluster
+from event_log import log
+from spectators import spectator_fanout
 
 HOST = "127.0.0.1"  # Standard loopback interface address (localhost)
 PORT = 65432  # Port to listen on
-MAX_SPECTATORS_PER_GAME = 5
+MAX_SPECTATORS_PER_GAME = 500  # Per game on this server; use chess_relay.py for more
+RECV_SIZE = 1024
+HEARTBEAT_INTERVAL = 15.0  # Seconds of silence before a client that speaks "hb" is pinged
+HEARTBEAT_TIMEOUT = 45.0  # Seconds of silence before a connection is considered dead
+RESUME_GRACE = 60.0  # Seconds a game waits for a disconnected "resume" player to come back
+REPLAY_MOVES = 128  # Moves kept per game for replay to resuming players
+JOURNAL_PATH = None  # Write-ahead journal of games in progress (see game_journal.py)
+ARCHIVE_DIR = None  # Where finished games are archived (see game_archive.py)
+METRICS_PORT = None  # Serve Prometheus metrics on this port (see metrics.py)
+LOG_FILE = None  # JSON-lines log file; stdout if None (see event_log.py)
+HANDOFF_PATH = None  # Unix socket a hot restart's successor connects to (see hot_restart.py)
+RATE_LIMITS = rate_limit.DEFAULT_LIMITS  # Per-connection command limits (see rate_limit.py)
+BACKLOG = admission.BACKLOG  # Pending connections the kernel queues for accept()
+ACCEPT_ERROR_PAUSE = 0.1  # Seconds the accept loop backs off after accept() fails
+SETTLE_PASSES = 4  # Event-loop passes from accept() to a session (3) and one spare, before a hot restart
 
-active_games = {}  # Stores game_id: {board, players: {white, black}, spectators, turn}
-waiting_players = []  # Queue for players looking for a game
-lock = (
-    threading.Lock()
-)  # To protect shared resources like waiting_players and active_games
+# Metrics. Updates are per-thread and lock-free, so they stay on in the hot path.
+moves_played = metrics.registry.counter("chess_moves_total", "Moves accepted.")
+move_validation_seconds = metrics.registry.histogram(
+    "chess_move_validation_seconds", "Time to parse, check and apply a move."
+)
+broadcast_seconds = {
+    kind: metrics.registry.histogram(
+        "chess_broadcast_seconds", "Time to queue a broadcast for every recipient.", {"kind": kind}
+    )
+    for kind in ("move", "message")
+}
+outbound_bytes = metrics.registry.counter(
+    "chess_outbound_bytes_total", "Bytes queued for sending to clients."
+)
+outbound_shed = metrics.registry.counter(
+    "chess_outbound_shed_total", "Low-priority messages (chat) dropped for connections that were behind."
+)
+connections_opened = metrics.registry.counter(
+    "chess_connections_opened_total", "Client connections accepted or adopted."
+)
+flags_fallen = metrics.registry.counter(
+    "chess_flag_falls_total", "Timed games lost on time."
+)
+lock_acquired = {
+    name: metrics.registry.counter(
+        "chess_lock_acquisitions_total", "Acquisitions of server locks.", {"lock": name}
+    )
+    for name in ("lobby", "game")
+}
+lock_wait_seconds = {
+    name: metrics.registry.histogram(
+        "chess_lock_wait_seconds", "Time spent waiting for a contended lock.", {"lock": name}
+    )
+    for name in ("lobby", "game")
+}
+
+# Locking: ``lobby_lock`` guards the matchmaker and every change to the
+# registry. The registry itself is copy-on-write, so lookups never lock, and
+# listings come from the lobby index, which has a short lock of its own (see
+# lobby.py). Each game has its own ``game["lock"]`` serializing its board,
+# players and spectators, and the messages broadcast about them, so games never
+# wait on each other. Sending only queues bytes in an outbox (see fanout.py); no lock
+# is ever held across socket I/O. Lock order: lobby_lock, then a game lock,
+# then the lobby index's lock.
+active_games = {}  # Stores game_id: {board, players: {white, black}, spectators, turn, tokens, replay, lock}
+lobby_lock = metrics.TimedLock(lock_wait_seconds["lobby"], lock_acquired["lobby"])
+cluster = None  # WorkerCluster when running as one of several SO_REUSEPORT workers
+heartbeats = timer_wheel.TimerWheel(tick=1.0)  # Silence deadlines of "hb" sessions
+grace_timers = timer_wheel.TimerWheel(tick=1.0)  # (game_id, color) of players away from a game
+clock_flags = game_clock.FlagScheduler()  # game_id of every timed game whose clock is running
+chat_flusher = chat.ChatFlusher()  # game_id of every game with chat waiting to be sent
+admission_control = admission.Admission()  # Replaced from the command line in __main__
+positions = position_cache.PositionCache()  # Shared by every game; replaced from the command line in __main__
+engines = engine.EnginePool()  # Searches for games against the engine; replaced from the command line in __main__
+engine_games = 0  # Games against the engine in the registry, for admission control
+journal = None  # game_journal.Journal when started with --journal
+archive = None  # game_archive.Archive when started with --archive
+metrics_server = None  # The metrics HTTP server when started with --metrics-port
+lobby_index = lobby.LobbyIndex(spectator_fanout.publish)  # What spectators can pick from
+listener = None  # The listening socket, which a hot restart hands on
+input_gate = contextlib.nullcontext()  # hot_restart.Gate around all input in threaded mode with --handoff
+open_connections = set()  # Every live SocketConnection/AsyncConnection, for the metrics
+open_connections_lock = threading.Lock()
+
+
+def new_game_lock():
+    return metrics.TimedLock(lock_wait_seconds["game"], lock_acquired["game"])
+
+
+def track_connection(conn, opened):
+    with open_connections_lock:
+        if opened:
+            open_connections.add(conn)
+        else:
+            open_connections.discard(conn)
+    if opened:
+        connections_opened.inc()
+
+
+def send_queue_depths():
+    """Bytes queued for each live connection, read at scrape time."""
+    with open_connections_lock:
+        conns = list(open_connections)
+    return [len(conn.outbox) for conn in conns]
+
+
+metrics.registry.gauge("chess_connections", "Open client connections.", lambda: len(open_connections))
+metrics.registry.gauge("chess_games", "Games in progress.", lambda: len(active_games))
+metrics.registry.gauge(
+    "chess_spectators",
+    "Spectators watching games on this server.",
+    lambda: sum(len(game["spectators"]) for game in active_games.values()),
+)
+metrics.registry.gauge(
+    "chess_lobby_subscribers", "Clients subscribed to lobby updates.", lambda: len(lobby_index.subscribers)
+)
+metrics.registry.gauge(
+    "chess_matchmaking_queue", "Players waiting for an opponent.", lambda: len(matchmaker)
+)
+metrics.registry.gauge("chess_running_clocks", "Timed games with a clock running.", lambda: len(clock_flags))
+metrics.registry.gauge("chess_engine_games", "Games against the engine.", lambda: engine_games)
+metrics.registry.gauge(
+    "chess_engine_queue", "Engine games waiting for a worker to search their move.", lambda: len(engines.queue)
+)
+metrics.registry.gauge("chess_position_cache_entries", "Positions in the position cache.", lambda: len(positions))
+metrics.registry.gauge(
+    "chess_send_queue_bytes", "Bytes queued for all connections.", lambda: sum(send_queue_depths())
+)
+metrics.registry.gauge(
+    "chess_send_queue_max_bytes",
+    "Bytes queued for the most backlogged connection.",
+    lambda: max(send_queue_depths(), default=0),
+)
+metrics.registry.gauge(
+    "chess_send_queue_backlogged",
+    "Connections with more than 64 KiB queued.",
+    lambda: sum(1 for depth in send_queue_depths() if depth > 64 * 1024),
+)
+
+
+def enable_keepalive(sock):
+    """Lets the kernel detect dead peers of clients that do not speak the heartbeat."""
+    sock.setsockopt(socket.SOL_SOCKET, socket.SO_KEEPALIVE, 1)
+    if hasattr(socket, "TCP_KEEPIDLE"):
+        probes = 3
+        interval = max(1, int((HEARTBEAT_TIMEOUT - HEARTBEAT_INTERVAL) / probes))
+        sock.setsockopt(socket.IPPROTO_TCP, socket.TCP_KEEPIDLE, max(1, int(HEARTBEAT_INTERVAL)))
+        sock.setsockopt(socket.IPPROTO_TCP, socket.TCP_KEEPINTVL, interval)
+        sock.setsockopt(socket.IPPROTO_TCP, socket.TCP_KEEPCNT, probes)
+
+
+def new_resume_token(game_id):
+    # The game ID in front lets any worker route the token to the game's owner
+    return f"{game_id}-{secrets.token_hex(12)}"
 
 
 def generate_game_id():
+    if cluster:
+        # The first two hex digits name the worker that owns the game
+        return cluster.game_id_prefix() + str(uuid.uuid4())[:6]
     return str(uuid.uuid4())[:8]  # Short unique ID
 
 
+def register_game(game_id, game):
+    """Adds a game to the registry. Caller holds ``lobby_lock``."""
+    global active_games, engine_games
+    games = dict(active_games)
+    games[game_id] = game
+    active_games = games  # Readers see either the old or the new dict, never a partial one
+    if "engine" in game:
+        engine_games += 1
+    lobby_index.add(
+        game_id,
+        game_journal.format_addr(game["player_addrs"]["white"]),
+        game_journal.format_addr(game["player_addrs"]["black"]),
+        game["time_control"],
+        lobby_status(game),
+    )
+
+
+def waiting_entry(session):
+    """A queued player's lobby id. It is made from their address, so it survives a hot restart."""
+    return "q-" + game_journal.format_addr(session.addr)
+
+
+def unregister_game(game_id):
+    """Removes a game from the registry, if present. Caller holds ``lobby_lock``."""
+    global active_games, engine_games
+    if game_id in active_games:
+        flush_chat(game_id)  # Lines posted just before the end still go out
+        games = dict(active_games)
+        if "engine" in games.pop(game_id):
+            engine_games -= 1
+            engines.cancel(game_id)
+        active_games = games
+        lobby_index.remove(game_id)
+        clock_flags.cancel(game_id)
+        if journal:
+            journal.game_ended(game_id)
+
+
+def archive_game(game_id, game, result, termination):
+    """Queues a finished game for the archive. Caller holds the game's lock."""
+    if archive:
+        archive.game_finished(
+            game_id,
+            game_journal.format_addr(game["player_addrs"]["white"]),
+            game_journal.format_addr(game["player_addrs"]["black"]),
+            result,
+            termination,
+            game["time_control"],
+            list(game["board"].move_stack),  # The writer thread encodes it
+        )
+
+
+def lobby_status(game):
+    """The game's status in the lobby index (see lobby.STATUS_NAMES)."""
+    if game.get("recovered"):
+        return "recovered"
+    if None in game["players"].values():
+        return "reconnecting"
+    return "playing"
+
+
+def lobby_page(query):
+    """One page of the lobby for a parsed query, from every worker when in a cluster."""
+    page = lobby_index.page(**query)
+    if cluster:
+        page = lobby.merge_pages([page] + cluster.peer_pages(query), query["limit"])
+    return page
+
+
+def snapshot_messages(game, conn):
+    """Messages that bring one connection up to date with the game's current position.
+
+    Caller holds the game's lock.
+    """
+    fen = game["position"].fen()
+    if "delta" in conn.features:
+        return [protocol.snapshot(len(game["board"].move_stack), fen)] + clock_messages(game)
+    return [protocol.board(fen), protocol.turn(game["turn"])] + clock_messages(game)
+
+
+def clock_messages(game):
+    """The game's CLOCK message as a list, empty for untimed games. Caller holds the game's lock."""
+    clock = game.get("clock")
+    if clock is None:
+        return []
+    return [protocol.clock(*clock.times(time.monotonic()))]
+
+
+def probe_lag(conn):
+    """Pings a player whose clock just started, to measure the round trip credited to them."""
+    if conn is not None and "hb" in conn.features:
+        try:
+            conn.send_message(protocol.ping(f"clk{time.monotonic_ns()}"))
+        except ConnectionResetError:
+            pass
+
+
+def chat_history(game):
+    """The game's recent chat as a list of at most one message. Caller holds the game's lock."""
+    room = game.get("chat")
+    lines = room.replay() if room is not None else None
+    return [protocol.chat_lines(lines)] if lines else []
+
+
+def flush_chat(game_id):
+    """Sends a game's pending chat, one low-priority CHAT message per recipient. Returns True if there was any."""
+    game = active_games.get(game_id)
+    if not game:
+        return False
+    with game["lock"]:
+        room = game.get("chat")
+        pending = room.take() if room is not None else None
+        if not pending:
+            return False
+        message = protocol.chat_lines([line for _, line, _ in pending])
+        for player_conn in game["players"].values():
+            if player_conn is None:
+                continue
+            if any(sender is player_conn for sender, _, _ in pending):
+                # The sender sees their own lines as "You: ..."
+                player_conn.send_low(
+                    protocol.chat_lines(
+                        [echo if sender is player_conn else line for sender, line, echo in pending]
+                    )
+                )
+            else:
+                player_conn.send_low(message)
+        spectator_fanout.publish(game["spectators"], [message], low=True)
+    return True
+
+
+def _send_to_players(game, legacy, delta=None, exclude_conn=None):
+    for player_conn in game["players"].values():
+        if player_conn and player_conn != exclude_conn:
+            try:
+                if delta is not None and "delta" in player_conn.features:
+                    player_conn.send_message(delta)
+                else:
+                    for message in legacy:
+                        player_conn.send_message(message)
+            except:  # Handle broken connections
+                pass
+
+
+def broadcast_snapshot(game_id):
+    """Sends the full position to everyone in a game, e.g. when it starts. Caller holds the game's lock."""
+    game = active_games.get(game_id)
+    if not game:
+        return
+    board = game["board"]
+    fen = game["position"].fen()  # Built once for all recipients
+    legacy = [protocol.board(fen), protocol.turn(game["turn"])]
+    snapshot = protocol.snapshot(len(board.move_stack), fen)
+    _send_to_players(game, legacy, snapshot)
+    spectator_fanout.publish(game["spectators"], legacy, snapshot)
+
+
+def broadcast_move(game_id, move_uci, color, game_over=False):
+    """Announces an accepted move: one DELTA for delta subscribers, BOARD/INFO/TURN for everyone else.
+
+    The FEN and the Zobrist checksum are only computed when someone needs them;
+    spectators are served by the spectator fan-out, not by the mover's thread.
+    Caller holds the game's lock, so every recipient sees moves in order.
+    """
+    with broadcast_seconds["move"].time():
+        _broadcast_move(game_id, move_uci, color, game_over)
+
+
+def _broadcast_move(game_id, move_uci, color, game_over):
+    game = active_games.get(game_id)
+    if not game:
+        return
+    board = game["board"]
+    seq = len(board.move_stack)
+    checksum = None
+    if seq % protocol.SYNC_INTERVAL == 0:
+        checksum = chess.polyglot.zobrist_hash(board)
+    delta = protocol.delta(seq, move_uci, checksum)
+    game["replay"].append((seq, delta))  # For players who resume after missing it
+    legacy = []
+    spectators = game["spectators"]
+    needs_legacy = spectators or any(
+        conn and "delta" not in conn.features for conn in game["players"].values()
+    )
+    if needs_legacy:
+        legacy.append(protocol.board(game["position"].fen()))
+        if not game_over:
+            legacy.append(protocol.move_played(move_uci, color))
+            legacy.append(protocol.turn(game["turn"]))
+    _send_to_players(game, legacy, delta)
+    spectator_fanout.publish(spectators, legacy, delta)
+
+
 def broadcast(game_id, message, exclude_conn=None):
-    """Sends a message to all players and spectators in a game, optionally excluding one connection."""
+    """Sends a protocol.Message to all players and spectators in a game, optionally excluding one connection.
+
+    Caller holds the game's lock.
+    """
     game = active_games.get(game_id)
     if not game:
         return
+    start = time.perf_counter()
 
     # Send to players
     for color, player_conn in game["players"].items():
         if player_conn and player_conn != exclude_conn:
             try:
-                player_conn.sendall(message.encode())
+                player_conn.send_message(message)
             except:  # Handle broken connections
                 # Potentially remove player or end game if critical
                 pass
 
-    # Send to spectators
-    for spec_conn in game["spectators"]:
-        if spec_conn != exclude_conn:
+    # Spectators are served by the spectator fan-out
+    watching = game["spectators"]
+    if exclude_conn in watching:
+        watching = spectators.remove_spectator(watching, exclude_conn)
+    spectator_fanout.publish(watching, [message])
+    broadcast_seconds["message"].observe(time.perf_counter() - start)
+
+
+class SocketConnection:
+    """A blocking client socket plus its negotiated protocol version.
+
+    Reads happen on the connection's own thread; writes are queued in an
+    Outbox and drained by the shared fanout.socket_writer thread, so sending
+    never blocks the caller (or whatever lock it holds).
+    """
+
+    def __init__(self, sock):
+        self.sock = sock
+        # The writer already coalesces each burst into one sendmsg; Nagle would
+        # only hold the next burst back until the peer's delayed ACK
+        sock.setsockopt(socket.IPPROTO_TCP, socket.TCP_NODELAY, 1)
+        enable_keepalive(sock)
+        self.protocol_version = 1
+        self.features = set()  # Optional protocol features, e.g. {"delta"}
+        self.outbox = fanout.Outbox()
+        self.aborted = False
+        self.session = None  # The ClientSession it serves
+        track_connection(self, True)
+
+    def send_message(self, message):
+        self.sendall(message.encode(self.protocol_version))
+
+    def sendall(self, data):
+        outbound_bytes.inc(len(data))
+        queued = self.outbox.push(data)
+        fanout.socket_writer.schedule(self)
+        if not queued:
+            raise ConnectionResetError("Connection dropped for falling behind.")
+
+    def send_low(self, message):
+        """Queues a message behind everything else, or sheds it if the connection is behind."""
+        data = message.encode(self.protocol_version)
+        if self.outbox.push_low(data):
+            outbound_bytes.inc(len(data))
+            fanout.socket_writer.schedule(self)
+        else:
+            outbound_shed.inc()
+
+    def recv(self, size):
+        return self.sock.recv(size)
+
+    def wait_readable(self):
+        """Blocks until there is something to read, without reading it."""
+        self.sock.recv(1, socket.MSG_PEEK)
+
+    def unsent(self):
+        """Bytes queued but not yet written."""
+        return self.outbox.queued()
+
+    def unread(self):
+        """Bytes read but not yet given to the session."""
+        return b""  # Every read goes straight to the session
+
+    def fileno(self):
+        return self.sock.fileno()
+
+    def abort(self):
+        """Shuts the socket down so the reading thread notices and cleans up."""
+        if not self.aborted:
+            self.aborted = True
             try:
-                spec_conn.sendall(message.encode())
-            except:  # Handle broken connections
-                # Potentially remove spectator
+                self.sock.shutdown(socket.SHUT_RDWR)
+            except OSError:
                 pass
 
+    def close(self):
+        track_connection(self, False)
+        fanout.socket_writer.close(self)  # Closes once queued data is flushed
 
-def handle_client(conn, addr):
-    print(f"[NEW CONNECTION] {addr} connected.")
-    player_game_id = None
-    player_color = None
-    is_spectator = False
 
-    try:
+class AsyncConnection:
+    """Gives an asyncio stream writer the same surface as SocketConnection.
+
+    Sends are queued and written once per event-loop tick, so a burst of
+    messages becomes a single write; the transport buffer counts towards the
+    outbox high-water mark.
+    """
+
+    def __init__(self, writer, reader=None):
+        self.writer = writer
+        self.reader = reader
+        enable_keepalive(writer.get_extra_info("socket"))
+        self.protocol_version = 1
+        self.features = set()
+        self.outbox = fanout.Outbox(
+            pending_elsewhere=writer.transport.get_write_buffer_size
+        )
+        self.loop = asyncio.get_running_loop()
+        self.loop_thread = threading.get_ident()
+        self.flush_scheduled = False
+        self.session = None
+        track_connection(self, True)
+
+    def send_message(self, message):
+        self.sendall(message.encode(self.protocol_version))
+
+    def sendall(self, data):
+        if self.writer.is_closing():
+            raise ConnectionResetError("Connection is closing.")
+        outbound_bytes.inc(len(data))
+        if not self.outbox.push(data):
+            self.abort()
+            raise ConnectionResetError("Connection dropped for falling behind.")
+        self._schedule_flush()
+
+    def send_low(self, message):
+        """Queues a message behind everything else, or sheds it if the connection is behind."""
+        if self.writer.is_closing():
+            return
+        data = message.encode(self.protocol_version)
+        if not self.outbox.push_low(data):
+            outbound_shed.inc()
+            return
+        outbound_bytes.inc(len(data))
+        self._schedule_flush()
+
+    def _schedule_flush(self):
+        if not self.flush_scheduled:
+            self.flush_scheduled = True
+            if threading.get_ident() == self.loop_thread:
+                self.loop.call_soon(self.flush)
+            else:
+                self.loop.call_soon_threadsafe(self.flush)
+
+    def flush(self):
+        self.flush_scheduled = False
+        chunks = self.outbox.take_all()
+        if chunks and not self.writer.is_closing():
+            self.writer.write(b"".join(chunks))
+
+    def fileno(self):
+        return self.writer.get_extra_info("socket").fileno()
+
+    def unsent(self):
+        """Bytes queued but not yet written, the transport's buffer first."""
+        buffered = getattr(self.writer.transport, "_buffer", b"")  # asyncio has no public accessor
+        if not isinstance(buffered, (bytes, bytearray)):
+            buffered = b"".join(buffered)  # A deque of chunks in newer Pythons
+        return bytes(buffered) + self.outbox.queued()
+
+    def unread(self):
+        """Bytes the stream reader has buffered that the session has not seen yet."""
+        return bytes(getattr(self.reader, "_buffer", b""))
+
+    def abort(self):
+        self.writer.transport.abort()
+
+    def close(self):
+        track_connection(self, False)
+        self.flush()
+        self.writer.close()
+
+
+class EngineSeat:
+    """Takes the engine's place in ``game["players"]``: a connection that sends nowhere.
+
+    The engine's moves come from engine_moved(), not from a session.
+    """
+
+    protocol_version = 2
+    features = frozenset(("delta",))  # So no BOARD/TURN messages are built for it
+    session = None
+
+    def send_message(self, message):
+        pass
+
+    send_low = send_message
+
+    def abort(self):
+        pass
+
+    close = abort
+
+
+engine_seat = EngineSeat()  # One for every engine game
+
+
+class ClientSession:
+    """Lobby, game and spectator state machine for a single client connection.
+
+    The session never reads from the network itself: the threaded and asyncio
+    front ends pass it each chunk they receive and stop once ``closed`` is set.
+    Incoming bytes are split into commands by a protocol decoder, so commands
+    that arrive coalesced or split across reads are handled one at a time.
+    """
+
+    def __init__(self, conn, addr):
+        self.conn = conn
+        self.addr = addr
+        self.game_id = None
+        self.color = None
+        self.is_spectator = False
+        self.state = "choice"  # choice -> spectate_pick -> spectating, or choice -> queued -> playing
+        self.match_params = {}  # key=value options from the choice line, e.g. {"tc": "5+0"}
+        self.ticket = None  # matchmaking.Ticket while queued
+        self.lobby_query = None  # The page query of a lobby subscription
+        self.left = False  # Set when the player quits on purpose, so the game is not held for them
+        self.last_seen = None  # time.monotonic() of the last read, once the client speaks "hb"
+        self.rtt = None  # Smoothed round trip of clock probes, in seconds
+        self.closed = False
+        self.greeted = False  # Set once start() has run, here or before a hot restart
+        self.handed_off = False  # Set once another worker process owns the connection
+        self.decoder = protocol.LineDecoder()
+        self.limiter = rate_limit.Limiter(RATE_LIMITS)
+        conn.session = self
+
+    def send(self, message):
+        self.conn.send_message(message)
+
+    def start(self, handoff=None):
+        """Greets a new client, or resumes one forwarded by another worker."""
+        self.greeted = True
+        if handoff:
+            log.info("cluster", "adopted from another worker", addr=self.addr, role=handoff["role"])
+            self._negotiate(handoff["version"], set(handoff["features"]))
+            self.decoder.feed(handoff["pending"].encode("latin-1"))
+            self.match_params = handoff.get("params", {})
+            if handoff["role"] == "player":
+                self._join_player(route=False)
+            elif handoff["role"] == "resume":
+                self._resume(route=False)
+            else:
+                self.is_spectator = True
+                admission_control.spectator_adopted()
+                self._handle_spectate_pick(handoff["game_id"])
+            self.receive(b"")  # Commands that arrived before the handoff
+            return
+        log.info("conn", "connected", addr=self.addr)
+        self.send(protocol.hello())  # Advertise protocol versions to newer clients
         # Ask if player or spectator
-        conn.sendall("Welcome! Play (P) or Spectate (S)? ".encode())
-        choice = conn.recv(1024).decode().strip().upper()
-
-        with lock:  # Protect access to waiting_players and active_games
-            if choice == "P":
-                if not waiting_players:
-                    # This is the first player for a new game
-                    game_id = generate_game_id()
-                    player_game_id = game_id
-                    player_color = "white"
-
-                    active_games[game_id] = {
-                        "board": chess.Board(),
-                        "players": {"white": conn, "black": None},
-                        "spectators": [],
-                        "turn": "white",
-                        "player_addrs": {"white": addr, "black": None},
-                    }
-                    waiting_players.append(game_id)
-                    conn.sendall(
-                        f"INFO:You are White. Game ID: {game_id}. Waiting for an opponent...\n".encode()
-                    )
-                    print(
-                        f"[GAME {game_id}] Player {addr} is White. Waiting for Black."
-                    )
+        self.send(protocol.prompt("Welcome! Play (P) or Spectate (S)? "))
+
+    def snapshot(self, now):
+        """The session as plain data for a hot restart, with its unhandled input and unsent output."""
+        ticket = self.ticket if self.ticket is not None and self.ticket.active else None
+        return {
+            "addr": list(self.addr),
+            "version": self.conn.protocol_version,
+            "features": sorted(self.conn.features),
+            "greeted": self.greeted,
+            "state": self.state,
+            "game_id": self.game_id,
+            "color": self.color,
+            "spectator": self.is_spectator,
+            "params": self.match_params,
+            "lobby_query": self.lobby_query,
+            "left": self.left,
+            "silent": None if self.last_seen is None else now - self.last_seen,
+            "rtt": self.rtt,
+            "terminated": getattr(self.decoder, "terminated", True),
+            "unread": bytes(self.decoder.buffer) + self.conn.unread(),
+            "unsent": self.conn.unsent(),
+            # Rating, time control and seconds waited so far
+            "ticket": None if ticket is None else [ticket.rating, ticket.time_control, now - ticket.enqueued_at],
+        }
+
+    def restore(self, state, now):
+        """Picks up from snapshot() taken in the process that handed the session over.
+
+        The unsent output and the queue ticket are left to start_restored().
+        """
+        self._negotiate(state["version"], set(state["features"]))
+        self.greeted = state["greeted"]
+        self.state = state["state"]
+        self.game_id = state["game_id"]
+        self.color = state["color"]
+        self.is_spectator = state["spectator"]
+        self.match_params = state["params"]
+        self.lobby_query = state["lobby_query"]
+        self.left = state["left"]
+        self.rtt = state["rtt"]
+        if state["silent"] is not None:
+            self.last_seen = now - state["silent"]
+            heartbeats.schedule(self, self.last_seen + HEARTBEAT_INTERVAL)
+        if isinstance(self.decoder, protocol.LineDecoder):
+            self.decoder.terminated = state["terminated"]
+        self.decoder.feed(state["unread"])
+        if self.state == "spectating":
+            self.conn.outbox.on_overflow = self._lagging_snapshot
+        elif self.lobby_query is not None:
+            self.conn.outbox.on_overflow = self._lagging_page
+
+    def prompt(self):
+        """Prompts the player before the next read if it is their turn."""
+        if self.state != "playing" or self.game_id not in active_games:
+            return
+        game = active_games[self.game_id]
+        if game["players"].get(self.color) == self.conn and game["turn"] == self.color:
+            self.send(protocol.your_turn())  # Prompt client
+
+    def receive(self, data):
+        """Buffers raw bytes from the client and handles every complete command in them."""
+        now = time.monotonic()
+        if self.last_seen is not None:
+            # Any traffic proves the peer is alive; this only updates a stored deadline
+            self.last_seen = now
+            heartbeats.schedule(self, self.last_seen + HEARTBEAT_INTERVAL)
+        self.decoder.feed(data)
+        while not self.closed:
+            command = self.decoder.pop()
+            if command is None:
+                break
+            verdict = self.limiter.check(command, now)
+            if verdict == rate_limit.ALLOWED:
+                self.feed(command)
+            elif verdict == rate_limit.DROPPED:
+                if not self.limiter.dropping:
+                    self._slow_down()
+            else:
+                self._flooded()
+
+    def _slow_down(self):
+        """Tells a client once per streak of dropped commands that it is being rate limited."""
+        self.limiter.dropping = True
+        log.info("conn", "rate limited, dropping commands", addr=self.addr, game=self.game_id)
+        self.send(protocol.info("You are sending too fast; some messages were dropped."))
+
+    def _flooded(self):
+        log.warning("conn", "kept flooding after being limited, disconnecting", addr=self.addr, game=self.game_id)
+        self.send(protocol.error("Too many messages. Disconnecting."))
+        self.left = True  # Not held for resume
+        self.closed = True
+
+    def _lag_measured(self, token):
+        """Credits the round trip of a clock probe to the player's clock."""
+        try:
+            rtt = (time.monotonic_ns() - int(token[3:])) / 1e9
+        except ValueError:
+            return
+        # Smoothed, so one slow probe does not hand out a large credit
+        self.rtt = rtt if self.rtt is None else 0.75 * self.rtt + 0.25 * rtt
+        game = active_games.get(self.game_id)
+        clock = game.get("clock") if game else None
+        if clock is not None and self.color:
+            clock.lag_credit[self.color] = min(max(self.rtt, 0.0), game_clock.MAX_LAG_CREDIT)
+
+    def _negotiate(self, version, features):
+        self.conn.protocol_version = version
+        self.conn.features = features
+        if version >= 2 and not isinstance(self.decoder, protocol.FrameDecoder):
+            # Bytes after the choice line are already framed
+            self.decoder = protocol.FrameDecoder(self.decoder.take_buffer())
+        if "hb" in features and self.last_seen is None:
+            self.last_seen = time.monotonic()
+            heartbeats.schedule(self, self.last_seen + HEARTBEAT_INTERVAL)
+
+    def feed(self, data):
+        """Handles one client command according to the current state."""
+        if data.startswith("PONG"):
+            token = data.partition(":")[2]
+            if token.startswith("clk"):
+                self._lag_measured(token)
+            return  # Otherwise already counted as traffic by receive()
+        if data.startswith("PING"):
+            self.send(protocol.pong(data.partition(":")[2]))
+            return
+        if self.state == "choice":
+            choice, options = protocol.parse_choice(data)
+            self._negotiate(
+                protocol.negotiated_version(options),
+                protocol.negotiated_features(options),
+            )
+            self.match_params = protocol.choice_params(options)
+            self._handle_choice(choice)
+        elif self.state == "spectate_pick":
+            self._handle_lobby_command(data.strip())
+        elif self.state == "spectating":
+            # Spectators just receive; the only thing they may ask for is a fresh snapshot
+            if data.strip().upper() == "RESYNC":
+                self._resync()
+        elif self.state == "queued":
+            self._handle_queued_command(data.strip())
+        elif self.state == "playing":
+            self._handle_game_command(data.strip())
+
+    def _handle_choice(self, choice):
+        reason = admission_control.admit(choice, len(matchmaker), engine_games)
+        if reason is not None:
+            self.send(protocol.busy(admission_control.retry_after(), admission.MESSAGES[reason]))
+            self.closed = True
+            log.info("admission", "busy", addr=self.addr, choice=choice, reason=reason)
+            return
+        if choice == "P":
+            self._join_player()
+        elif choice == "E":
+            self._play_engine()
+        elif choice == "R":
+            self._resume()
+        elif choice == "S":
+            self.is_spectator = True
+            page = lobby_page(lobby.parse_query(self.match_params))
+            if not page["total"] and "lobby" not in self.conn.features:
+                self.send(protocol.info("No active games to spectate. Try again later."))
+                self.closed = True
+                return
+            self._send_page(page)
+            self.state = "spectate_pick"
+        else:
+            self.send(protocol.info("Invalid choice."))
+            self.closed = True
+
+    def _send_page(self, page):
+        """Sends a lobby page as LOBBY lines, or as the "Active Games" text for older clients."""
+        if "lobby" in self.conn.features:
+            for message in lobby.page_messages(page):
+                self.send(message)
+            return
+        games_list_str = "Active Games:\n"
+        for g in page["games"]:
+            status = lobby.STATUS_NAMES.get(g["status"], g["status"])
+            games_list_str += f"  ID: {g['id']} - White: {g['white']} vs Black: {g['black']} ({status})\n"
+        if page["next"]:
+            games_list_str += f"  ({page['total']} games in all; send LIST after={page['next']} for more)\n"
+        games_list_str += "Enter Game ID to spectate: "
+        self.send(protocol.info(games_list_str, newline=False))
+
+    def _handle_lobby_command(self, data):
+        """LIST, SUBSCRIBE or UNSUBSCRIBE while picking a game; anything else is a game ID."""
+        command, options = protocol.parse_choice(data)
+        if command == "LIST":
+            self._send_page(lobby_page(lobby.parse_query(protocol.choice_params(options))))
+        elif command == "SUBSCRIBE":
+            self.lobby_query = lobby.parse_query(protocol.choice_params(options))
+            self.conn.outbox.on_overflow = self._lagging_page
+            lobby_index.subscribe(self.conn, self.lobby_query)
+        elif command == "UNSUBSCRIBE":
+            lobby_index.unsubscribe(self.conn)
+            self.lobby_query = None
+        else:
+            self._handle_spectate_pick(data)
+
+    def _lagging_page(self):
+        """Replaces a lagging lobby subscriber's backlog with a fresh page.
+
+        Deltas still queued behind it carry versions the page already covers,
+        so the client skips them.
+        """
+        if self.lobby_query is None:
+            return None
+        page = lobby_index.page(**self.lobby_query)
+        return [message.encode(self.conn.protocol_version) for message in lobby.page_messages(page)]
+
+    def _join_player(self, route=True):
+        """Queues the player for a game here, or forwards them to the worker where players are waiting."""
+        time_control = matchmaking.parse_time_control(self.match_params.get("tc"))
+        if time_control is None:
+            self.send(
+                protocol.info(
+                    "Unknown time control. Choose one of: "
+                    + ", ".join(matchmaking.TIME_CONTROLS)
+                    + "."
+                )
+            )
+            self.closed = True
+            return
+        if cluster is None:
+            with lobby_lock:
+                self._enqueue(time_control)
+            return
+
+        def join_here():
+            with lobby_lock:
+                self._enqueue(time_control)
+                return matchmaker.unpaired(time_control)
+
+        if not route:
+            cluster.waiting_changed({time_control: join_here()})
+            return
+        owner = cluster.claim_waiting(time_control, join_here)
+        if owner is not None and not self._hand_off(owner, {"role": "player"}):
+            cluster.waiting_changed({time_control: join_here()})  # Peer unreachable, play here instead
+
+    def _play_engine(self):
+        """Starts a game against the engine, e.g. "E v2 delta depth=5 time=2 color=black tc=5+3"."""
+        time_control = matchmaking.parse_time_control(self.match_params.get("tc"))
+        strength = engine.parse_strength(self.match_params, engines.max_seconds)
+        color = self.match_params.get("color", "random")
+        if color == "random":
+            color = secrets.choice(("white", "black"))
+        if time_control is None:
+            reason = "Unknown time control. Choose one of: " + ", ".join(matchmaking.TIME_CONTROLS) + "."
+        elif strength is None:
+            reason = (
+                f"Invalid engine strength. Choose depth=1..{engine.MAX_DEPTH} "
+                f"and/or time= up to {engines.max_seconds:g} seconds."
+            )
+        elif color not in ("white", "black"):
+            reason = "Invalid color. Choose color=white, black or random."
+        else:
+            with lobby_lock:
+                start_engine_game(self, color, time_control, *strength)
+            return
+        self.send(protocol.info(reason))
+        self.closed = True
+
+    def _resume(self, route=True):
+        """Puts a reconnecting player back into their game and replays what they missed.
+
+        The choice line carries the token from the game's handshake and the
+        seq of the last move the client has, e.g. "R v2 delta resume
+        token=<token> seq=14".
+        """
+        token = self.match_params.get("token", "")
+        game_id = token.partition("-")[0]
+        owner = cluster.owner_of(game_id) if cluster and game_id else None
+        if route and owner is not None and owner != cluster.index:
+            if not self._hand_off(owner, {"role": "resume"}):
+                self.send(protocol.info("Could not reach the server hosting that game."))
+                self.closed = True
+            return
+        try:
+            seen = int(self.match_params.get("seq", -1))
+        except ValueError:
+            seen = -1
+        game = active_games.get(game_id)
+        color = None
+        if game:
+            for side, side_token in game["tokens"].items():
+                if secrets.compare_digest(side_token, token):
+                    color = side
+        if color is None:
+            self.send(protocol.game_over("The game session has ended."))
+            self.closed = True
+            return
+        with game["lock"]:
+            if game["finished"]:
+                self.send(protocol.game_over("The game session has ended."))
+                self.closed = True
+                return
+            old_conn = game["players"][color]
+            game["players"][color] = self.conn
+            grace_timers.cancel((game_id, color))
+            self.game_id = game_id
+            self.color = color
+            self.state = "playing"
+            if None not in game["players"].values():
+                game.pop("recovered", None)
+                clock = game.get("clock")
+                if clock is not None and clock.running is None:
+                    clock.start(game["turn"], time.monotonic())  # Paused while this player was away
+                    clock_flags.schedule(game_id, clock.deadline())
+                    broadcast(game_id, protocol.clock(*clock.times(time.monotonic())), exclude_conn=self.conn)
+                request_engine_move(game_id, game)  # A recovered engine game may have the engine to move
+            lobby_index.update(game_id, lobby_status(game))
+            self.send(protocol.info(f"Resumed game {game_id} as {color.capitalize()}."))
+            room = game.get("chat")
+            missed_chat = room.missed(color) if room is not None else []
+            for message in self._missed_messages(game, seen):
+                self.send(message)
+            if missed_chat:
+                self.send(protocol.chat_lines(missed_chat))
+            broadcast(
+                game_id, protocol.info(f"{color.capitalize()} reconnected."), exclude_conn=self.conn
+            )
+        if old_conn is not None:
+            # Still attached, e.g. after a NAT rebinding the old connection has not timed out yet
+            old_conn.abort()
+        log.info("game", "player resumed", game=game_id, addr=self.addr, color=color, seq=seen)
+
+    def _missed_messages(self, game, seen):
+        """The moves after seq ``seen`` from the replay buffer, or a snapshot. Caller holds the game's lock."""
+        seq = len(game["board"].move_stack)
+        replay = game["replay"]
+        if "delta" in self.conn.features and 0 <= seen <= seq:
+            if seen == seq:
+                return clock_messages(game)
+            if replay and replay[0][0] <= seen + 1:
+                missed = [delta for move_seq, delta in replay if move_seq > seen]
+                return missed + clock_messages(game)
+        return snapshot_messages(game, self.conn)
+
+    def _hand_off(self, owner, header):
+        """Passes the client socket to worker ``owner``. Returns False if it could not be reached."""
+        header = dict(
+            header,
+            op="adopt",
+            addr=list(self.addr),
+            version=self.conn.protocol_version,
+            features=sorted(self.conn.features),
+            params=self.match_params,
+            pending=self.decoder.take_buffer().decode("latin-1"),
+        )
+        try:
+            cluster.forward(owner, self.conn, header)
+        except (OSError, ValueError) as e:
+            log.warning("cluster", "handoff failed", addr=self.addr, worker=owner, error=str(e))
+            return False
+        self.handed_off = True
+        self.closed = True
+        return True
+
+    def _enqueue(self, time_control):
+        """Puts the player in the matchmaking queue. Caller holds ``lobby_lock``."""
+        rating = matchmaking.parse_rating(self.match_params.get("rating"))
+        self.state = "queued"
+        self.ticket = matchmaker.enqueue(self, rating, time_control)
+        lobby_index.add(waiting_entry(self), game_journal.format_addr(self.addr), "-", time_control, "waiting")
+        self.send(
+            protocol.info(f"Looking for an opponent ({time_control}, rating {rating})...")
+        )
+        log.info("lobby", "queued", addr=self.addr, tc=time_control, rating=rating)
+
+    def _handle_queued_command(self, data):
+        with lobby_lock:  # The matchmaker may pair the player at any moment
+            paired = self.state == "playing"
+            if not paired and data.upper() == "QUIT":
+                matchmaker.cancel(self.ticket)
+                lobby_index.remove(waiting_entry(self))
+                self.ticket = None
+                self.closed = True
+        if paired:
+            self._handle_game_command(data)
+        elif self.closed:
+            self.send(protocol.info("You have left the queue."))
+        else:
+            self.send(protocol.info("Still looking for an opponent. Send QUIT to leave the queue."))
+
+    def _handle_spectate_pick(self, spec_game_id_choice):
+        owner = cluster.owner_of(spec_game_id_choice) if cluster else None
+        if owner is not None and owner != cluster.index:
+            if not self._hand_off(
+                owner, {"role": "spectator", "game_id": spec_game_id_choice}
+            ):
+                self.send(protocol.info("Could not reach the server hosting that game."))
+                self.closed = True
+            return
+
+        game = active_games.get(spec_game_id_choice)
+        if not game:
+            self.send(protocol.info("Invalid Game ID."))
+            self.closed = True
+            return
+        if self.lobby_query is not None:
+            lobby_index.unsubscribe(self.conn)
+            self.lobby_query = None
+        with game["lock"]:
+            if len(game["spectators"]) >= MAX_SPECTATORS_PER_GAME:
+                joined = False
+            else:
+                joined = True
+                game["spectators"] = spectators.add_spectator(
+                    game["spectators"], self.conn
+                )
+                self.game_id = spec_game_id_choice  # Track which game they are watching
+                self.state = "spectating"
+                self.conn.outbox.on_overflow = self._lagging_snapshot
+                # Queued behind any move already published to the fan-out, so
+                # the snapshot is never followed by a delta it already contains
+                welcome = protocol.info(
+                    f"Spectating Game ID {spec_game_id_choice}. Board updates will follow."
+                )
+                spectator_fanout.publish(
+                    (self.conn,),
+                    [welcome] + snapshot_messages(game, self.conn) + chat_history(game),
+                )
+        if joined:
+            log.info("spectator", "spectating", addr=self.addr, game=spec_game_id_choice)
+        else:
+            self.send(protocol.info("Spectator limit reached for this game."))
+            self.closed = True
+
+    def _handle_game_command(self, data):
+        game_id = self.game_id
+        player_color = self.color
+        game = active_games.get(game_id)
+        if not game or game["finished"]:
+            # Game might have ended and been cleaned up
+            self.send(protocol.info("The game session has ended."))
+            self.closed = True
+            return
+
+        log.debug("game", "received", game=game_id, addr=self.addr, color=player_color, data=data)
+
+        if data.startswith("MOVE:") or data.upper() == "DRAW":
+            with game["lock"]:  # Serializes this game's moves and their broadcasts
+                if data.upper() == "DRAW":
+                    game_over = self._claim_draw(game)
                 else:
-                    # Join an existing waiting game
-                    game_id = waiting_players.pop(0)
-                    player_game_id = game_id
-                    player_color = "black"
+                    game_over = self._play_move(game, data.split(":")[1])
+            if game_over:
+                # Clean up game after it ends
+                with lobby_lock:
+                    unregister_game(game_id)
+                self.closed = True  # End client handler loop
 
-                    game = active_games[game_id]
-                    game["players"]["black"] = conn
-                    game["player_addrs"]["black"] = addr
+        elif data.startswith("CHAT:"):
+            chat_msg = data.split(":", 1)[1]
+            with game["lock"]:
+                room = game.get("chat")
+                if room is None:
+                    room = game["chat"] = chat.ChatRoom()
+                first = room.post(
+                    self.conn, f"{player_color if player_color else 'Spectator'}({self.addr})", chat_msg
+                )
+            if first:
+                chat_flusher.mark(game_id)  # Sent with whatever else arrives within the flush interval
 
-                    conn.sendall(
-                        f"INFO:You are Black. Game ID: {game_id}. Game starting with {game['player_addrs']['white']}!\n".encode()
-                    )
-                    if game["players"]["white"]:
-                        game["players"]["white"].sendall(
-                            f"INFO:Player {addr} (Black) has joined. Game starts!\n".encode()
-                        )
+        elif data.upper() == "RESYNC":
+            self._resync()
 
-                    print(
-                        f"[GAME {game_id}] Player {addr} is Black. Game starts with {game['player_addrs']['white']}."
-                    )
-                    broadcast(game_id, f"BOARD:{game['board'].fen()}\n")
-                    broadcast(game_id, f"TURN:{game['turn']}\n")
-
-            elif choice == "S":
-                is_spectator = True
-                if not active_games:
-                    conn.sendall(
-                        "INFO:No active games to spectate. Try again later.\n".encode()
+        elif data.upper() == "QUIT":
+            self.send(protocol.info("You have quit the game."))
+            self.left = True
+            self.closed = True
+
+        else:
+            # Handle non-turn commands or just ignore
+            if game["turn"] != player_color:
+                self.send(
+                    protocol.info(
+                        "It's not your turn. Type 'CHAT:<your message>' to chat or 'QUIT'."
                     )
-                    return
-
-                games_list_str = "INFO:Active Games:\n"
-                for gid, g_data in active_games.items():
-                    white_player = g_data["player_addrs"]["white"]
-                    black_player = g_data["player_addrs"]["black"]
-                    status = "Waiting for Black" if not black_player else "In Progress"
-                    games_list_str += f"  ID: {gid} - White: {white_player} vs Black: {black_player if black_player else 'N/A'} ({status})\n"
-                games_list_str += "Enter Game ID to spectate: "
-                conn.sendall(games_list_str.encode())
-
-                spec_game_id_choice = conn.recv(1024).decode().strip()
-
-                if spec_game_id_choice in active_games:
-                    game = active_games[spec_game_id_choice]
-                    if len(game["spectators"]) < MAX_SPECTATORS_PER_GAME:
-                        game["spectators"].append(conn)
-                        player_game_id = (
-                            spec_game_id_choice  # Track which game they are watching
-                        )
-                        conn.sendall(
-                            f"INFO:Spectating Game ID {spec_game_id_choice}. Board updates will follow.\n".encode()
-                        )
-                        conn.sendall(f"BOARD:{game['board'].fen()}\n")
-                        conn.sendall(f"TURN:{game['turn']}\n")
-                        print(
-                            f"[SPECTATOR] {addr} is now spectating game {spec_game_id_choice}"
+                )
+
+    def _play_move(self, game, move_uci):
+        """Validates, applies and broadcasts one move. Caller holds the game's lock.
+
+        Returns True if the move ended the game.
+        """
+        game_id = self.game_id
+        player_color = self.color
+        if game["finished"]:
+            self.send(protocol.info("The game session has ended."))
+            return False
+        if game["turn"] != player_color:
+            self.send(protocol.invalid_move("Not your turn."))
+            return False
+        if not game["players"]["white"] or not game["players"]["black"]:
+            self.send(protocol.invalid_move("Opponent not connected yet."))
+            return False
+
+        try:
+            start = time.perf_counter()
+            move = game["position"].parse_move(move_uci)
+            if move is None:
+                self.send(protocol.invalid_move("Illegal move."))
+                return False
+            return play_move(game_id, game, move, player_color, start)
+        except ValueError:  # Invalid UCI
+            self.send(
+                protocol.invalid_move("Invalid move format (use UCI e.g., e2e4).")
+            )
+        except Exception as e:
+            log.error("game", "error processing move", game=game_id, move=move_uci, error=str(e))
+            self.send(protocol.error("Could not process move."))
+        return False
+
+    def _claim_draw(self, game):
+        """Ends the game if the player to move has a claimable draw. Caller holds the game's lock.
+
+        Returns True if the game ended.
+        """
+        if game["finished"] or game["turn"] != self.color:
+            self.send(protocol.info("You can only claim a draw on your turn."))
+            return False
+        reason = game["position"].claimable_draw()
+        if reason is None:
+            self.send(protocol.info("No draw can be claimed in this position."))
+            return False
+        end_game(self.game_id, game, f"Draw claimed by {self.color} ({reason}).")
+        return True
+
+    def _lagging_snapshot(self):
+        """Replaces a lagging spectator's backlog with a fresh snapshot of the game.
+
+        Runs on the fan-out thread under the spectator's outbox lock. Spectators
+        are only ever sent to through the fan-out, so nobody holding the game
+        lock waits on that outbox lock.
+        """
+        game = active_games.get(self.game_id)
+        if not game:
+            return None
+        log.warning("spectator", "fell behind, resending snapshot", addr=self.addr, game=self.game_id)
+        with game["lock"]:
+            messages = snapshot_messages(game, self.conn)
+        return [message.encode(self.conn.protocol_version) for message in messages]
+
+    def _resync(self):
+        """Resends the full position after the client reported a desync."""
+        game = active_games.get(self.game_id)
+        if not game:
+            return
+        with game["lock"]:
+            messages = snapshot_messages(game, self.conn)
+            if self.is_spectator:
+                # Keeps the snapshot in order with the moves already queued for them
+                spectator_fanout.publish((self.conn,), messages)
+                return
+            for message in messages:
+                self.send(message)
+
+    def disconnected(self):
+        """Logs a disconnect noticed by the front end (empty read)."""
+        if self.state == "playing":
+            log.info("conn", "player disconnected", addr=self.addr, color=self.color, game=self.game_id)
+
+    def _hold_for_resume(self, game):
+        """Keeps the game open for RESUME_GRACE seconds after the player dropped. Caller holds the game's lock.
+
+        Returns False if the game should end now instead: it is already over,
+        the player quit on purpose, or their client cannot resume.
+        """
+        if game["finished"] or self.left or "resume" not in self.conn.features or RESUME_GRACE <= 0:
+            return False
+        game["players"][self.color] = None
+        if game.get("chat") is not None:
+            game["chat"].mark_away(self.color)
+        lobby_index.update(self.game_id, lobby_status(game))
+        grace_timers.schedule((self.game_id, self.color), time.monotonic() + RESUME_GRACE)
+        clock = game.get("clock")
+        if clock is not None and clock.running != self.color:
+            # The opponent cannot move until this player is back; only the absent side's time runs
+            clock.stop(time.monotonic())
+            clock_flags.cancel(self.game_id)
+        broadcast(
+            self.game_id,
+            protocol.info(
+                f"{self.color.capitalize()} disconnected. "
+                f"Waiting up to {RESUME_GRACE:.0f}s for them to reconnect."
+            ),
+        )
+        log.info(
+            "game", "holding game for resume", game=self.game_id, addr=self.addr,
+            color=self.color, grace=RESUME_GRACE,
+        )
+        return True
+
+    def cleanup(self):
+        """Removes the connection from the game registry once the front end is done with it."""
+        heartbeats.cancel(self)
+        conn = self.conn
+        addr = self.addr
+        if self.is_spectator:
+            admission_control.spectator_left()
+            if self.lobby_query is not None:
+                lobby_index.unsubscribe(conn)
+            player_game_id = self.game_id
+            game = active_games.get(player_game_id) if player_game_id else None
+            if game:
+                with game["lock"]:
+                    watching = conn in game["spectators"]
+                    if watching:
+                        game["spectators"] = spectators.remove_spectator(
+                            game["spectators"], conn
                         )
+                if watching:
+                    log.info("spectator", "left", addr=addr, game=player_game_id)
+            return
+
+        with lobby_lock:
+            # If the player was still waiting for an opponent
+            if self.ticket is not None and matchmaker.cancel(self.ticket):
+                lobby_index.remove(waiting_entry(self))
+                log.info("lobby", "left the queue", addr=addr)
+            self.ticket = None
+            # Read under the lock: the matchmaker may have just paired the player
+            player_game_id = self.game_id
+            player_color = self.color
+            game = active_games.get(player_game_id) if player_game_id else None
+            if game:  # It's a player
+                with game["lock"]:
+                    if game["players"].get(player_color) is not conn:
+                        outcome = "replaced"  # A resumed connection has taken over
+                    elif self._hold_for_resume(game):
+                        outcome = "held"
                     else:
-                        conn.sendall(
-                            "INFO:Spectator limit reached for this game.\n".encode()
-                        )
-                        return
-                else:
-                    conn.sendall("INFO:Invalid Game ID.\n".encode())
-                    return
+                        outcome = "over" if game["finished"] else "ended"
+                        game["finished"] = True
+                        # Notify opponent about disconnection
+                        opponent_color = "black" if player_color == "white" else "white"
+                        opponent_conn = game["players"].get(opponent_color)
+                        if outcome == "ended":
+                            archive_game(
+                                player_game_id, game, "*", f"{player_color} disconnected"
+                            )
+                        if opponent_conn and outcome == "ended":
+                            try:
+                                opponent_conn.send_message(
+                                    protocol.info(
+                                        f"Opponent ({player_color}) disconnected. Game ended."
+                                    )
+                                )
+                            except:
+                                pass  # Opponent might also be disconnected
+
+                if outcome == "ended":
+                    # If a player disconnects, the game is typically over or forfeited
+                    log.info(
+                        "game", "ended by disconnect", game=player_game_id, addr=addr, color=player_color
+                    )
+                if outcome in ("ended", "over"):
+                    unregister_game(player_game_id)
+            unpaired = _unpaired()
+        if cluster:
+            cluster.waiting_changed(unpaired)
+
+
+def play_move(game_id, game, move, color, start):
+    """Applies a legal move for color and tells everyone. Caller holds the game's lock.
+
+    ``start`` is the time.perf_counter() at which validating the move began.
+    Returns True if the move ended the game; the caller unregisters it then.
+    """
+    clock = game.get("clock")
+    now = time.monotonic()
+    if clock is not None and clock.running == color and not clock.press(color, now):
+        end_on_time(game_id, game, color)  # The move came in after the flag fell
+        return True
+    result_message = game["position"].push(move, color)
+    move_validation_seconds.observe(time.perf_counter() - start)
+    moves_played.inc()
+    if journal:
+        journal.move_played(game_id, move.uci())
+    game["turn"] = "black" if color == "white" else "white"
+    game_over = result_message is not None
+
+    broadcast_move(game_id, move.uci(), color, game_over)
+    if clock is not None:
+        if game_over:
+            clock.stop(now)
+        elif clock.running is not None:  # Stopped while the player to move is away
+            clock_flags.schedule(game_id, clock.deadline())
+        broadcast(game_id, protocol.clock(*clock.times(now)))
+        if not game_over:
+            probe_lag(game["players"][game["turn"]])
+    if game_over:
+        end_game(game_id, game, result_message)
+    else:
+        offer_draw(game)
+        request_engine_move(game_id, game)
+    return game_over
+
+
+def offer_draw(game):
+    """Tells the side to move that it may claim a draw. Caller holds the game's lock."""
+    reason = game["position"].claimable_draw()
+    opponent = game["players"].get(game["turn"])
+    if reason and opponent:
+        try:
+            opponent.send_message(
+                protocol.info(f"You may claim a draw by the {reason}. Send DRAW to claim it.")
+            )
+        except:  # Handle broken connections
+            pass
+
+
+def end_game(game_id, game, result_message):
+    """Announces the result. Caller holds the game's lock and unregisters the game afterwards."""
+    game["finished"] = True
+    archive_game(game_id, game, game_archive.result_of(game["board"]), result_message)
+    broadcast(game_id, protocol.game_over(result_message))
+    log.info("game", "game over", game=game_id, result=result_message)
+
+
+def request_engine_move(game_id, game):
+    """Queues a search if the engine is to move in an engine game. Caller holds the game's lock."""
+    options = game.get("engine")
+    if options is None or game["finished"] or game["turn"] != options["color"]:
+        return
+    seconds = options["seconds"]
+    clock = game.get("clock")
+    if clock is not None:
+        # Spread the engine's time over the rest of the game
+        seconds = min(seconds, clock.remaining[options["color"]] / engine.MOVES_TO_GO + clock.increment / 2)
+    stack = game["board"].move_stack
+    engines.submit(game_id, len(stack), " ".join(move.uci() for move in stack), options["depth"], seconds)
+
+
+def engine_moved(job):
+    """Plays the move an engine search found, unless its game has ended or moved on meanwhile."""
+    game_id = job.game_id
+    game = active_games.get(game_id)
+    if not game:
+        return
+    with game["lock"]:
+        options = game.get("engine")
+        if (
+            game["finished"] or options is None or game["turn"] != options["color"]
+            or len(game["board"].move_stack) != job.seq
+        ):
+            return
+        start = time.perf_counter()
+        move = game["position"].parse_move(job.move) if job.move else None
+        if move is None:
+            game["finished"] = True
+            message = "The engine failed. Game abandoned."
+            archive_game(game_id, game, "*", message)
+            broadcast(game_id, protocol.game_over(message))
+            game_over = True
+        else:
+            game_over = play_move(game_id, game, move, options["color"], start)
+    log.debug(
+        "engine", "moved", game=game_id, move=job.move, depth=job.reached, score=job.score,
+        nodes=job.nodes, seconds=round(time.monotonic() - job.started, 3),
+    )
+    if game_over:
+        with lobby_lock:
+            unregister_game(game_id)
+
+
+def heartbeat_expired(session):
+    """Pings a session that has gone quiet, or closes it once it has been silent too long."""
+    if session.closed or session.last_seen is None:
+        return
+    silent = time.monotonic() - session.last_seen
+    if silent >= HEARTBEAT_TIMEOUT:
+        log.info("heartbeat", "silent, closing connection", addr=session.addr, silent=round(silent))
+        session.conn.abort()  # The front end sees the connection end and cleans up
+        return
+    try:
+        session.send(protocol.ping(str(int(session.last_seen))))
+    except ConnectionResetError:
+        return
+    heartbeats.schedule(session, session.last_seen + HEARTBEAT_TIMEOUT)
+
+
+def grace_expired(key):
+    """Ends a game whose player did not come back within RESUME_GRACE."""
+    game_id, color = key
+    with lobby_lock:
+        game = active_games.get(game_id)
+        if not game:
+            return
+        with game["lock"]:
+            if game["finished"] or game["players"][color] is not None:
+                return  # Over already, or the player is back
+            game["finished"] = True
+            opponent = "black" if color == "white" else "white"
+            if game["players"][opponent] is not None:
+                result = "0-1" if color == "white" else "1-0"
+                message = f"{color.capitalize()} did not reconnect in time. Winner: {opponent}"
             else:
-                conn.sendall("INFO:Invalid choice.\n".encode())
+                result = "*"
+                message = "Neither player reconnected. Game abandoned."
+            archive_game(game_id, game, result, message)
+            broadcast(game_id, protocol.game_over(message))
+        unregister_game(game_id)
+    log.info("game", "resume grace expired", game=game_id, result=message)
+
+
+def end_on_time(game_id, game, color):
+    """Ends a game that color lost on time. Caller holds the game's lock and unregisters the game afterwards."""
+    game["finished"] = True
+    clock = game["clock"]
+    clock.remaining[color] = 0.0
+    clock.running = None
+    winner = game_clock.other(color)
+    if game["board"].has_insufficient_material(chess.WHITE if winner == "white" else chess.BLACK):
+        result = "1/2-1/2"
+        message = f"{color.capitalize()} ran out of time, but {winner} cannot checkmate. It's a draw."
+    else:
+        result = "1-0" if winner == "white" else "0-1"
+        message = f"{color.capitalize()} ran out of time. Winner: {winner}"
+    archive_game(game_id, game, result, message)
+    broadcast(game_id, protocol.clock(*clock.times(time.monotonic())))
+    broadcast(game_id, protocol.game_over(message))
+    flags_fallen.inc()
+    log.info("game", "flag fell", game=game_id, color=color, result=result)
+
+
+def flag_fell(game_id):
+    """Ends a timed game whose running clock has run out, unless a move got in first."""
+    with lobby_lock:
+        game = active_games.get(game_id)
+        if not game:
+            return
+        with game["lock"]:
+            clock = game.get("clock")
+            if game["finished"] or clock is None or clock.running is None:
+                return
+            if not clock.flagged(time.monotonic()):
+                clock_flags.schedule(game_id, clock.deadline())  # Lag credit grew meanwhile
                 return
+            end_on_time(game_id, game, clock.running)
+        unregister_game(game_id)
 
-        # Main game loop for the connected client
-        while True:
-            if player_game_id and player_game_id in active_games:
-                game = active_games[player_game_id]
-                if is_spectator:
-                    # Spectators just receive, server doesn't expect input from them after initial setup
-                    # However, we need to keep the connection alive or handle their disconnects
-                    try:
-                        # A simple way to check if spectator is still connected.
-                        # Could send periodic pings or rely on recv to error out on disconnect.
-                        conn.settimeout(60)  # Check every 60s
-                        data = conn.recv(
-                            1, socket.MSG_PEEK | socket.MSG_DONTWAIT
-                        )  # Non-blocking peek
-                        if not data and conn.fileno() == -1:  # Socket closed
-                            break
-                        conn.settimeout(None)  # Reset timeout
-                    except socket.timeout:
-                        continue  # No data, just timed out, continue spectating
-                    except (
-                        BlockingIOError
-                    ):  # No data, not an error for non-blocking peek
-                        pass
-                    except Exception:  # Any other error, assume disconnect
-                        break
-                    threading.Event().wait(5)  # Wait a bit before checking again
-                    continue
 
-                # If it's this player's turn
-                if (
-                    game["players"].get(player_color) == conn
-                    and game["turn"] == player_color
-                ):
-                    conn.sendall("YOUR_TURN:\n".encode())  # Prompt client
+def gated(handler):
+    """Wraps a timer callback so that a hot restart in threaded mode holds it off (see input_gate)."""
 
-                data = conn.recv(1024).decode().strip()
-                if not data:
-                    print(
-                        f"[DISCONNECTED] {addr} (Player: {player_color}, Game: {player_game_id})"
-                    )
-                    break  # Connection closed by client
+    def run(key):
+        with input_gate:
+            return handler(key)
 
-                print(
-                    f"[GAME {player_game_id}] Received from {addr} ({player_color}): {data}"
-                )
+    return run
 
-                if data.startswith("MOVE:"):
-                    if game["turn"] != player_color:
-                        conn.sendall("INVALID_MOVE:Not your turn.\n".encode())
-                        continue
-                    if not game["players"]["white"] or not game["players"]["black"]:
-                        conn.sendall(
-                            "INVALID_MOVE:Opponent not connected yet.\n".encode()
-                        )
-                        continue
-
-                    move_uci = data.split(":")[1]
-                    try:
-                        move = game["board"].parse_uci(move_uci)
-                        if move in game["board"].legal_moves:
-                            game["board"].push(move)
-                            game["turn"] = (
-                                "black" if player_color == "white" else "white"
-                            )
 
-                            broadcast(player_game_id, f"BOARD:{game['board'].fen()}\n")
+def _tick_timers(loop):
+    # asyncio mode: expiries run on the loop, where transports may be aborted
+    for session in heartbeats.advance():
+        heartbeat_expired(session)
+    for key in grace_timers.advance():
+        grace_expired(key)
+    loop.call_later(heartbeats.tick, _tick_timers, loop)
 
-                            game_over = False
-                            result_message = ""
-                            if game["board"].is_checkmate():
-                                result_message = (
-                                    f"GAME_OVER:Checkmate! Winner: {player_color}\n"
-                                )
-                                game_over = True
-                            elif game["board"].is_stalemate():
-                                result_message = "GAME_OVER:Stalemate! It's a draw.\n"
-                                game_over = True
-                            elif game["board"].is_insufficient_material():
-                                result_message = (
-                                    "GAME_OVER:Insufficient material! It's a draw.\n"
-                                )
-                                game_over = True
-                            elif game["board"].is_seventyfive_moves():
-                                result_message = (
-                                    "GAME_OVER:75-move rule! It's a draw.\n"
-                                )
-                                game_over = True
-                            elif game["board"].is_fivefold_repetition():
-                                result_message = (
-                                    "GAME_OVER:Fivefold repetition! It's a draw.\n"
-                                )
-                                game_over = True
 
-                            if game_over:
-                                broadcast(player_game_id, result_message)
-                                print(
-                                    f"[GAME {player_game_id}] Game Over. {result_message.strip()}"
-                                )
-                                # Clean up game after it ends
-                                with lock:
-                                    if player_game_id in active_games:
-                                        del active_games[player_game_id]
-                                break  # End client handler loop
-                            else:
-                                broadcast(
-                                    player_game_id,
-                                    f"INFO:Move {move_uci} by {player_color} was valid.\n",
-                                )
-                                broadcast(player_game_id, f"TURN:{game['turn']}\n")
-                        else:
-                            conn.sendall("INVALID_MOVE:Illegal move.\n".encode())
-                    except ValueError:  # Invalid UCI
-                        conn.sendall(
-                            "INVALID_MOVE:Invalid move format (use UCI e.g., e2e4).\n".encode()
-                        )
-                    except Exception as e:
-                        print(f"Error processing move: {e}")
-                        conn.sendall("ERROR:Could not process move.\n".encode())
-
-                elif data.startswith("CHAT:"):
-                    chat_msg = data.split(":", 1)[1]
-                    broadcast(
-                        player_game_id,
-                        f"CHAT:{player_color if player_color else 'Spectator'}({addr}): {chat_msg}\n",
-                        exclude_conn=conn,
-                    )
-                    conn.sendall(f"CHAT:You: {chat_msg}\n".encode())  # Echo to self
+def new_game(game_id, players, player_addrs, time_control):
+    """The registry entry of a game about to start."""
+    board = chess.Board()
+    return {
+        "board": board,
+        "position": termination.Position(board, positions),  # Repetition counts, cached outcome and FEN
+        "players": players,
+        "spectators": (),  # Immutable, replaced on join/leave
+        "turn": "white",
+        "player_addrs": player_addrs,
+        "time_control": time_control,
+        "tokens": {"white": new_resume_token(game_id), "black": new_resume_token(game_id)},
+        "replay": collections.deque(maxlen=REPLAY_MOVES),  # (seq, DELTA message) of recent moves
+        "lock": new_game_lock(),
+        "finished": False,
+        "clock": game_clock.new_clock(time_control),  # None if untimed
+    }
 
-                elif data.upper() == "QUIT":
-                    conn.sendall("INFO:You have quit the game.\n".encode())
-                    break
 
-                else:
-                    # Handle non-turn commands or just ignore
-                    if game["turn"] != player_color:
-                        conn.sendall(
-                            "INFO:It's not your turn. Type 'CHAT:<your message>' to chat or 'QUIT'.\n".encode()
-                        )
+def start_game(white, black, time_control):
+    """Opens a game for two sessions the matchmaker paired. Called under ``lobby_lock``."""
+    game_id = generate_game_id()
+    game = new_game(
+        game_id,
+        {"white": white.conn, "black": black.conn},
+        {"white": white.addr, "black": black.addr},
+        time_control,
+    )
+    with game["lock"]:
+        for session, color in ((white, "white"), (black, "black")):
+            session.game_id = game_id
+            session.color = color
+            session.ticket = None
+            session.state = "playing"
+            lobby_index.remove(waiting_entry(session))
+        register_game(game_id, game)
+        if journal:
+            journal.game_started(game_id, time_control, white.addr, black.addr, game["tokens"])
+        for session, color, opponent in ((white, "White", black), (black, "Black", white)):
+            handshake = f"You are {color}. Game ID: {game_id}. Game starting with {opponent.addr}!"
+            if "resume" in session.conn.features:
+                handshake += f" Resume token: {game['tokens'][color.lower()]}."
+            session.send(protocol.info(handshake))
+        broadcast_snapshot(game_id)
+        clock = game["clock"]
+        if clock is not None:
+            clock.start("white", time.monotonic())
+            clock_flags.schedule(game_id, clock.deadline())
+            broadcast(game_id, protocol.clock(*clock.times(time.monotonic())))
+            probe_lag(white.conn)
+            probe_lag(black.conn)
+    log.info("game", "started", game=game_id, white=white.addr, black=black.addr, tc=time_control)
 
-            elif player_game_id and player_game_id not in active_games:
-                # Game might have ended and been cleaned up
-                conn.sendall("INFO:The game session has ended.\n".encode())
-                break
-            elif not player_game_id and not is_spectator:
-                # Player was waiting but game didn't start (e.g. server restarted before match)
-                conn.sendall(
-                    "INFO:Disconnected from lobby. Please try connecting again.\n".encode()
+
+def engine_addr(depth):
+    """The engine's stand-in for a player address, in the lobby, the journal and the archive."""
+    return ("engine", depth)
+
+
+def start_engine_game(session, color, time_control, depth, seconds):
+    """Opens a game between a session and the engine, which plays the other color. Called under ``lobby_lock``."""
+    game_id = generate_game_id()
+    engine_color = game_clock.other(color)
+    game = new_game(
+        game_id,
+        {color: session.conn, engine_color: engine_seat},
+        {color: session.addr, engine_color: engine_addr(depth)},
+        time_control,
+    )
+    game["engine"] = {"color": engine_color, "depth": depth, "seconds": seconds}
+    with game["lock"]:
+        session.game_id = game_id
+        session.color = color
+        session.state = "playing"
+        register_game(game_id, game)
+        if journal:
+            journal.game_started(
+                game_id, time_control, game["player_addrs"]["white"], game["player_addrs"]["black"], game["tokens"]
+            )
+        handshake = (
+            f"You are {color.capitalize()}. Game ID: {game_id}. "
+            f"Game starting with the engine (depth {depth}, {seconds:g}s per move)!"
+        )
+        if "resume" in session.conn.features:
+            handshake += f" Resume token: {game['tokens'][color]}."
+        session.send(protocol.info(handshake))
+        broadcast_snapshot(game_id)
+        clock = game["clock"]
+        if clock is not None:
+            clock.start("white", time.monotonic())
+            clock_flags.schedule(game_id, clock.deadline())
+            broadcast(game_id, protocol.clock(*clock.times(time.monotonic())))
+            probe_lag(session.conn)
+        request_engine_move(game_id, game)
+    log.info(
+        "game", "started against the engine", game=game_id, addr=session.addr, color=color,
+        depth=depth, seconds=seconds, tc=time_control,
+    )
+
+
+class RecoveredGame(dict):
+    """A game rebuilt from the journal after a restart, or handed over by a hot restart.
+
+    Only the move list is read back at startup; the board (with its full move
+    stack) and the repetition counts are replayed the first time they are
+    used, which happens under the game's lock. That keeps recovery of many
+    games down to parsing the journal.
+    """
+
+    def __missing__(self, key):
+        if key not in ("board", "position"):
+            raise KeyError(key)
+        board = chess.Board()
+        for move_uci in self["moves"].split():
+            board.push(chess.Move.from_uci(move_uci))
+        self["board"] = board
+        self["position"] = termination.Position(board, positions)
+        del self["moves"]
+        return self[key]
+
+
+def recover_games(path):
+    """Opens the journal at path and registers the games it holds. Returns the Journal."""
+    global active_games, engine_games
+    started = time.perf_counter()
+    gc.disable()  # Nothing here is cyclic garbage; collections would only slow the load
+    try:
+        games = game_journal.read_journal(path)
+        with lobby_lock:
+            recovered = dict(active_games)
+            for game_id, entry in games.items():
+                player_addrs = {
+                    "white": game_journal.parse_addr(entry.white),
+                    "black": game_journal.parse_addr(entry.black),
+                }
+                game = recovered[game_id] = RecoveredGame(
+                    moves=entry.moves,
+                    players={"white": None, "black": None},  # Until they come back
+                    spectators=(),
+                    turn="white" if entry.plies() % 2 == 0 else "black",
+                    player_addrs=player_addrs,
+                    time_control=entry.time_control,
+                    tokens={"white": entry.white_token, "black": entry.black_token},
+                    replay=collections.deque(maxlen=REPLAY_MOVES),
+                    lock=new_game_lock(),
+                    finished=False,
+                    recovered=True,
+                    clock=None,  # Clocks are not journaled; recovered games finish untimed
                 )
-                break
+                # The players get the usual grace period to come back
+                deadline = time.monotonic() + RESUME_GRACE
+                for color, addr in player_addrs.items():
+                    if addr[0] == "engine":
+                        # Only the depth is journaled, in the address; it thinks for up to the time cap
+                        game["engine"] = {"color": color, "depth": addr[1], "seconds": engines.max_seconds}
+                        game["players"][color] = engine_seat
+                        engine_games += 1
+                    else:
+                        grace_timers.schedule((game_id, color), deadline)
+            active_games = recovered
+            lobby_index.add_many(
+                (
+                    (game_id, entry.white, entry.black, entry.time_control)
+                    for game_id, entry in games.items()
+                ),
+                "recovered",
+            )
+    finally:
+        gc.enable()
+    opened = game_journal.Journal(path, games)
+    opened.open()
+    log.info(
+        "journal", "recovered games", path=path, games=len(games),
+        seconds=round(time.perf_counter() - started, 3),
+    )
+    return opened
+
+
+def open_archive(directory):
+    opened = game_archive.Archive(directory)
+    opened.open()
+    log.info("archive", "archiving finished games", directory=directory)
+    return opened
+
+
+def open_journal(path):
+    """Opens the journal a hot restart's predecessor has just synced, without registering its games again."""
+    opened = game_journal.Journal(path, game_journal.read_journal(path))
+    opened.open()
+    return opened
+
+
+def offer_connections(ctl, mode):
+    """Step 1 of a hot restart: passes the listener and every client socket on, while still serving them.
+
+    In asyncio mode this runs on the event loop, where transports close their
+    sockets. Returns the index each connection's socket was offered with.
+    """
+    with open_connections_lock:  # Held until sent: a tracked connection's socket is open
+        conns = [conn for conn in open_connections if conn.fileno() >= 0]
+        hot_restart.offer(ctl, listener.fileno(), [conn.fileno() for conn in conns], mode)
+    return {conn: index for index, conn in enumerate(conns)}
+
+
+def registry_snapshot(offered):
+    """The registry as plain data for a hot restart, and the sockets accepted since offer_connections().
+
+    Caller has stopped everything that changes the registry or writes to a
+    socket (see hand_over).
+    """
+    now = time.monotonic()
+    with open_connections_lock:
+        conns = [
+            conn for conn in open_connections
+            if conn.session is not None and not conn.session.closed and conn.fileno() >= 0
+        ]
+    late = [conn for conn in conns if conn not in offered]
+    sockets = {conn: len(offered) + index for index, conn in enumerate(late)}
+    sockets.update(offered)
+    conn_ids = {conn: index for index, conn in enumerate(conns)}
+    games = {
+        game_id: _game_snapshot(game_id, game, conn_ids, now)
+        for game_id, game in active_games.items()
+        if not game["finished"]
+    }
+    lobby_version, lobby_games = lobby_index.snapshot()
+    snapshot = {
+        "games": games,
+        "sessions": [conn.session.snapshot(now) for conn in conns],
+        "sockets": [sockets[conn] for conn in conns],  # Where each session's socket is among those sent
+        "lobby": {"version": lobby_version, "games": lobby_games},
+    }
+    return snapshot, [conn.fileno() for conn in late]
+
+
+def _game_snapshot(game_id, game, conn_ids, now):
+    players = {color: conn_ids.get(conn) for color, conn in game["players"].items()}
+    options = game.get("engine")
+    away = {}
+    for color, index in players.items():
+        if index is None and (options is None or options["color"] != color):
+            deadline = grace_timers.deadline((game_id, color))
+            # A player whose connection was already closing gets the usual grace
+            away[color] = deadline - now if deadline is not None else RESUME_GRACE
+    clock = game.get("clock")
+    room = game.get("chat")
+    return {
+        "moves": game["moves"] if "moves" in game else " ".join(move.uci() for move in game["board"].move_stack),
+        "turn": game["turn"],
+        "players": players,
+        "away": away,  # Color -> seconds of grace left
+        "spectators": [conn_ids[conn] for conn in game["spectators"] if conn in conn_ids],
+        "player_addrs": {color: list(addr) for color, addr in game["player_addrs"].items()},
+        "time_control": game["time_control"],
+        "tokens": game["tokens"],
+        "recovered": bool(game.get("recovered")),
+        "engine": options,
+        "replay": [[seq, delta.payload] for seq, delta in game["replay"]],
+        "clock": None if clock is None else {
+            "remaining": clock.remaining,
+            "increment": clock.increment,
+            "running": clock.running,
+            "elapsed": now - clock.turn_started if clock.running else 0.0,
+            "lag_credit": clock.lag_credit,
+        },
+        "chat": None if room is None else {
+            "history": list(room.history),
+            "pending": [[conn_ids.get(sender), line, echo] for sender, line, echo in room.pending],
+            "seq": room.seq,
+            "delivered": room.delivered,
+            "away": room.away,
+        },
+    }
+
+
+def hand_over(ctl, offered, threaded):
+    """Step 2: hands the registry and any later connections to the successor on ctl, then exits.
+
+    In threaded mode the session and timer threads are held at input_gate; in
+    asyncio mode this runs on the event loop, which holds everything else
+    off by itself. Returns, with everything running again, if the successor
+    does not take over.
+    """
+    started = time.perf_counter()
+    log.info("restart", "handing over")
+    if threaded:
+        input_gate.close()
+    gc.disable()  # The snapshot allocates a lot and frees nothing; collections would only stretch the pause
+    try:
+        with lobby_lock:  # Holds off the matchmaker
+            spectator_fanout.flush()
+            fanout.socket_writer.pause()
+            try:
+                snapshot, fds = registry_snapshot(offered)
+                hot_restart.send(ctl, fds, snapshot)
+            except Exception:
+                fanout.socket_writer.resume()
+                raise
+            if journal:
+                journal.sync()
+            if archive:
+                archive.sync()
+            if metrics_server:
+                metrics_server.server_close()  # Frees the port for the successor
+            log.info(
+                "restart", "handed over", connections=len(snapshot["sessions"]), late=len(fds),
+                games=len(snapshot["games"]),
+                seconds=round(time.perf_counter() - started, 3),
+            )
+            log.flush()
+            hot_restart.finish(ctl)
+            os._exit(0)
+    finally:
+        gc.enable()
+        if threaded:
+            input_gate.open()
+
+
+def _hand_over_threaded(ctl):
+    offered = offer_connections(ctl, "threads")
+    hot_restart.wait_for(ctl, "prepared")  # Serving on meanwhile
+    hand_over(ctl, offered, threaded=True)
+
+
+def restore_registry(takeover, conns):
+    """Rebuilds the registry a hot restart handed over, around the connections it came with.
+
+    conns wraps the sockets offered in step 1 and then the late ones, in
+    the order they came. Nothing is read or written yet: returns the
+    (session, snapshot) pairs for start_restored(), to be called once the
+    predecessor has let go.
+    """
+    global active_games, engine_games
+    snapshot = takeover.snapshot
+    now = time.monotonic()
+    unused = set(conns)
+    conns = [conns[index] for index in snapshot["sockets"]]  # Now by session
+    unused.difference_update(conns)
+    for conn in unused:
+        conn.close()  # Closed in the predecessor since it was offered
+    restored = []
+    for conn, state in zip(conns, snapshot["sessions"]):
+        session = ClientSession(conn, tuple(state["addr"]))
+        session.restore(state, now)
+        admission_control.connect(force=True)
+        if session.is_spectator:
+            admission_control.spectator_adopted()
+        restored.append((session, state))
+    games = {
+        game_id: _restore_game(game_id, state, conns, now)
+        for game_id, state in snapshot["games"].items()
+    }
+    with lobby_lock:
+        active_games = games
+        engine_games = sum("engine" in game for game in games.values())
+        lobby_index.restore(
+            snapshot["lobby"]["version"],
+            snapshot["lobby"]["games"],
+            [session.conn for session, _ in restored if session.lobby_query is not None],
+        )
+    return restored
+
+
+def _restore_game(game_id, state, conns, now):
+    game = RecoveredGame(
+        moves=state["moves"],
+        players={
+            color: None if index is None else conns[index] for color, index in state["players"].items()
+        },
+        spectators=tuple(conns[index] for index in state["spectators"]),
+        turn=state["turn"],
+        player_addrs={color: tuple(addr) for color, addr in state["player_addrs"].items()},
+        time_control=state["time_control"],
+        tokens=state["tokens"],
+        replay=collections.deque(
+            ((seq, protocol.Message(protocol.DELTA, payload)) for seq, payload in state["replay"]),
+            maxlen=REPLAY_MOVES,
+        ),
+        lock=new_game_lock(),
+        finished=False,
+        clock=None,
+    )
+    if state["recovered"]:
+        game["recovered"] = True
+    if state["engine"] is not None:
+        game["engine"] = state["engine"]
+        game["players"][state["engine"]["color"]] = engine_seat
+    saved = state["clock"]
+    if saved is not None:
+        clock = game["clock"] = game_clock.Clock(0.0, saved["increment"])
+        clock.remaining = saved["remaining"]
+        clock.lag_credit = saved["lag_credit"]
+        if saved["running"] is not None:
+            clock.start(saved["running"], now - saved["elapsed"])
+            clock_flags.schedule(game_id, clock.deadline())
+    saved = state["chat"]
+    if saved is not None:
+        room = game["chat"] = chat.ChatRoom()
+        room.history.extend((seq, line) for seq, line in saved["history"])
+        room.pending.extend(
+            (None if index is None else conns[index], line, echo) for index, line, echo in saved["pending"]
+        )
+        room.seq = saved["seq"]
+        room.delivered = saved["delivered"]
+        room.away = saved["away"]
+        if room.pending:
+            chat_flusher.mark(game_id)  # Flushed once the flusher runs
+    for color, remaining in state["away"].items():
+        grace_timers.schedule((game_id, color), now + remaining)
+    return game
+
+
+def start_restored(restored):
+    """Queues the output the predecessor had not written yet, puts waiting players back in the queue
+    and asks the engine again for the moves it was searching."""
+    now = time.monotonic()
+    for session, state in restored:
+        if state["unsent"]:
+            try:
+                session.conn.sendall(state["unsent"])
+            except ConnectionResetError:
+                pass  # Too far behind; its front end finds it dropped
+    waiting = [(session, state["ticket"]) for session, state in restored if state["ticket"] is not None]
+    waiting.sort(key=lambda entry: -entry[1][2])  # Longest waiting first, as they were queued
+    with lobby_lock:
+        for session, (rating, time_control, waited) in waiting:
+            session.ticket = matchmaker.enqueue(session, rating, time_control)
+            session.ticket.enqueued_at = now - waited
+    for game_id, game in active_games.items():
+        if "engine" in game:
+            with game["lock"]:
+                request_engine_move(game_id, game)
+
+
+def _unpaired():
+    """{time_control: whether a player here has no opponent}, for the other workers. Caller holds ``lobby_lock``."""
+    return {time_control: matchmaker.unpaired(time_control) for time_control in matchmaking.TIME_CONTROLS}
+
+
+def _matchmaking_done():
+    """Tells the other workers which time controls still have a player waiting here after a pairing tick."""
+    if cluster:
+        with lobby_lock:
+            unpaired = _unpaired()
+        cluster.waiting_changed(unpaired)
+
+
+matchmaker = matchmaking.Matchmaker(lobby_lock, start_game, after_tick=_matchmaking_done)
+
+
+def refuse(sock, reason):
+    """Tells a connection the server is busy and closes it, without a thread or a session."""
+    message = protocol.busy(admission_control.retry_after(), admission.MESSAGES[reason])
+    try:
+        sock.setblocking(False)
+        sock.send(message.encode(1))  # Before HELLO, so always text
+    except OSError:
+        pass
+    sock.close()
+
+
+def handle_client(sock, addr, handoff=None, session=None):
+    """Serves one connection on its own thread. The caller has counted it with admission_control.connect().
+
+    ``session`` is the connection's session if the caller made it, e.g. one a
+    hot restart handed over.
+    """
+    if session is None:
+        session = ClientSession(SocketConnection(sock), addr)
+    conn = session.conn
+    restored = session.greeted
+    try:
+        with input_gate:
+            if restored:
+                session.receive(b"")  # Commands the predecessor read but did not handle
+            else:
+                session.start(handoff)
+        prompted = restored  # The predecessor prompted before its last read
+        while not session.closed:
+            if not prompted:
+                with input_gate:
+                    session.prompt()
+            prompted = False
+            if HANDOFF_PATH:
+                conn.wait_readable()  # So a hot restart never finds input read but not handled
+            with input_gate:
+                data = conn.recv(RECV_SIZE)
+                if not data:
+                    session.disconnected()
+                    break  # Connection closed by client
+                session.receive(data)
 
     except socket.error as e:
-        print(f"[SOCKET ERROR] {addr}: {e}")
+        log.warning("conn", "socket error", addr=addr, error=str(e))
     except Exception as e:
-        print(f"[ERROR] {addr}: {e}")
+        log.error("conn", "session failed", addr=addr, error=repr(e))
     finally:
-        with lock:
-            if player_game_id and player_game_id in active_games:
-                game = active_games[player_game_id]
-                if is_spectator:
-                    if conn in game["spectators"]:
-                        game["spectators"].remove(conn)
-                        print(f"[SPECTATOR] {addr} left game {player_game_id}")
-                else:  # It's a player
-                    # Notify opponent about disconnection
-                    opponent_color = "black" if player_color == "white" else "white"
-                    opponent_conn = game["players"].get(opponent_color)
-                    if opponent_conn:
-                        try:
-                            opponent_conn.sendall(
-                                f"INFO:Opponent ({player_color}) disconnected. Game ended.\n".encode()
-                            )
-                        except:
-                            pass  # Opponent might also be disconnected
+        with input_gate:
+            session.cleanup()
+        conn.close()
+        admission_control.disconnect()
+        if not session.handed_off:
+            log.info("conn", "closed", addr=addr)
 
-                    # If a player disconnects, the game is typically over or forfeited
-                    print(
-                        f"[GAME END DUE TO DISCONNECT] Game {player_game_id} ended because {player_color} ({addr}) disconnected."
-                    )
-                    if (
-                        player_game_id in active_games
-                    ):  # Check again as it might be deleted by game_over
-                        del active_games[player_game_id]
-
-            # If the player was waiting and disconnected before game started
-            for i, waiting_gid in enumerate(waiting_players):
-                # Check if the disconnected player was the one waiting in this game_id slot
-                if (
-                    waiting_gid == player_game_id
-                    and active_games.get(waiting_gid)
-                    and active_games[waiting_gid]["players"]["white"] == conn
-                ):
-                    del waiting_players[i]
-                    if (
-                        waiting_gid in active_games
-                    ):  # Also remove the partial game entry
-                        del active_games[waiting_gid]
-                    print(
-                        f"[LOBBY] Player {addr} removed from waiting queue for game {waiting_gid}."
-                    )
-                    break
 
+async def handle_client_async(reader, writer, handoff=None, session=None):
+    """Coroutine counterpart of handle_client: same session, no thread per connection."""
+    restored = session is not None  # By a hot restart
+    if restored:
+        addr = session.addr
+    else:
+        addr = tuple(handoff["addr"]) if handoff else writer.get_extra_info("peername")
+        if not admission_control.connect(force=bool(handoff)):
+            busy = protocol.busy(admission_control.retry_after(), admission.MESSAGES["connections"])
+            writer.write(busy.encode(1))  # Before HELLO, so always text
+            writer.close()
+            return
+        session = ClientSession(AsyncConnection(writer, reader), addr)
+    conn = session.conn
+    try:
+        if session.greeted:
+            session.receive(b"")  # Commands the predecessor read but did not handle
+        else:
+            session.start(handoff)
+        prompted = restored  # The predecessor prompted before its last read
+        while not session.closed:
+            if not prompted:
+                session.prompt()
+            prompted = False
+            await writer.drain()
+            data = await reader.read(RECV_SIZE)
+            if not data:
+                session.disconnected()
+                break  # Connection closed by client
+            session.receive(data)
+            # A read from an already-filled buffer does not suspend; yield so the
+            # per-tick flushes (and other connections) get to run
+            await asyncio.sleep(0)
+        await writer.drain()
+
+    except socket.error as e:
+        log.warning("conn", "socket error", addr=addr, error=str(e))
+    except Exception as e:
+        log.error("conn", "session failed", addr=addr, error=repr(e))
+    finally:
+        session.cleanup()
         conn.close()
-        print(f"[CONNECTION CLOSED] {addr}")
+        admission_control.disconnect()
+        if not session.handed_off:
+            log.info("conn", "closed", addr=addr)
 
 
-def start_server():
-    server_socket = socket.socket(socket.AF_INET, socket.SOCK_STREAM)
-    server_socket.setsockopt(
-        socket.SOL_SOCKET, socket.SO_REUSEADDR, 1
-    )  # Allow reuse of address
-    server_socket.bind((HOST, PORT))
-    server_socket.listen()
-    print(f"Chess server listening on {HOST}:{PORT}")
+def start_server(server_socket=None, restored=()):
+    """Serves with a thread per connection. ``restored`` comes from restore_registry() after a hot restart."""
+    global listener
+    if server_socket is None:
+        server_socket = socket.socket(socket.AF_INET, socket.SOCK_STREAM)
+        server_socket.setsockopt(
+            socket.SOL_SOCKET, socket.SO_REUSEADDR, 1
+        )  # Allow reuse of address
+        server_socket.bind((HOST, PORT))
+        server_socket.listen(BACKLOG)
+    listener = server_socket
+    if cluster:
+        cluster.serve_control(_adopt_threaded, _list_games)
+    heartbeats.run(gated(heartbeat_expired))
+    grace_timers.run(gated(grace_expired))
+    clock_flags.run(gated(flag_fell))
+    chat_flusher.run(gated(flush_chat))
+    engines.run(gated(engine_moved))
+    if restored:
+        start_restored(restored)
+        for session, _ in restored:
+            threading.Thread(target=handle_client, args=(None, session.addr, None, session), daemon=True).start()
+    if HANDOFF_PATH:
+        hot_restart.serve(HANDOFF_PATH, _hand_over_threaded)
+    log.info("server", "listening", host=HOST, port=PORT, mode="threads")
 
+    # Wait for the listener to become readable, then take everything queued
+    # (up to ACCEPT_BATCH) before waiting again
+    server_socket.setblocking(False)
+    selector = selectors.DefaultSelector()
+    selector.register(server_socket, selectors.EVENT_READ)
     while True:
-        conn, addr = server_socket.accept()
-        thread = threading.Thread(target=handle_client, args=(conn, addr))
-        thread.daemon = True  # Allow main program to exit even if threads are running
-        thread.start()
+        selector.select()
+        with input_gate:  # A hot restart leaves new connections in the backlog for its successor
+            for _ in range(admission.ACCEPT_BATCH):
+                try:
+                    conn, addr = server_socket.accept()
+                except (BlockingIOError, InterruptedError):
+                    break
+                except OSError as e:  # E.g. out of file descriptors; the client waits in the backlog
+                    log.warning("server", "accept failed", error=str(e))
+                    time.sleep(ACCEPT_ERROR_PAUSE)
+                    break
+                conn.setblocking(True)
+                if not admission_control.connect():
+                    refuse(conn, "connections")
+                    continue
+                # Made here, under the gate, so a hot restart hands on every accepted connection
+                session = ClientSession(SocketConnection(conn), addr)
+                thread = threading.Thread(target=handle_client, args=(conn, addr, None, session))
+                thread.daemon = True  # Allow main program to exit even if threads are running
+                try:
+                    thread.start()
+                except RuntimeError:  # Out of threads
+                    track_connection(session.conn, False)
+                    admission_control.disconnect()
+                    admission.rejected["resources"].inc()
+                    refuse(conn, "resources")
+
+
+async def serve_async(server_socket=None, takeover=None):
+    global listener
+    restored = await _take_over_async(takeover) if takeover else ()
+    if server_socket is None:
+        server = await asyncio.start_server(
+            handle_client_async, HOST, PORT, reuse_address=True, backlog=BACKLOG
+        )
+        listener = server.sockets[0]
+    else:
+        # asyncio listens again with this backlog, and accepts up to that many per wakeup
+        server = await asyncio.start_server(handle_client_async, sock=server_socket, backlog=BACKLOG)
+        listener = server_socket
+    loop = asyncio.get_running_loop()
+    spectator_fanout.use_event_loop(loop)
+    _tick_timers(loop)
+    clock_flags.run_on_loop(loop, flag_fell)
+    chat_flusher.run_on_loop(loop, flush_chat)
+    engines.run_on_loop(loop, engine_moved)
+    if cluster:
+
+        def adopt(sock, header):
+            asyncio.run_coroutine_threadsafe(_adopt_async(sock, header), loop)
+
+        cluster.serve_control(adopt, _list_games)
+    if restored:
+        start_restored(restored)
+        for session, _ in restored:
+            conn = session.conn
+            conn.writer.transport.resume_reading()
+            loop.create_task(handle_client_async(conn.reader, conn.writer, session=session))
+    if HANDOFF_PATH:
+
+        async def offer_on_loop(ctl):
+            return offer_connections(ctl, "asyncio")
+
+        async def hand_over_on_loop(ctl, offered):
+            fd = listener.fileno()
+            loop.remove_reader(fd)  # New connections wait in the backlog
+            try:
+                for _ in range(SETTLE_PASSES):
+                    await asyncio.sleep(0)  # Connections accepted already get their sessions
+                hand_over(ctl, offered, threaded=False)
+            finally:
+                # Still here: the successor did not take over
+                await asyncio.start_server(
+                    handle_client_async, sock=socket.socket(fileno=os.dup(fd)), backlog=BACKLOG
+                )
+
+        def on_takeover(ctl):
+            offered = asyncio.run_coroutine_threadsafe(offer_on_loop(ctl), loop).result()
+            hot_restart.wait_for(ctl, "prepared")  # Serving on meanwhile
+            asyncio.run_coroutine_threadsafe(hand_over_on_loop(ctl, offered), loop).result()
+
+        hot_restart.serve(HANDOFF_PATH, on_takeover)
+    log.info("server", "listening", host=HOST, port=PORT, mode="asyncio")
+    async with server:
+        await server.serve_forever()
+
+
+def start_async_server(server_socket=None, takeover=None):
+    asyncio.run(serve_async(server_socket, takeover))
+
+
+class _HeldStreamProtocol(asyncio.StreamReaderProtocol):
+    """A stream protocol that does not read until resume_reading(), for sockets a hot restart handed over."""
+
+    def connection_made(self, transport):
+        super().connection_made(transport)
+        transport.pause_reading()  # Before the transport first reads
+
+
+async def _held_stream(sock):
+    # asyncio.open_connection(), with a protocol that holds off reading
+    loop = asyncio.get_running_loop()
+    reader = asyncio.StreamReader(loop=loop)
+    stream_protocol = _HeldStreamProtocol(reader, loop=loop)
+    transport, _ = await loop.create_connection(lambda: stream_protocol, sock=sock)
+    return reader, asyncio.StreamWriter(transport, stream_protocol, reader, loop)
+
+
+async def _take_over_async(takeover):
+    """restore_registry() for asyncio mode, and _taken_over(). Runs before the server starts serving."""
+    streams = await asyncio.gather(*(_held_stream(sock) for sock in takeover.sockets))
+    conns = [AsyncConnection(writer, reader) for reader, writer in streams]
+    streams = await asyncio.gather(*(_held_stream(sock) for sock in takeover.receive()))
+    conns += [AsyncConnection(writer, reader) for reader, writer in streams]
+    restored = _restore_or_refuse(takeover, conns)
+    _taken_over(takeover)
+    return restored
+
+
+def take_over(path, mode):
+    """Takes the listener, connections and games over from the server handing them over at path, and serves them."""
+    gc.disable()  # Until _taken_over(), as in recover_games()
+    takeover = hot_restart.Takeover(path, mode)
+    log.info("restart", "taking over", pid=takeover.pid, connections=len(takeover.sockets))
+    if mode == "asyncio":
+        start_async_server(takeover.listener, takeover)
+        return
+    conns = [SocketConnection(sock) for sock in takeover.sockets]
+    conns += [SocketConnection(sock) for sock in takeover.receive()]
+    restored = _restore_or_refuse(takeover, conns)
+    _taken_over(takeover)
+    start_server(takeover.listener, restored)
+
+
+def _restore_or_refuse(takeover, conns):
+    try:
+        return restore_registry(takeover, conns)
+    except Exception as e:
+        log.error("restart", "could not rebuild the registry", error=repr(e))
+        takeover.refuse(repr(e))  # The predecessor carries on
+
+
+def _taken_over(takeover):
+    """Waits for the predecessor to let go, then opens what it had open."""
+    global journal, archive
+    started = time.perf_counter()
+    takeover.ready()
+    gc.freeze()  # The registry just rebuilt is long-lived; collections need not scan it
+    gc.enable()
+    log.info(
+        "restart", "took over", pid=takeover.pid, games=len(active_games),
+        waited=round(time.perf_counter() - started, 3), paused=round(time.perf_counter() - takeover.paused, 3),
+        seconds=round(time.perf_counter() - takeover.started, 3),
+    )
+    if METRICS_PORT:
+        serve_metrics(METRICS_PORT)
+    if JOURNAL_PATH:
+        journal = open_journal(JOURNAL_PATH)
+    if ARCHIVE_DIR:
+        archive = open_archive(ARCHIVE_DIR)
+
+
+def _list_games(query):
+    return lobby_index.page(**query)
+
+
+def _adopt_threaded(sock, header):
+    admission_control.connect(force=True)  # Admitted by the worker that accepted it
+    thread = threading.Thread(
+        target=handle_client, args=(sock, tuple(header["addr"]), header)
+    )
+    thread.daemon = True
+    thread.start()
+
+
+async def _adopt_async(sock, header):
+    reader, writer = await asyncio.open_connection(sock=sock)
+    await handle_client_async(reader, writer, header)
+
+
+def serve_metrics(port):
+    global metrics_server
+    metrics_server = metrics.serve(HOST, port)
+    log.info("metrics", "serving Prometheus metrics", url=f"http://{HOST}:{port}/metrics")
+
+
+def run_worker(index, mode):
+    """Entry point of one SO_REUSEPORT worker process."""
+    global journal, archive
+    cluster.attach(index)
+    log.configure(path=f"{LOG_FILE}.{index}" if LOG_FILE else None, fields={"worker": index})
+    if METRICS_PORT:
+        serve_metrics(METRICS_PORT + index)  # One endpoint per worker
+    if JOURNAL_PATH:
+        journal = recover_games(f"{JOURNAL_PATH}.{index}")  # One journal per worker
+    if ARCHIVE_DIR:
+        archive = open_archive(os.path.join(ARCHIVE_DIR, f"worker-{index}"))
+    server_socket = worker_cluster.reuseport_listener(HOST, PORT, BACKLOG)
+    log.info("cluster", "worker started", pid=os.getpid())
+    if mode == "asyncio":
+        start_async_server(server_socket)
+    else:
+        start_server(server_socket)
+
+
+def parse_args():
+    parser = argparse.ArgumentParser(description="Network chess server.")
+    parser.add_argument("--host", default=HOST, help="address to listen on (the metrics endpoint too)")
+    parser.add_argument("--port", type=int, default=PORT, help="port to listen on")
+    parser.add_argument(
+        "--mode",
+        choices=("threads", "asyncio"),
+        default="threads",
+        help="threads: one thread per connection; asyncio: a single event loop",
+    )
+    parser.add_argument(
+        "--max-spectators",
+        type=int,
+        default=MAX_SPECTATORS_PER_GAME,
+        help="spectators allowed per game on this server (relays count as one)",
+    )
+    parser.add_argument(
+        "--heartbeat-interval",
+        type=float,
+        default=HEARTBEAT_INTERVAL,
+        help="seconds of silence before a heartbeat client is pinged",
+    )
+    parser.add_argument(
+        "--heartbeat-timeout",
+        type=float,
+        default=HEARTBEAT_TIMEOUT,
+        help="seconds of silence before a connection is closed as dead",
+    )
+    parser.add_argument(
+        "--resume-grace",
+        type=float,
+        default=RESUME_GRACE,
+        help="seconds a game waits for a disconnected player to resume (0 ends it at once)",
+    )
+    parser.add_argument(
+        "--journal",
+        metavar="PATH",
+        help="journal games to PATH and recover them from it on startup",
+    )
+    parser.add_argument(
+        "--archive",
+        metavar="DIR",
+        help="archive finished games in DIR (export them with game_archive.py)",
+    )
+    parser.add_argument(
+        "--metrics-port",
+        type=int,
+        metavar="PORT",
+        help="serve Prometheus metrics on http://HOST:PORT/metrics (worker N uses PORT+N)",
+    )
+    parser.add_argument(
+        "--log-level",
+        choices=tuple(event_log.LEVELS),
+        default="info",
+        help="least severe log records to keep (debug logs every command received)",
+    )
+    parser.add_argument(
+        "--log-file",
+        metavar="PATH",
+        help="write JSON-lines logs to PATH instead of stdout (worker N writes PATH.N)",
+    )
+    parser.add_argument(
+        "--log-sample",
+        action="append",
+        metavar="CATEGORY=N",
+        help="keep one in N log records of a category, e.g. game=100 (repeatable)",
+    )
+    parser.add_argument(
+        "--rate-limit",
+        action="append",
+        metavar="KIND=RATE/BURST",
+        help="per-connection command limit, e.g. chat=1/5 or move=off (repeatable); kinds are "
+        + ", ".join(rate_limit.DEFAULT_LIMITS),
+    )
+    parser.add_argument(
+        "--max-connections",
+        type=int,
+        default=admission.DEFAULT_LIMITS["connections"],
+        help="open connections allowed (per worker); past it new ones get BUSY at once",
+    )
+    parser.add_argument(
+        "--max-waiting",
+        type=int,
+        default=admission.DEFAULT_LIMITS["waiting"],
+        help="players allowed in the matchmaking queue before new players get BUSY",
+    )
+    parser.add_argument(
+        "--max-spectating",
+        type=int,
+        default=admission.DEFAULT_LIMITS["spectators"],
+        help="spectators allowed in all (per worker) before new spectators get BUSY",
+    )
+    parser.add_argument(
+        "--resume-reserve",
+        type=int,
+        default=admission.DEFAULT_LIMITS["reserve"],
+        help="connections under --max-connections kept for players resuming a game",
+    )
+    parser.add_argument(
+        "--busy-retry",
+        type=float,
+        default=admission.RETRY_AFTER,
+        help="seconds refused clients are told to wait (jittered up to twice that)",
+    )
+    parser.add_argument(
+        "--position-cache-mb",
+        type=float,
+        default=position_cache.DEFAULT_MAX_BYTES / 2**20,
+        help="memory for positions shared between games (legal moves, game over, FEN); 0 turns it off",
+    )
+    parser.add_argument(
+        "--engine-workers",
+        type=int,
+        default=0,
+        help="processes searching moves for games against the engine (per worker); 0 shares the CPUs out",
+    )
+    parser.add_argument(
+        "--engine-max-time",
+        type=float,
+        default=engine.MAX_SECONDS,
+        help="longest the engine may search for one move, in seconds",
+    )
+    parser.add_argument(
+        "--max-engine-games",
+        type=int,
+        default=admission.DEFAULT_LIMITS["engines"],
+        help="games against the engine allowed (per worker) before new ones get BUSY",
+    )
+    parser.add_argument(
+        "--backlog",
+        type=int,
+        default=BACKLOG,
+        help="listen() backlog of connections waiting to be accepted",
+    )
+    parser.add_argument(
+        "--handoff",
+        metavar="PATH",
+        help="let a new server process take over this one's connections and games via the Unix socket PATH",
+    )
+    parser.add_argument(
+        "--takeover",
+        metavar="PATH",
+        help="take over the connections and games of the server started with --handoff PATH, then serve them",
+    )
+    parser.add_argument(
+        "--workers",
+        type=int,
+        default=1,
+        help="number of worker processes sharing the port via SO_REUSEPORT",
+    )
+    args = parser.parse_args()
+    try:
+        args.rate_limit = rate_limit.parse_limits(args.rate_limit)
+    except ValueError as e:
+        parser.error(f"--rate-limit: {e}")
+    if args.workers > 1 and (args.handoff or args.takeover):
+        parser.error("--handoff and --takeover work with a single process, not --workers")
+    if args.engine_max_time < engine.MIN_SECONDS:
+        parser.error(f"--engine-max-time must be at least {engine.MIN_SECONDS} seconds")
+    return args
 
 
 if __name__ == "__main__":
-    start_server()
+    args = parse_args()
+    HOST = args.host
+    PORT = args.port
+    MAX_SPECTATORS_PER_GAME = args.max_spectators
+    HEARTBEAT_INTERVAL = args.heartbeat_interval
+    HEARTBEAT_TIMEOUT = args.heartbeat_timeout
+    RESUME_GRACE = args.resume_grace
+    JOURNAL_PATH = args.journal
+    ARCHIVE_DIR = args.archive
+    METRICS_PORT = args.metrics_port
+    LOG_FILE = args.log_file
+    RATE_LIMITS = args.rate_limit
+    BACKLOG = args.backlog
+    HANDOFF_PATH = args.handoff
+    if HANDOFF_PATH and args.mode == "threads":
+        input_gate = hot_restart.Gate()
+    admission_control = admission.Admission(
+        {
+            "connections": args.max_connections,
+            "waiting": args.max_waiting,
+            "engines": args.max_engine_games,
+            "spectators": args.max_spectating,
+            "reserve": args.resume_reserve,
+        },
+        args.busy_retry,
+    )
+    positions = position_cache.PositionCache(int(args.position_cache_mb * 2**20))
+    engines = engine.EnginePool(
+        args.engine_workers or max(1, (os.cpu_count() or 1) // max(1, args.workers)), args.engine_max_time
+    )
+    log.configure(level=args.log_level, sample=event_log.parse_sampling(args.log_sample))
+    if args.workers <= 1:
+        if LOG_FILE:
+            log.configure(path=LOG_FILE)
+    if args.workers <= 1 and not args.takeover:  # A successor opens them once its predecessor lets go
+        if METRICS_PORT:
+            serve_metrics(METRICS_PORT)
+        if JOURNAL_PATH:
+            journal = recover_games(JOURNAL_PATH)
+        if ARCHIVE_DIR:
+            archive = open_archive(ARCHIVE_DIR)
+    if args.takeover:
+        take_over(args.takeover, args.mode)
+    elif args.workers > 1:
+        cluster = worker_cluster.WorkerCluster(args.workers, PORT)
+        worker_cluster.run_workers(cluster, lambda index: run_worker(index, args.mode))
+    elif args.mode == "asyncio":
+        start_async_server()
+    else:
+        start_server()
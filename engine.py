@@ -0,0 +1,494 @@
+"""The built-in engine for games against the computer, searching in a pool of worker processes.
+
+The search is a plain alpha-beta (negamax) over python-chess boards with
+iterative deepening, a transposition table, captures-first move ordering
+(the previous iteration's best move ahead of everything) and a quiescence
+search of captures at the horizon. It evaluates material and piece
+placement. Strength is a depth and a time budget per move: the search
+deepens one ply at a time up to the depth and plays the best move of the
+deepest iteration it finished in time. The first ply is always finished.
+
+Searches run in worker processes (ProcessPoolExecutor), so they never hold
+up the threads or the event loop serving sockets. An EnginePool queues the
+games whose engine is to move, at most one search per game, and starts
+them oldest first as workers come free. Each game therefore gets one search
+per turn of the queue, however many games there are. When the queue grows
+past the workers, every search gets less time, so moves keep coming within
+about QUEUE_TARGET seconds and the engine plays weaker instead of slower.
+The result of a search is handed back like the flag scheduler's expiries:
+to a callback on a thread of its own, or on the event loop in asyncio mode.
+
+Each worker keeps its transposition table between searches, up to
+TABLE_SIZE entries, so a game's next search often starts from what its last
+one found.
+"""
+
+import collections
+import concurrent.futures
+import math
+import multiprocessing
+import os
+import queue
+import signal
+import threading
+import time
+
+import chess
+
+import metrics
+from event_log import log
+from termination import position_key
+
+DEFAULT_DEPTH = 4
+MAX_DEPTH = 8
+DEFAULT_SECONDS = 1.0  # Per move, when only a depth is asked for the server's cap applies instead
+MAX_SECONDS = 10.0  # Most a search may take, whatever was asked for
+MIN_SECONDS = 0.05  # Least a search gets when the queue is long; the first ply is finished regardless
+QUEUE_TARGET = 2.0  # Seconds a queued game should wait for a worker, for sharing out time
+MOVES_TO_GO = 30  # A timed game's engine spends at most its remaining time over this many moves
+TABLE_SIZE = 1 << 18  # Transposition table entries per worker; the table is cleared when full
+CHECK_EVERY = 1024  # Nodes between looks at the clock
+
+MATE = 100_000
+INFINITY = 1_000_000
+EXACT, LOWER, UPPER = 0, 1, 2
+
+searches = metrics.registry.counter("chess_engine_searches_total", "Engine searches finished.")
+search_seconds = metrics.registry.histogram("chess_engine_search_seconds", "Time an engine search took.")
+wait_seconds = metrics.registry.histogram(
+    "chess_engine_wait_seconds", "Time a game waited for an engine worker."
+)
+failures = metrics.registry.counter("chess_engine_failures_total", "Engine searches that raised.")
+
+VALUES = {
+    chess.PAWN: 100, chess.KNIGHT: 320, chess.BISHOP: 330,
+    chess.ROOK: 500, chess.QUEEN: 900, chess.KING: 0,
+}
+
+# Piece-square tables from White's side, rank 8 first as they are usually written
+_TABLES = {
+    chess.PAWN: (
+        0, 0, 0, 0, 0, 0, 0, 0,
+        50, 50, 50, 50, 50, 50, 50, 50,
+        10, 10, 20, 30, 30, 20, 10, 10,
+        5, 5, 10, 25, 25, 10, 5, 5,
+        0, 0, 0, 20, 20, 0, 0, 0,
+        5, -5, -10, 0, 0, -10, -5, 5,
+        5, 10, 10, -20, -20, 10, 10, 5,
+        0, 0, 0, 0, 0, 0, 0, 0,
+    ),
+    chess.KNIGHT: (
+        -50, -40, -30, -30, -30, -30, -40, -50,
+        -40, -20, 0, 0, 0, 0, -20, -40,
+        -30, 0, 10, 15, 15, 10, 0, -30,
+        -30, 5, 15, 20, 20, 15, 5, -30,
+        -30, 0, 15, 20, 20, 15, 0, -30,
+        -30, 5, 10, 15, 15, 10, 5, -30,
+        -40, -20, 0, 5, 5, 0, -20, -40,
+        -50, -40, -30, -30, -30, -30, -40, -50,
+    ),
+    chess.BISHOP: (
+        -20, -10, -10, -10, -10, -10, -10, -20,
+        -10, 0, 0, 0, 0, 0, 0, -10,
+        -10, 0, 5, 10, 10, 5, 0, -10,
+        -10, 5, 5, 10, 10, 5, 5, -10,
+        -10, 0, 10, 10, 10, 10, 0, -10,
+        -10, 10, 10, 10, 10, 10, 10, -10,
+        -10, 5, 0, 0, 0, 0, 5, -10,
+        -20, -10, -10, -10, -10, -10, -10, -20,
+    ),
+    chess.ROOK: (
+        0, 0, 0, 0, 0, 0, 0, 0,
+        5, 10, 10, 10, 10, 10, 10, 5,
+        -5, 0, 0, 0, 0, 0, 0, -5,
+        -5, 0, 0, 0, 0, 0, 0, -5,
+        -5, 0, 0, 0, 0, 0, 0, -5,
+        -5, 0, 0, 0, 0, 0, 0, -5,
+        -5, 0, 0, 0, 0, 0, 0, -5,
+        0, 0, 0, 5, 5, 0, 0, 0,
+    ),
+    chess.QUEEN: (
+        -20, -10, -10, -5, -5, -10, -10, -20,
+        -10, 0, 0, 0, 0, 0, 0, -10,
+        -10, 0, 5, 5, 5, 5, 0, -10,
+        -5, 0, 5, 5, 5, 5, 0, -5,
+        0, 0, 5, 5, 5, 5, 0, -5,
+        -10, 5, 5, 5, 5, 5, 0, -10,
+        -10, 0, 5, 0, 0, 0, 0, -10,
+        -20, -10, -10, -5, -5, -10, -10, -20,
+    ),
+    chess.KING: (
+        -30, -40, -40, -50, -50, -40, -40, -30,
+        -30, -40, -40, -50, -50, -40, -40, -30,
+        -30, -40, -40, -50, -50, -40, -40, -30,
+        -30, -40, -40, -50, -50, -40, -40, -30,
+        -20, -30, -30, -40, -40, -30, -30, -20,
+        -10, -20, -20, -20, -20, -20, -20, -10,
+        20, 20, 0, 0, 0, 0, 20, 20,
+        20, 30, 10, 0, 0, 10, 30, 20,
+    ),
+}
+_KING_ENDGAME = (
+    -50, -40, -30, -20, -20, -30, -40, -50,
+    -30, -20, -10, 0, 0, -10, -20, -30,
+    -30, -10, 20, 30, 30, 20, -10, -30,
+    -30, -10, 30, 40, 40, 30, -10, -30,
+    -30, -10, 30, 40, 40, 30, -10, -30,
+    -30, -10, 20, 30, 30, 20, -10, -30,
+    -30, -30, 0, 0, 0, 0, -30, -30,
+    -50, -30, -30, -30, -30, -30, -30, -50,
+)
+
+
+def _by_square(table, value):
+    """(White's, Black's) value of a piece on each square a1..h8, material included."""
+    white = tuple(value + table[square ^ 56] for square in chess.SQUARES)
+    black = tuple(value + table[square] for square in chess.SQUARES)
+    return white, black
+
+
+SQUARE_VALUES = {piece_type: _by_square(table, VALUES[piece_type]) for piece_type, table in _TABLES.items()}
+KING_ENDGAME = _by_square(_KING_ENDGAME, 0)
+
+
+def parse_strength(params, max_seconds=MAX_SECONDS):
+    """(depth, seconds per move) from the choice line's depth= and time=, or None if they are invalid.
+
+    With only a depth the search may take up to max_seconds; with only a
+    time it deepens as far as MAX_DEPTH.
+    """
+    try:
+        depth = int(params["depth"]) if "depth" in params else None
+        seconds = float(params["time"]) if "time" in params else None
+    except ValueError:
+        return None
+    if depth is not None and not 1 <= depth <= MAX_DEPTH:
+        return None
+    if seconds is not None and not 0 < seconds <= max_seconds:
+        return None
+    if depth is None and seconds is None:
+        return DEFAULT_DEPTH, min(DEFAULT_SECONDS, max_seconds)
+    return depth or MAX_DEPTH, seconds or max_seconds
+
+
+def evaluate(board):
+    """Material and piece placement in centipawns, from the side to move's point of view."""
+    score = 0
+    endgame = not board.queens
+    for piece_type, (white, black) in SQUARE_VALUES.items():
+        if piece_type == chess.KING and endgame:
+            white, black = KING_ENDGAME
+        for square in chess.scan_forward(board.pieces_mask(piece_type, chess.WHITE)):
+            score += white[square]
+        for square in chess.scan_forward(board.pieces_mask(piece_type, chess.BLACK)):
+            score -= black[square]
+    return score if board.turn == chess.WHITE else -score
+
+
+def _ordered(board, moves, first=None):
+    """Moves with ``first`` ahead, then captures and promotions by what they win, then the rest."""
+
+    def gain(move):
+        if move == first:
+            return INFINITY
+        victim = board.piece_type_at(move.to_square)
+        if victim is None and board.is_en_passant(move):
+            victim = chess.PAWN
+        score = 0
+        if victim is not None:
+            score = 10 * VALUES[victim] - VALUES[board.piece_type_at(move.from_square)] + 1
+        if move.promotion:
+            score += VALUES[move.promotion]
+        return score
+
+    return sorted(moves, key=gain, reverse=True)
+
+
+class _OutOfTime(Exception):
+    pass
+
+
+_table = {}  # position_key -> (depth, EXACT/LOWER/UPPER, score, best move), kept between searches
+
+
+class _Search:
+    """One search from one position; the board is a private copy it plays moves on."""
+
+    def __init__(self, board, seen, deadline):
+        self.board = board
+        self.seen = seen  # Position keys of the game so far and the current line: repeating one scores a draw
+        self.deadline = deadline
+        self.nodes = 0
+
+    def _tick(self):
+        self.nodes += 1
+        if self.nodes % CHECK_EVERY == 0 and time.monotonic() > self.deadline:
+            raise _OutOfTime()
+
+    def root(self, depth, first):
+        """(score, best move) of a full-width search depth plies deep."""
+        board = self.board
+        key = position_key(board)
+        self.seen.add(key)
+        alpha = -INFINITY
+        best = None
+        for move in _ordered(board, board.generate_legal_moves(), first):
+            board.push(move)
+            score = -self.negamax(depth - 1, -INFINITY, -alpha, 1)
+            board.pop()
+            if score > alpha:
+                alpha, best = score, move
+        self.seen.discard(key)
+        _table[key] = (depth, EXACT, alpha, best)
+        return alpha, best
+
+    def negamax(self, depth, alpha, beta, ply):
+        self._tick()
+        board = self.board
+        key = position_key(board)
+        if key in self.seen or board.halfmove_clock >= 100:
+            return 0
+        if depth <= 0:
+            return self.quiesce(alpha, beta, ply)
+        entry = _table.get(key)
+        first = None
+        if entry is not None:
+            entry_depth, bound, score, first = entry
+            if entry_depth >= depth:
+                # Mate scores are stored relative to the position, not the root
+                if score > MATE // 2:
+                    score -= ply
+                elif score < -MATE // 2:
+                    score += ply
+                if bound == EXACT or (bound == LOWER and score >= beta) or (bound == UPPER and score <= alpha):
+                    return score
+        moves = _ordered(board, board.generate_legal_moves(), first)
+        if not moves:
+            return -MATE + ply if board.is_check() else 0
+        original_alpha = alpha
+        best_score = -INFINITY
+        best = None
+        self.seen.add(key)
+        for move in moves:
+            board.push(move)
+            score = -self.negamax(depth - 1, -beta, -alpha, ply + 1)
+            board.pop()
+            if score > best_score:
+                best_score, best = score, move
+                if score > alpha:
+                    alpha = score
+                    if alpha >= beta:
+                        break
+        self.seen.discard(key)
+        bound = UPPER if best_score <= original_alpha else LOWER if best_score >= beta else EXACT
+        stored = best_score
+        if stored > MATE // 2:
+            stored += ply
+        elif stored < -MATE // 2:
+            stored -= ply
+        if len(_table) >= TABLE_SIZE:
+            _table.clear()
+        _table[key] = (depth, bound, stored, best)
+        return best_score
+
+    def quiesce(self, alpha, beta, ply):
+        """Plays out captures until the position is quiet, so the horizon does not cut an exchange in half."""
+        self._tick()
+        board = self.board
+        stand_pat = evaluate(board)
+        if stand_pat >= beta:
+            return stand_pat
+        if stand_pat > alpha:
+            alpha = stand_pat
+        for move in _ordered(board, board.generate_legal_captures()):
+            board.push(move)
+            score = -self.quiesce(-beta, -alpha, ply + 1)
+            board.pop()
+            if score >= beta:
+                return score
+            if score > alpha:
+                alpha = score
+        return alpha
+
+
+def choose_move(moves, depth, seconds):
+    """Searches the position after ``moves`` (UCI, space-separated, from the start position).
+
+    Returns (move UCI, depth finished, score in centipawns, nodes). Runs in
+    a worker process.
+    """
+    board = chess.Board()
+    seen = set()
+    for move_uci in moves.split():
+        seen.add(position_key(board))
+        board.push_uci(move_uci)
+    legal = list(board.generate_legal_moves())
+    if len(legal) == 1:
+        return legal[0].uci(), 0, 0, 0
+    deadline = time.monotonic() + seconds
+    search = _Search(board, seen, math.inf)  # The first ply is finished whatever the time
+    best, reached, score = legal[0], 0, 0
+    for ply in range(1, depth + 1):
+        try:
+            score, best = search.root(ply, best)
+        except _OutOfTime:
+            break
+        reached = ply
+        search.deadline = deadline
+        if abs(score) > MATE // 2 or time.monotonic() > deadline:
+            break  # A forced mate is not going to change
+    return best.uci(), reached, score, search.nodes
+
+
+def _start_worker():
+    """Runs in each worker process before its first search."""
+    signal.signal(signal.SIGINT, signal.SIG_IGN)  # Ctrl-C is for the server, which stops the pool
+    parent = multiprocessing.parent_process()
+
+    def exit_with_parent():
+        parent.join()  # Also when the server exits without shutting the pool down, e.g. after a hot restart
+        os._exit(0)
+
+    threading.Thread(target=exit_with_parent, daemon=True).start()
+
+
+class Job:
+    """One game's request for an engine move, and the move once found."""
+
+    __slots__ = (
+        "game_id", "seq", "moves", "depth", "seconds", "queued", "started", "executor",
+        "move", "reached", "score", "nodes",
+    )
+
+    def __init__(self, game_id, seq, moves, depth, seconds):
+        self.game_id = game_id
+        self.seq = seq  # Plies played when it was asked for; the move is for that position only
+        self.moves = moves
+        self.depth = depth
+        self.seconds = seconds
+        self.queued = time.monotonic()
+        self.started = None  # None while queued
+        self.executor = None  # The ProcessPoolExecutor searching it
+        self.move = None  # UCI; stays None if the search failed
+        self.reached = self.score = self.nodes = 0
+
+
+class EnginePool:
+    """The process's engine searches: a FIFO of games waiting for a worker and the workers themselves."""
+
+    def __init__(self, workers=None, max_seconds=MAX_SECONDS):
+        self.workers = workers or os.cpu_count() or 1
+        self.max_seconds = max_seconds
+        self.executor = None  # Started with the first search
+        self.lock = threading.Lock()
+        self.queue = collections.deque()  # Live jobs waiting for a worker, oldest first
+        self.jobs = {}  # game_id -> its Job, queued or running
+        self.running = 0
+        self.deliver = None  # Set by run() or run_on_loop()
+
+    def __len__(self):
+        return len(self.jobs)
+
+    def submit(self, game_id, seq, moves, depth, seconds):
+        """Asks for the engine's move in a game. Does nothing if that position is already being searched."""
+        with self.lock:
+            job = self.jobs.get(game_id)
+            if job is not None and job.seq == seq:
+                return
+            self._forget(game_id)
+            job = self.jobs[game_id] = Job(game_id, seq, moves, depth, min(seconds, self.max_seconds))
+            self.queue.append(job)
+            self._dispatch()
+
+    def cancel(self, game_id):
+        """Forgets a game's search. A queued one leaves the queue; a running one finishes and is dropped."""
+        with self.lock:
+            self._forget(game_id)
+
+    def _forget(self, game_id):
+        """Drops a game's job, taking it out of the queue if it has not started. Caller holds the lock."""
+        job = self.jobs.pop(game_id, None)
+        if job is not None and job.started is None:
+            self.queue.remove(job)  # Linear, but the queue holds at most one job per engine game
+
+    def _dispatch(self):
+        """Starts queued searches on free workers. Caller holds the lock."""
+        if self.deliver is None:
+            return
+        while self.running < self.workers and self.queue:
+            job = self.queue.popleft()
+            # Everyone queued behind waits for this search too: share the workers' time out
+            share = QUEUE_TARGET * self.workers / max(1, len(self.queue))
+            seconds = max(MIN_SECONDS, min(job.seconds, share))
+            if self.executor is None:
+                self.executor = concurrent.futures.ProcessPoolExecutor(
+                    self.workers, mp_context=_context(), initializer=_start_worker
+                )
+            job.started = time.monotonic()
+            job.executor = self.executor
+            future = self.executor.submit(choose_move, job.moves, job.depth, seconds)
+            self.running += 1
+            deliver = self.deliver
+            future.add_done_callback(lambda future, job=job: deliver(job, future))
+
+    def _finish(self, job, future, on_move):
+        with self.lock:
+            self.running -= 1
+            current = self.jobs.get(job.game_id) is job
+            if current:
+                del self.jobs[job.game_id]
+            try:
+                job.move, job.reached, job.score, job.nodes = future.result()
+            except concurrent.futures.process.BrokenProcessPool as e:
+                # A worker died (e.g. killed for memory): start a new pool and search again
+                if job.executor is self.executor:  # Not yet replaced for another of its searches
+                    log.error("engine", "worker pool broke, restarting it", error=repr(e))
+                    self.executor.shutdown(wait=False, cancel_futures=True)
+                    self.executor = None
+                if current:
+                    job.started = None
+                    self.jobs[job.game_id] = job
+                    self.queue.appendleft(job)
+                    current = False
+            except Exception as e:
+                failures.inc()
+                log.error("engine", "search failed", game=job.game_id, error=repr(e))
+            self._dispatch()
+        if not current:
+            return
+        now = time.monotonic()
+        searches.inc()
+        wait_seconds.observe(job.started - job.queued)
+        search_seconds.observe(now - job.started)
+        on_move(job)
+
+    def run(self, on_move):
+        """Calls on_move(job) with each finished search from a daemon thread."""
+        finished = queue.SimpleQueue()
+
+        def loop():
+            while True:
+                job, future = finished.get()
+                try:
+                    self._finish(job, future, on_move)
+                except Exception as e:
+                    log.error("engine", "delivering a move failed", game=job.game_id, error=repr(e))
+
+        threading.Thread(target=loop, daemon=True).start()
+        with self.lock:
+            self.deliver = lambda job, future: finished.put((job, future))
+            self._dispatch()  # Asked for before the pool ran, e.g. by a hot restart
+
+    def run_on_loop(self, loop, on_move):
+        """Like run(), calling on_move on an asyncio event loop."""
+        with self.lock:
+            self.deliver = lambda job, future: loop.call_soon_threadsafe(self._finish, job, future, on_move)
+            self._dispatch()
+
+
+def _context():
+    # Forked workers would inherit every client socket open at the time and
+    # keep those connections alive after the server closes them
+    if "forkserver" in multiprocessing.get_all_start_methods():
+        return multiprocessing.get_context("forkserver")
+    return multiprocessing.get_context("spawn")
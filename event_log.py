@@ -0,0 +1,164 @@
+"""Asynchronous, batched, structured logging for the server and the relay.
+
+Logging a record only checks the level and the category's sampling rate and
+appends a tuple to a bounded deque; nothing is formatted or written on the
+caller's thread, and no lock is taken. A writer thread wakes every
+FLUSH_INTERVAL (or sooner when the buffer fills up), turns everything queued
+into JSON lines and writes them with one write() and one flush().
+
+When the buffer is full, records are dropped and counted rather than making
+the caller wait; the writer reports each batch of drops as a warning record,
+and the counts are in the metrics (chess_log_dropped_total).
+
+    {"ts": 1792212406.567, "level": "info", "cat": "game", "msg": "started", "game": "0dc0a422", ...}
+
+Levels are debug, info, warning and error ("off" silences everything).
+Sampling keeps one record in N for a category, e.g. {"game": 100}.
+"""
+
+import atexit
+import collections
+import itertools
+import json
+import os
+import sys
+import threading
+import time
+
+import metrics
+
+LEVELS = {"debug": 10, "info": 20, "warning": 30, "error": 40, "off": 100}
+BUFFER_RECORDS = 65536  # Records queued before new ones are dropped
+FLUSH_INTERVAL = 0.05  # Seconds between writer passes
+
+logged = metrics.registry.counter("chess_log_records_total", "Log records written.")
+dropped = metrics.registry.counter(
+    "chess_log_dropped_total", "Log records dropped because the log buffer was full."
+)
+
+
+def _json_default(value):
+    return str(value)
+
+
+class EventLog:
+    def __init__(self):
+        self.records = collections.deque()
+        self.level = LEVELS["info"]
+        self.sampling = {}  # category -> (keep one in N, itertools.count())
+        self.fields = {}  # Added to every record, e.g. {"worker": 2}
+        self.out = sys.stdout
+        self.wakeup = threading.Event()
+        self.drain_lock = threading.Lock()  # The writer thread and flush() at exit
+        self.start_lock = threading.Lock()
+        self.thread = None
+        self.reported_drops = 0
+
+    def configure(self, level=None, sample=None, path=None, fields=None):
+        """Sets the level name, the {category: N} sampling, the output file (stdout if None) and static fields."""
+        if level is not None:
+            self.level = LEVELS[level]
+        if sample is not None:
+            self.sampling = {category: (every, itertools.count()) for category, every in sample.items()}
+        if path is not None:
+            self.out = open(path, "a", encoding="utf-8", buffering=1024 * 1024)
+        if fields is not None:
+            self.fields = dict(fields)
+
+    def enabled(self, level):
+        return LEVELS[level] >= self.level
+
+    def log(self, level, category, message, fields):
+        if LEVELS[level] < self.level:
+            return
+        sampling = self.sampling.get(category)
+        if sampling is not None and next(sampling[1]) % sampling[0]:
+            return
+        records = self.records
+        if len(records) >= BUFFER_RECORDS:
+            dropped.inc()
+            return
+        records.append((time.time(), level, category, message, fields))
+        if self.thread is None:
+            self._start()
+        elif len(records) == BUFFER_RECORDS // 2:
+            self.wakeup.set()  # Filling up faster than the writer's interval
+
+    def debug(self, category, message, **fields):
+        self.log("debug", category, message, fields)
+
+    def info(self, category, message, **fields):
+        self.log("info", category, message, fields)
+
+    def warning(self, category, message, **fields):
+        self.log("warning", category, message, fields)
+
+    def error(self, category, message, **fields):
+        self.log("error", category, message, fields)
+
+    def _start(self):
+        with self.start_lock:
+            if self.thread is None:
+                self.thread = threading.Thread(target=self._run, daemon=True)
+                self.thread.start()
+
+    def _run(self):
+        while True:
+            self.wakeup.wait(FLUSH_INTERVAL)
+            self.wakeup.clear()
+            self.flush()
+
+    def flush(self):
+        """Writes everything queued so far."""
+        with self.drain_lock:
+            lines = []
+            pop = self.records.popleft  # Only this thread pops, so len() items are there
+            static = self.fields
+            for _ in range(len(self.records)):  # Not more: under a flood, write and come back
+                ts, level, category, message, fields = pop()
+                record = {"ts": round(ts, 6), "level": level, "cat": category, "msg": message}
+                record.update(static)
+                record.update(fields)
+                lines.append(json.dumps(record, default=_json_default))
+            drops = dropped.value()
+            if drops != self.reported_drops:
+                record = {
+                    "ts": round(time.time(), 6), "level": "warning", "cat": "log",
+                    "msg": "log buffer full, records dropped", "dropped": drops - self.reported_drops,
+                }
+                record.update(static)
+                lines.append(json.dumps(record))
+                self.reported_drops = drops
+            if not lines:
+                return
+            lines.append("")
+            try:
+                self.out.write("\n".join(lines))
+                self.out.flush()
+            except (OSError, ValueError):
+                return  # Nowhere left to write, e.g. stdout closed
+            logged.inc(len(lines) - 1)
+
+
+def _after_fork():
+    # Only the forking thread survives; the child starts its own writer
+    log.thread = None
+    log.wakeup = threading.Event()
+    log.drain_lock = threading.Lock()
+    log.start_lock = threading.Lock()
+
+
+log = EventLog()  # The process's log
+atexit.register(log.flush)
+if hasattr(os, "register_at_fork"):
+    # Written before forking, so children do not write the parent's records again
+    os.register_at_fork(before=log.flush, after_in_child=_after_fork)
+
+
+def parse_sampling(specs):
+    """Turns ["game=100", "conn=10"] into {"game": 100, "conn": 10}."""
+    sampling = {}
+    for spec in specs or ():
+        category, _, every = spec.partition("=")
+        sampling[category] = max(1, int(every))
+    return sampling
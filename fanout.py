@@ -0,0 +1,284 @@
+"""Outbound fan-out: bounded per-connection queues drained by non-blocking writes.
+
+Senders never touch the socket. They append already-encoded bytes to the
+connection's Outbox and return; a single writer (the SocketWriter thread for
+threaded connections, the event loop for asyncio ones) drains the queue.
+Everything queued since the last drain goes out in one vectored write, so the
+BOARD/INFO/TURN burst after a move costs one syscall per recipient.
+
+A connection whose queue grows past HIGH_WATER bytes is behind. Its
+``on_overflow`` callback may return a smaller replacement (for spectators, a
+fresh snapshot of the game); otherwise, or after MAX_OVERFLOWS, it is dropped.
+
+Low-priority data (chat) goes into a second lane that is only written once
+the first one is empty, so it never delays the moves queued with it, and is
+shed instead of queued once the connection has LOW_WATER bytes outstanding.
+"""
+
+import collections
+import os
+import selectors
+import socket
+import threading
+import time
+
+HIGH_WATER = 256 * 1024  # Bytes queued for one connection before it counts as lagging
+LOW_WATER = 64 * 1024  # Bytes outstanding for one connection before low-priority data is shed
+MAX_OVERFLOWS = 3  # Snapshot resets allowed before a lagging connection is dropped
+CLOSE_LINGER = 5.0  # Seconds a closing connection may take to flush its queue
+MAX_IOV = min(64, os.sysconf("SC_IOV_MAX") if hasattr(os, "sysconf") else 64)
+NONBLOCKING_SEND = hasattr(socket, "MSG_DONTWAIT") and hasattr(socket.socket, "sendmsg")
+
+
+class Outbox:
+    """Bounded queue of encoded chunks waiting to be written to one connection."""
+
+    def __init__(self, high_water=HIGH_WATER, pending_elsewhere=None, low_water=LOW_WATER):
+        self.lock = threading.Lock()
+        self.chunks = collections.deque()
+        self.low = collections.deque()  # Low-priority chunks, written once chunks is empty
+        self.size = 0  # Both lanes
+        self.high_water = high_water
+        self.low_water = low_water
+        self.sending_low = False  # Which lane the last peek() returned
+        self.low_partial = False  # The low lane's head has been partly written
+        self.overflows = 0
+        self.dropped = False
+        self.on_overflow = None  # callable() -> list of bytes to send instead, or None
+        # Bytes already handed to a lower layer (e.g. an asyncio transport buffer)
+        self.pending_elsewhere = pending_elsewhere or (lambda: 0)
+
+    def push(self, data):
+        """Queues data. Returns False if the connection has been dropped for lagging."""
+        with self.lock:
+            if self.dropped:
+                return False
+            self.chunks.append(data)
+            self.size += len(data)
+            if self.size + self.pending_elsewhere() > self.high_water:
+                self._overflow()
+            return not self.dropped
+
+    def push_low(self, data):
+        """Queues data behind everything else. Returns False if it was shed because the connection is behind."""
+        with self.lock:
+            if self.dropped or self.size + len(data) + self.pending_elsewhere() > self.low_water:
+                return False
+            self.low.append(data)
+            self.size += len(data)
+            return True
+
+    def _overflow(self):
+        self.overflows += 1
+        self.chunks.clear()
+        self.low.clear()
+        self.low_partial = False
+        self.size = 0
+        replacement = None
+        if self.on_overflow and self.overflows <= MAX_OVERFLOWS:
+            replacement = self.on_overflow()
+        if replacement is None:
+            self.dropped = True
+            return
+        for data in replacement:
+            self.chunks.append(data)
+            self.size += len(data)
+
+    def peek(self, max_chunks=MAX_IOV):
+        """The next chunks to write, all from one lane: the first, unless a low chunk is half written."""
+        with self.lock:
+            self.sending_low = self.low_partial or not self.chunks
+            lane = self.low if self.sending_low else self.chunks
+            return [lane[i] for i in range(min(max_chunks, len(lane)))]
+
+    def queued(self):
+        """Every byte still to be written, in the order it would go out, left in place."""
+        with self.lock:
+            low = list(self.low)
+            head = low[:1] if self.low_partial else []  # Finished before anything else
+            return b"".join(head + list(self.chunks) + low[len(head) :])
+
+    def take_all(self):
+        with self.lock:
+            chunks = list(self.chunks)
+            chunks.extend(self.low)
+            self.chunks.clear()
+            self.low.clear()
+            self.low_partial = False
+            self.size = 0
+            return chunks
+
+    def consume(self, nbytes):
+        """Drops nbytes from the front of the lane peek() returned after a (possibly partial) write."""
+        with self.lock:
+            self.size -= nbytes
+            lane = self.low if self.sending_low else self.chunks
+            partial = False
+            while nbytes and lane:
+                head = lane[0]
+                if len(head) <= nbytes:
+                    nbytes -= len(head)
+                    lane.popleft()
+                else:
+                    lane[0] = head[nbytes:]
+                    nbytes = 0
+                    partial = True
+            if self.sending_low:
+                self.low_partial = partial
+            if not self.chunks:
+                self.overflows = 0  # Caught up again
+
+    def __len__(self):
+        return self.size
+
+
+class SocketWriter:
+    """Drains the outboxes of all blocking-socket connections from one thread.
+
+    Connections are scheduled when data is queued; sockets that would block
+    are parked in a selector until they become writable again.
+    """
+
+    def __init__(self):
+        self.lock = threading.Lock()
+        self.ready = set()
+        self.blocked = set()
+        self.closing = {}  # conn -> deadline
+        self.thread = None
+        self.pausing = False
+
+    def _ensure_started(self):
+        # The selector and wake-up pair are created on first use so that forked
+        # worker processes never share them
+        if self.thread is None:
+            with self.lock:
+                if self.thread is None:
+                    self.selector = selectors.DefaultSelector()
+                    self._wake_r, self._wake_w = socket.socketpair()
+                    self._wake_r.setblocking(False)
+                    self._wake_w.setblocking(False)
+                    self.selector.register(self._wake_r, selectors.EVENT_READ)
+                    self.thread = threading.Thread(target=self._run, daemon=True)
+                    self.thread.start()
+
+    def schedule(self, conn):
+        self._ensure_started()
+        with self.lock:
+            wake = not self.ready
+            self.ready.add(conn)
+        if wake:
+            try:
+                self._wake_w.send(b"\0")
+            except BlockingIOError:
+                pass  # Wake-up already pending
+
+    def pause(self):
+        """Stops the writer thread between passes and returns once it has; queued data stays queued.
+
+        Used by a hot restart, which hands what is still queued to the next process.
+        """
+        if self.thread is None:
+            return
+        self.pausing = True
+        try:
+            self._wake_w.send(b"\0")
+        except BlockingIOError:
+            pass
+        self.thread.join()
+
+    def resume(self):
+        """Restarts the writer after pause()."""
+        if self.thread is None or not self.pausing:
+            return
+        self.pausing = False
+        self.thread = threading.Thread(target=self._run, daemon=True)
+        self.thread.start()
+        with self.lock:
+            self.ready.update(self.blocked)  # Whatever became writable meanwhile
+        try:
+            self._wake_w.send(b"\0")
+        except BlockingIOError:
+            pass
+
+    def close(self, conn):
+        """Closes conn once its queue is flushed (or CLOSE_LINGER has passed)."""
+        with self.lock:
+            self.closing[conn] = time.monotonic() + CLOSE_LINGER
+        self.schedule(conn)
+
+    def _run(self):
+        while not self.pausing:
+            timeout = 1.0 if self.closing else None
+            for key, _ in self.selector.select(timeout):
+                if key.fileobj is self._wake_r:
+                    try:
+                        while self._wake_r.recv(4096):
+                            pass
+                    except BlockingIOError:
+                        pass
+                else:
+                    self._unpark(key.data)
+                    with self.lock:
+                        self.ready.add(key.data)
+            with self.lock:
+                ready, self.ready = self.ready, set()
+            for conn in ready:
+                self._flush(conn)
+            self._expire_closing()
+
+    def _flush(self, conn):
+        outbox = conn.outbox
+        while not outbox.dropped:
+            chunks = outbox.peek()
+            if not chunks:
+                break
+            try:
+                if NONBLOCKING_SEND:
+                    sent = conn.sock.sendmsg(chunks, [], socket.MSG_DONTWAIT)
+                else:
+                    data = b"".join(chunks)
+                    conn.sock.sendall(data)
+                    sent = len(data)
+            except (BlockingIOError, InterruptedError):
+                self._park(conn)
+                return
+            except OSError:
+                outbox.dropped = True
+                break
+            outbox.consume(sent)
+        self._unpark(conn)
+        if outbox.dropped:
+            conn.abort()
+        if conn in self.closing and (outbox.dropped or not len(outbox)):
+            self._finish_close(conn)
+
+    def _park(self, conn):
+        if conn not in self.blocked:
+            self.blocked.add(conn)
+            self.selector.register(conn.sock, selectors.EVENT_WRITE, conn)
+
+    def _unpark(self, conn):
+        if conn in self.blocked:
+            self.blocked.discard(conn)
+            self.selector.unregister(conn.sock)
+
+    def _finish_close(self, conn):
+        with self.lock:
+            self.closing.pop(conn, None)
+        self._unpark(conn)
+        try:
+            conn.sock.close()
+        except OSError:
+            pass
+
+    def _expire_closing(self):
+        now = time.monotonic()
+        with self.lock:
+            expired = [conn for conn, deadline in self.closing.items() if deadline <= now]
+        for conn in expired:
+            self._finish_close(conn)
+
+
+socket_writer = SocketWriter()  # Shared by every threaded connection in the process
+if hasattr(os, "register_at_fork"):
+    os.register_at_fork(after_in_child=socket_writer.__init__)
@@ -0,0 +1,348 @@
+"""Archive of finished games, with PGN export.
+
+Games are appended to segment files (games-00000.seg, games-00001.seg, ...)
+as length-prefixed binary records:
+
+    <u32 record length> <u16 header length> <header> <u16 per move>...
+
+The header is the tab-separated game id, White and Black addresses, result,
+termination, time control and end time. Each move takes two bytes (from
+square, to square and promotion piece), so a 40-move game is about 200 bytes.
+A new segment is started when the current one reaches SEGMENT_BYTES and on
+every startup, so a record torn by a crash is only ever at the end of a
+segment, where readers stop.
+
+index.tsv has one line per game (id, White, Black, result, segment, offset),
+so games can be found by id, player address or result without reading the
+segments, and each one read with a single seek.
+
+The server only queues finished games; a writer thread encodes and writes
+them, so archiving never blocks a game. Run this module to export:
+
+    python game_archive.py archive show <game_id>
+    python game_archive.py archive export [--player HOST:PORT] [--result 1-0] [--jobs 4] > games.pgn
+"""
+
+import argparse
+import collections
+import concurrent.futures
+import os
+import queue
+import struct
+import sys
+import threading
+import time
+
+import chess
+
+SEGMENT_BYTES = 64 * 1024 * 1024
+INDEX_FILE = "index.tsv"
+RESULTS = ("1-0", "0-1", "1/2-1/2", "*")
+EXPORT_CHUNK = 500  # Games converted to PGN per task in a parallel export
+
+_RECORD_HEADER = struct.Struct("<IH")
+
+
+def encode_moves(moves):
+    """Packs chess.Move objects two bytes each: from | to << 6 | promotion << 12."""
+    return struct.pack(
+        f"<{len(moves)}H",
+        *(move.from_square | move.to_square << 6 | (move.promotion or 0) << 12 for move in moves),
+    )
+
+
+def decode_moves(data):
+    moves = []
+    for (value,) in struct.iter_unpack("<H", data):
+        promotion = value >> 12
+        moves.append(chess.Move(value & 0x3F, value >> 6 & 0x3F, promotion or None))
+    return moves
+
+
+def result_of(board):
+    """The PGN result of a finished game's final position."""
+    if board.is_checkmate():
+        return "0-1" if board.turn == chess.WHITE else "1-0"
+    return "1/2-1/2"
+
+
+def segment_path(directory, number):
+    return os.path.join(directory, f"games-{number:05d}.seg")
+
+
+class ArchivedGame:
+    """One game read back from the archive."""
+
+    __slots__ = ("game_id", "white", "black", "result", "termination", "time_control", "ended_at", "moves")
+
+    def __init__(self, game_id, white, black, result, termination, time_control, ended_at, moves):
+        self.game_id = game_id
+        self.white = white
+        self.black = black
+        self.result = result
+        self.termination = termination
+        self.time_control = time_control
+        self.ended_at = float(ended_at)
+        self.moves = moves
+
+    @classmethod
+    def decode(cls, payload):
+        (header_length,) = struct.unpack_from("<H", payload)
+        header = payload[2 : 2 + header_length].decode().split("\t")
+        return cls(*header, decode_moves(payload[2 + header_length :]))
+
+    def pgn(self):
+        """The game as PGN text."""
+        if self.time_control == "untimed":
+            time_control = "-"
+        else:
+            minutes, _, increment = self.time_control.partition("+")
+            time_control = f"{int(minutes) * 60}+{increment or 0}"
+        ended = time.gmtime(self.ended_at)
+        tags = (
+            ("Event", "Network Chess"),
+            ("Site", "?"),
+            ("Date", time.strftime("%Y.%m.%d", ended)),
+            ("Round", "-"),
+            ("White", self.white),
+            ("Black", self.black),
+            ("Result", self.result),
+            ("GameId", self.game_id),
+            ("TimeControl", time_control),
+            ("Termination", self.termination),
+        )
+        lines = [f'[{name} "{value}"]' for name, value in tags]
+        movetext = chess.Board().variation_san(self.moves) if self.moves else ""
+        lines.append("")
+        lines.append(f"{movetext} {self.result}".strip())
+        return "\n".join(lines) + "\n\n"
+
+
+class Archive:
+    """Appends finished games to the archive directory from a writer thread."""
+
+    def __init__(self, directory):
+        self.directory = directory
+        self.queue = queue.SimpleQueue()
+        self.thread = None
+        self.segment = None
+        self.segment_number = -1
+        self.index = None
+        self.archived = 0
+
+    def open(self):
+        os.makedirs(self.directory, exist_ok=True)
+        self.segment_number = max(segment_numbers(self.directory), default=-1)
+        self._next_segment()  # Never append after a record a crash may have torn
+        self.index = open(os.path.join(self.directory, INDEX_FILE), "a", encoding="utf-8")
+        self.thread = threading.Thread(target=self._run, daemon=True)
+        self.thread.start()
+
+    def game_finished(self, game_id, white, black, result, termination, time_control, moves):
+        """Queues a finished game. ``moves`` is a copy of the board's move stack."""
+        self.queue.put((game_id, white, black, result, termination, time_control, time.time(), moves))
+
+    def _next_segment(self):
+        if self.segment is not None:
+            self.segment.close()
+        self.segment_number += 1
+        self.segment = open(segment_path(self.directory, self.segment_number), "ab")
+
+    def sync(self):
+        """Waits until every game queued so far is written and flushed."""
+        if self.thread is None:
+            return
+        written = threading.Event()
+        self.queue.put(written)
+        written.wait()
+
+    def _run(self):
+        while True:
+            entry = self.queue.get()
+            if isinstance(entry, threading.Event):
+                self.segment.flush()
+                self.index.flush()
+                entry.set()  # A sync() marker
+                continue
+            self._write(entry)
+            if self.queue.empty():
+                # Flush once per burst, not once per game
+                self.segment.flush()
+                self.index.flush()
+
+    def _write(self, entry):
+        game_id, white, black, result, termination, time_control, ended_at, moves = entry
+        header = "\t".join(
+            (game_id, white, black, result, termination, time_control, f"{ended_at:.0f}")
+        ).encode()
+        body = encode_moves(moves)
+        if self.segment.tell() >= SEGMENT_BYTES:
+            self._next_segment()
+        offset = self.segment.tell()
+        self.segment.write(
+            _RECORD_HEADER.pack(2 + len(header) + len(body), len(header)) + header + body
+        )
+        self.index.write(
+            f"{game_id}\t{white}\t{black}\t{result}\t{self.segment_number}\t{offset}\n"
+        )
+        self.archived += 1
+
+
+def _segment_payloads(path):
+    with open(path, "rb") as f:
+        while True:
+            prefix = f.read(4)
+            if len(prefix) < 4:
+                return
+            (length,) = struct.unpack("<I", prefix)
+            payload = f.read(length)
+            if len(payload) < length:
+                return  # Torn by a crash
+            yield payload
+
+
+def read_segment(path):
+    """Yields every complete game in one segment file, in the order they were archived."""
+    for payload in _segment_payloads(path):
+        yield ArchivedGame.decode(payload)
+
+
+def segment_numbers(directory):
+    return sorted(
+        int(name[6:11])
+        for name in os.listdir(directory)
+        if name.startswith("games-") and name.endswith(".seg")
+    )
+
+
+def find(directory, game_id=None, player=None, result=None):
+    """Yields (game_id, white, black, result, segment, offset) for indexed games matching every filter."""
+    with open(os.path.join(directory, INDEX_FILE), encoding="utf-8") as index:
+        for line in index:
+            fields = line.rstrip("\n").split("\t")
+            if len(fields) != 6:
+                continue  # Torn by a crash
+            if game_id is not None and fields[0] != game_id:
+                continue
+            if player is not None and player not in (fields[1], fields[2]):
+                continue
+            if result is not None and fields[3] != result:
+                continue
+            yield (*fields[:4], int(fields[4]), int(fields[5]))
+
+
+def _read_payload(f, offset):
+    f.seek(offset)
+    (length,) = struct.unpack("<I", f.read(4))
+    return f.read(length)
+
+
+def read_game(directory, segment, offset):
+    with open(segment_path(directory, segment), "rb") as f:
+        return ArchivedGame.decode(_read_payload(f, offset))
+
+
+def _payloads(directory, player=None, result=None):
+    """Yields the raw records to export, without holding more than one at a time."""
+    if player is None and result is None:
+        # Everything: read the segments front to back, no index needed
+        for number in segment_numbers(directory):
+            yield from _segment_payloads(segment_path(directory, number))
+        return
+    # The index is in archive order, so matches come segment by segment
+    f = None
+    current = None
+    try:
+        for *_, segment, offset in find(directory, player=player, result=result):
+            if segment != current:
+                if f is not None:
+                    f.close()
+                f = open(segment_path(directory, segment), "rb")
+                current = segment
+            yield _read_payload(f, offset)
+    finally:
+        if f is not None:
+            f.close()
+
+
+def _batches(items, size):
+    batch = []
+    for item in items:
+        batch.append(item)
+        if len(batch) == size:
+            yield batch
+            batch = []
+    if batch:
+        yield batch
+
+
+def _pgn_chunk(payloads):
+    return "".join(ArchivedGame.decode(payload).pgn() for payload in payloads)
+
+
+def export(directory, out, player=None, result=None, jobs=1):
+    """Streams games as PGN to out and returns the number exported.
+
+    Games are converted in chunks of EXPORT_CHUNK, on ``jobs`` processes if
+    more than one (writing SAN is the slow part). At most two chunks per
+    process are in flight, so memory use does not depend on the archive size.
+    """
+    count = 0
+    batches = _batches(_payloads(directory, player, result), EXPORT_CHUNK)
+    if jobs <= 1:
+        for batch in batches:
+            out.write(_pgn_chunk(batch))
+            count += len(batch)
+        return count
+    with concurrent.futures.ProcessPoolExecutor(jobs) as pool:
+        in_flight = collections.deque()
+        for batch in batches:
+            in_flight.append((len(batch), pool.submit(_pgn_chunk, batch)))
+            if len(in_flight) >= 2 * jobs:
+                size, future = in_flight.popleft()
+                out.write(future.result())
+                count += size
+        for size, future in in_flight:
+            out.write(future.result())
+            count += size
+    return count
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Look up and export archived games.")
+    parser.add_argument("directory", help="archive directory given to the server's --archive")
+    commands = parser.add_subparsers(dest="command", required=True)
+    show = commands.add_parser("show", help="print one game as PGN")
+    show.add_argument("game_id")
+    listing = commands.add_parser("list", help="list indexed games")
+    bulk = commands.add_parser("export", help="stream games as PGN")
+    for command in (listing, bulk):
+        command.add_argument("--player", metavar="HOST:PORT", help="only games with this player")
+        command.add_argument("--result", choices=RESULTS, help="only games with this result")
+    bulk.add_argument(
+        "--jobs", type=int, default=1, help="processes converting games to PGN in parallel"
+    )
+    args = parser.parse_args()
+
+    if args.command == "show":
+        for *_, segment, offset in find(args.directory, game_id=args.game_id):
+            sys.stdout.write(read_game(args.directory, segment, offset).pgn())
+            return
+        sys.exit(f"No archived game with ID {args.game_id}.")
+    elif args.command == "list":
+        for game_id, white, black, result, _, _ in find(
+            args.directory, player=args.player, result=args.result
+        ):
+            print(f"{game_id}\t{white}\t{black}\t{result}")
+    else:
+        count = export(
+            args.directory, sys.stdout, player=args.player, result=args.result, jobs=args.jobs
+        )
+        print(f"Exported {count} games.", file=sys.stderr)
+
+
+if __name__ == "__main__":
+    try:
+        main()
+    except BrokenPipeError:  # e.g. piped into head
+        sys.stderr.close()
@@ -0,0 +1,205 @@
+"""Chess clocks, and one heap of flag-fall deadlines for every game in the process.
+
+A time control is "<minutes>+<increment seconds>", e.g. "5+0" or "15+10";
+"untimed" games have no clock. Nothing ticks on the server: a Clock stores
+each side's remaining time and when the running side's turn started, and a
+move charges the mover for the time in between, less a credit for network
+lag (their measured round trip, capped at MAX_LAG_CREDIT), then adds the
+increment.
+
+Flag-falls are found by the FlagScheduler, a heap of (deadline, game) for
+every running clock, served by one thread (or, in asyncio mode, one timer on
+the event loop) that sleeps until the earliest deadline. A move pushes the
+game's new deadline and leaves the old entry where it is; stale entries are
+recognized by their version and skipped, and the heap is rebuilt once they
+outnumber the live ones, so scheduling stays O(log n) in the number of games.
+"""
+
+import heapq
+import itertools
+import threading
+import time
+
+from event_log import log
+
+MAX_LAG_CREDIT = 1.0  # Most seconds of network lag refunded per move
+
+
+def parse_time_control(time_control):
+    """Returns (base seconds, increment seconds) for "5+3", or None for an untimed game."""
+    minutes, plus, increment = (time_control or "").partition("+")
+    if not plus:
+        return None
+    try:
+        return float(minutes) * 60, float(increment)
+    except ValueError:
+        return None
+
+
+def new_clock(time_control):
+    """A stopped Clock for the time control, or None if it is untimed."""
+    parsed = parse_time_control(time_control)
+    return Clock(*parsed) if parsed else None
+
+
+def other(color):
+    return "black" if color == "white" else "white"
+
+
+class Clock:
+    """Both sides' remaining time. Caller holds the game's lock; times are time.monotonic() values."""
+
+    __slots__ = ("remaining", "increment", "running", "turn_started", "lag_credit")
+
+    def __init__(self, base, increment):
+        self.remaining = {"white": base, "black": base}
+        self.increment = increment
+        self.running = None  # Color whose time is running, or None when stopped
+        self.turn_started = 0.0
+        self.lag_credit = {"white": 0.0, "black": 0.0}  # Seconds refunded per move
+
+    def start(self, color, now):
+        self.running = color
+        self.turn_started = now
+
+    def deadline(self):
+        """When the running side's flag falls, lag credit included."""
+        return self.turn_started + self.remaining[self.running] + self.lag_credit[self.running]
+
+    def flagged(self, now):
+        return self.running is not None and now >= self.deadline()
+
+    def press(self, color, now):
+        """Charges color for the turn that just ended and starts the opponent's time.
+
+        Returns False, leaving color's time at zero, if their flag had already fallen.
+        """
+        spent = max(0.0, now - self.turn_started - self.lag_credit[color])
+        left = self.remaining[color] - spent
+        if left <= 0:
+            self.remaining[color] = 0.0
+            self.running = None
+            return False
+        self.remaining[color] = left + self.increment
+        self.start(other(color), now)
+        return True
+
+    def stop(self, now):
+        """Stops the clock at the end of a game, charging the running side up to now."""
+        if self.running is not None:
+            spent = max(0.0, now - self.turn_started - self.lag_credit[self.running])
+            self.remaining[self.running] = max(0.0, self.remaining[self.running] - spent)
+            self.running = None
+
+    def times(self, now):
+        """(white seconds, black seconds, running color or None) as of now."""
+        white, black = self.remaining["white"], self.remaining["black"]
+        if self.running is not None:
+            spent = max(0.0, now - self.turn_started)
+            if self.running == "white":
+                white = max(0.0, white - spent)
+            else:
+                black = max(0.0, black - spent)
+        return white, black, self.running
+
+
+class FlagScheduler:
+    """Flag-fall deadlines of every running clock, soonest first."""
+
+    def __init__(self):
+        self.heap = []  # (deadline, version, key); entries whose version is not current are stale
+        self.versions = {}  # key -> version of its live entry
+        self.counter = itertools.count()
+        self.lock = threading.Lock()
+        self.wake = None  # Called when a deadline earlier than all others is scheduled
+
+    def schedule(self, key, deadline):
+        """Sets key's deadline (a time.monotonic() value), replacing any earlier one."""
+        with self.lock:
+            version = next(self.counter)
+            self.versions[key] = version
+            heapq.heappush(self.heap, (deadline, version, key))
+            earliest = self.heap[0][1] == version
+            if len(self.heap) > 2 * len(self.versions) + 64:
+                self._compact()
+        if earliest and self.wake is not None:
+            self.wake()
+
+    def cancel(self, key):
+        with self.lock:
+            self.versions.pop(key, None)
+
+    def __len__(self):
+        return len(self.versions)
+
+    def _compact(self):
+        versions = self.versions
+        self.heap = [entry for entry in self.heap if versions.get(entry[2]) == entry[1]]
+        heapq.heapify(self.heap)
+
+    def next_deadline(self):
+        """The earliest live deadline, or None."""
+        with self.lock:
+            heap = self.heap
+            while heap and self.versions.get(heap[0][2]) != heap[0][1]:
+                heapq.heappop(heap)
+            return heap[0][0] if heap else None
+
+    def expired(self, now=None):
+        """Removes and returns the keys whose deadline has passed."""
+        now = time.monotonic() if now is None else now
+        keys = []
+        with self.lock:
+            heap = self.heap
+            while heap and heap[0][0] <= now:
+                _, version, key = heapq.heappop(heap)
+                if self.versions.get(key) == version:
+                    del self.versions[key]
+                    keys.append(key)
+        return keys
+
+    def _fire(self, on_expire):
+        for key in self.expired():
+            try:
+                on_expire(key)
+            except Exception as e:
+                log.error("clock", "flag handler failed", key=key, error=repr(e))
+
+    def run(self, on_expire):
+        """Calls on_expire(key) for each flag-fall from a daemon thread that sleeps until the next one."""
+        condition = threading.Condition()
+
+        def wake():
+            with condition:
+                condition.notify()
+
+        def loop():
+            while True:
+                with condition:
+                    deadline = self.next_deadline()
+                    if deadline is None or deadline > time.monotonic():
+                        condition.wait(None if deadline is None else deadline - time.monotonic())
+                self._fire(on_expire)
+
+        self.wake = wake
+        thread = threading.Thread(target=loop, daemon=True)
+        thread.start()
+        return thread
+
+    def run_on_loop(self, loop, on_expire):
+        """Like run(), with one timer on an asyncio event loop (whose clock is time.monotonic())."""
+        handle = None
+
+        def arm():
+            nonlocal handle
+            if handle is not None:
+                handle.cancel()
+            deadline = self.next_deadline()
+            handle = None if deadline is None else loop.call_at(deadline, fire)
+
+        def fire():
+            self._fire(on_expire)
+            arm()
+
+        self.wake = lambda: loop.call_soon_threadsafe(arm)
+        arm()
@@ -0,0 +1,204 @@
+"""Write-ahead journal of games in progress, for recovery after a crash.
+
+The journal is an append-only text file with one record per line:
+
+    C <game_id> <time_control> <white> <black> <white token> <black token>   game created
+    M <game_id> <uci>                                                         move played
+    E <game_id>                                                               game ended
+    G <game_id> <time_control> <white> <black> <tokens> <uci> <uci> ...       compacted game
+
+Players are "host:port" addresses; the tokens are the players' resume tokens,
+so players can resume games recovered after a restart.
+
+Appending only adds the record to an in-memory batch; a writer thread writes
+everything queued since its last pass with one write() and one fsync() (group
+commit). Records that arrive while an fsync is in progress form the next
+batch, so the move path never waits for the disk and the number of fsyncs
+stays bounded by the disk's speed, not by the move rate. A crash can lose the
+records of the last batch that was not synced yet.
+
+The writer thread also keeps the live games' move lists. Once the file has
+grown past twice its compacted size, it is rewritten with one G record per
+live game and swapped in with an atomic rename.
+"""
+
+import os
+import threading
+
+from event_log import log
+
+COMPACT_MIN_BYTES = 16 * 1024 * 1024  # Never compact a journal smaller than this
+
+
+class JournalGame:
+    """A live game as the journal knows it."""
+
+    __slots__ = ("game_id", "time_control", "white", "black", "white_token", "black_token", "moves")
+
+    def __init__(self, game_id, time_control, white, black, white_token, black_token, moves=""):
+        self.game_id = game_id
+        self.time_control = time_control
+        self.white = white  # "host:port"
+        self.black = black
+        self.white_token = white_token
+        self.black_token = black_token
+        # Space-separated UCI moves. One string rather than a list: recovering
+        # 100k games would otherwise mean allocating millions of small strings.
+        self.moves = moves
+
+    def add_move(self, move_uci):
+        self.moves = f"{self.moves} {move_uci}" if self.moves else move_uci
+
+    def plies(self):
+        return self.moves.count(" ") + 1 if self.moves else 0
+
+    def record(self):
+        """The compacted G line for this game."""
+        fields = [
+            "G", self.game_id, self.time_control, self.white, self.black,
+            self.white_token, self.black_token,
+        ]
+        if self.moves:
+            fields.append(self.moves)
+        return " ".join(fields) + "\n"
+
+
+def format_addr(addr):
+    return f"{addr[0]}:{addr[1]}"
+
+
+def parse_addr(text):
+    host, _, port = text.rpartition(":")
+    return (host, int(port))
+
+
+def _apply(games, line):
+    """Applies one journal line to a game_id -> JournalGame dict."""
+    fields = line.rstrip("\n").split(" ", 7)
+    kind = fields[0]
+    if kind == "M":
+        game = games.get(fields[1])
+        if game is not None:
+            game.add_move(fields[2])
+    elif kind == "C":
+        games[fields[1]] = JournalGame(*fields[1:7])
+    elif kind == "E":
+        games.pop(fields[1], None)
+    elif kind == "G":
+        games[fields[1]] = JournalGame(*fields[1:8])
+
+
+def read_journal(path):
+    """Returns the games still live in a journal file, in creation order."""
+    games = {}
+    try:
+        with open(path, "r", encoding="ascii") as f:
+            data = f.read()
+    except FileNotFoundError:
+        return games
+    lines = data.split("\n")
+    # The last element is "" after a complete final line, or a torn record after a crash
+    for line in lines[:-1]:
+        if line:
+            _apply(games, line)
+    return games
+
+
+class Journal:
+    """An open journal file and the writer thread that commits to it."""
+
+    def __init__(self, path, games=None):
+        self.path = path
+        self.games = games if games is not None else {}  # Owned by the writer thread
+        self.pending = []  # Records appended since the writer's last pass
+        self.appended = 0  # Records appended so far
+        self.committed = 0  # Records written and synced so far
+        self.condition = threading.Condition()
+        self.batches = 0  # fsyncs done, for the benchmark
+        self.file = None
+        self.size = 0
+        self.compacted_size = 0
+        self.thread = None
+
+    def open(self):
+        """Starts the journal from the games already known (compacting them), then starts the writer."""
+        self.compact()
+        self.thread = threading.Thread(target=self._run, daemon=True)
+        self.thread.start()
+
+    def append(self, record):
+        """Queues one record line. Never blocks on the disk."""
+        with self.condition:
+            self.pending.append(record)
+            self.appended += 1
+            self.condition.notify()
+
+    def game_started(self, game_id, time_control, white_addr, black_addr, tokens):
+        self.append(
+            f"C {game_id} {time_control} {format_addr(white_addr)} {format_addr(black_addr)} "
+            f"{tokens['white']} {tokens['black']}\n"
+        )
+
+    def move_played(self, game_id, move_uci):
+        self.append(f"M {game_id} {move_uci}\n")
+
+    def game_ended(self, game_id):
+        self.append(f"E {game_id}\n")
+
+    def sync(self):
+        """Waits until every record appended so far is on disk."""
+        with self.condition:
+            target = self.appended
+            while self.committed < target:
+                self.condition.wait()
+
+    def _run(self):
+        while True:
+            with self.condition:
+                while not self.pending:
+                    self.condition.wait()
+                batch = self.pending
+                self.pending = []
+            data = "".join(batch).encode("ascii")
+            self.file.write(data)
+            self.file.flush()
+            os.fsync(self.file.fileno())
+            self.size += len(data)
+            self.batches += 1
+            for record in batch:
+                _apply(self.games, record)
+            if self.size >= max(COMPACT_MIN_BYTES, 2 * self.compacted_size):
+                self.compact()
+            with self.condition:
+                self.committed += len(batch)
+                self.condition.notify_all()
+
+    def compact(self):
+        """Rewrites the journal as one G record per live game. Runs on the writer thread."""
+        temp_path = self.path + ".compact"
+        with open(temp_path, "wb") as f:
+            data = "".join(game.record() for game in self.games.values()).encode("ascii")
+            f.write(data)
+            f.flush()
+            os.fsync(f.fileno())
+        os.replace(temp_path, self.path)
+        _fsync_dir(self.path)
+        if self.file is not None:
+            self.file.close()
+        self.file = open(self.path, "ab")
+        self.size = self.compacted_size = len(data)
+        log.info("journal", "compacted", path=self.path, games=len(self.games), bytes=len(data))
+
+
+def _fsync_dir(path):
+    # Makes the rename itself durable
+    try:
+        fd = os.open(os.path.dirname(os.path.abspath(path)), os.O_RDONLY)
+    except OSError:
+        return
+    try:
+        os.fsync(fd)
+    except OSError:
+        pass
+    finally:
+        os.close(fd)
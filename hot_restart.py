@@ -0,0 +1,261 @@
+"""Hot restart: a new server process takes over the listener and every live connection.
+
+A server started with --handoff PATH listens for a successor on a Unix
+socket at PATH. A new build started with --takeover PATH connects there and:
+
+1. The old process sends its listening socket and every client socket
+   (SCM_RIGHTS, MAX_FDS_PER_MESSAGE per message) while it goes on serving,
+   and the new one wraps them, ready to serve but not reading yet. This is
+   the part that grows with the number of connections, so it is kept out
+   of the pause.
+2. The old process stops handling input, lets the spectator fan-out and
+   the socket writer finish their current pass, and snapshots its registry
+   (games, sessions, the matchmaking queue, the lobby). Each session
+   carries the bytes it had read but not handled and the bytes queued for
+   it but not yet written. It sends the snapshot, with the sockets of
+   connections accepted since step 1.
+3. The new process rebuilds the registry around the same sockets and
+   answers "ready"; the old one syncs its journal and archive, answers
+   "done" and exits, and the new one starts serving.
+
+The sockets stay open in the kernel throughout, so clients see a pause
+rather than a disconnect: what they send meanwhile waits in the socket
+buffers, and new connections wait in the listen backlog. If the new
+process refuses the snapshot or does not answer within READY_TIMEOUT, the
+old one carries on serving as if nothing had happened.
+
+The snapshot is pickled, which is several times faster than JSON both
+ways; it holds only plain data (dicts, lists, strings, bytes, numbers), and
+loading anything else is refused.
+"""
+
+import io
+import json
+import os
+import pickle
+import resource
+import socket
+import struct
+import threading
+import time
+
+from event_log import log
+
+MAX_FDS_PER_MESSAGE = 253  # SCM_MAX_FD on Linux
+READY_TIMEOUT = 10.0  # Seconds the old process waits for the new one to rebuild
+SNAPSHOT_VERSION = 3  # Bumped when the snapshot layout changes incompatibly
+PICKLE_PROTOCOL = 5  # Fixed, so a successor on another Python can still read it
+SIZES = struct.Struct("!II")  # Late sockets and snapshot bytes, ahead of step 2
+
+
+class HandoffError(Exception):
+    """Raised when a takeover cannot go ahead."""
+
+
+class Gate:
+    """Lets any number of threads handle input at once, and a hot restart stop them all between commands.
+
+    Threads must not enter it again while inside.
+    """
+
+    def __init__(self):
+        self.condition = threading.Condition()
+        self.inside = 0
+        self.closed = False
+
+    def __enter__(self):
+        with self.condition:
+            while self.closed:
+                self.condition.wait()
+            self.inside += 1
+
+    def __exit__(self, *exc_info):
+        with self.condition:
+            self.inside -= 1
+            if self.closed and not self.inside:
+                self.condition.notify_all()
+
+    def close(self):
+        """Returns once every thread inside has left; the ones that arrive after wait at the gate."""
+        with self.condition:
+            self.closed = True
+            while self.inside:
+                self.condition.wait()
+
+    def open(self):
+        with self.condition:
+            self.closed = False
+            self.condition.notify_all()
+
+
+def _send_line(ctl, message):
+    ctl.sendall((json.dumps(message) + "\n").encode())
+
+
+def _read_line(ctl):
+    data = b""
+    while not data.endswith(b"\n"):
+        chunk = ctl.recv(4096)
+        if not chunk:
+            raise HandoffError("The other process went away.")
+        data += chunk
+    return json.loads(data)
+
+
+def _read_exactly(ctl, size):
+    view = memoryview(bytearray(size))
+    received = 0
+    while received < size:
+        count = ctl.recv_into(view[received:])
+        if not count:
+            raise HandoffError("The other process went away.")
+        received += count
+    return view.obj
+
+
+def serve(path, on_takeover):
+    """Listens at path for a successor from a daemon thread.
+
+    on_takeover(ctl) is called with each connection that asks to take over.
+    It hands everything over with offer(), send() and finish() and never returns, or
+    returns after a failed attempt with everything running again.
+    """
+    if os.path.exists(path):
+        os.unlink(path)
+    listener = socket.socket(socket.AF_UNIX, socket.SOCK_STREAM)
+    listener.bind(path)
+    listener.listen()
+
+    def loop():
+        while True:
+            ctl, _ = listener.accept()
+            try:
+                ctl.settimeout(READY_TIMEOUT)
+                if _read_line(ctl).get("op") == "takeover":
+                    on_takeover(ctl)
+            except Exception as e:
+                log.error("restart", "takeover failed, still serving", error=repr(e))
+            finally:
+                ctl.close()
+
+    threading.Thread(target=loop, daemon=True).start()
+    log.info("restart", "accepting takeovers", path=path)
+
+
+def _send_sockets(ctl, fds):
+    for start in range(0, len(fds), MAX_FDS_PER_MESSAGE):
+        # One byte per batch, so the receiver can read each batch on its own
+        socket.send_fds(ctl, [b"\0"], fds[start : start + MAX_FDS_PER_MESSAGE])
+
+
+def offer(ctl, listener_fd, fds, mode):
+    """Step 1: sends the listener and the client sockets, without waiting for the successor.
+
+    The caller keeps serving them; wait_for(ctl, "prepared") tells when the
+    successor has wrapped them.
+    """
+    header = {"version": SNAPSHOT_VERSION, "mode": mode, "sockets": len(fds), "pid": os.getpid()}
+    socket.send_fds(ctl, [(json.dumps(header) + "\n").encode()], [listener_fd])
+    _send_sockets(ctl, fds)
+
+
+def wait_for(ctl, op):
+    """Reads the successor's next answer. Raises HandoffError unless it is op."""
+    reply = _read_line(ctl)
+    if reply.get("op") != op:
+        raise HandoffError(reply.get("error", f"The successor did not answer {op!r}."))
+
+
+def send(ctl, fds, snapshot):
+    """Step 2: sends the sockets accepted since offer() and the snapshot, then waits for "ready".
+
+    Raises HandoffError (or OSError) if the successor does not take them.
+    """
+    payload = pickle.dumps(snapshot, protocol=PICKLE_PROTOCOL)
+    ctl.sendall(SIZES.pack(len(fds), len(payload)))
+    _send_sockets(ctl, fds)
+    ctl.sendall(payload)
+    wait_for(ctl, "ready")
+
+
+def finish(ctl):
+    """Tells the successor it may start serving. The caller exits straight after."""
+    _send_line(ctl, {"op": "done"})
+
+
+class _PlainUnpickler(pickle.Unpickler):
+    def find_class(self, module, name):
+        raise HandoffError(f"The snapshot holds a {module}.{name}; only plain data is handed over.")
+
+
+class Takeover:
+    """The successor's end of a hot restart: the listener, the client sockets and the snapshot."""
+
+    def __init__(self, path, mode):
+        """Connects to the server handing over at path and receives step 1.
+
+        Refuses if that server runs in another mode: its sockets are blocking
+        in threaded mode and non-blocking under asyncio, and wrapping them
+        for the other mode would change them under it while it still serves.
+        """
+        self.started = time.perf_counter()
+        # Every connection of the old process arrives at once
+        soft, hard = resource.getrlimit(resource.RLIMIT_NOFILE)
+        if soft < hard:
+            resource.setrlimit(resource.RLIMIT_NOFILE, (hard, hard))
+        self.ctl = socket.socket(socket.AF_UNIX, socket.SOCK_STREAM)
+        self.ctl.settimeout(READY_TIMEOUT)
+        self.ctl.connect(path)
+        _send_line(self.ctl, {"op": "takeover"})
+        data, fds, _, _ = socket.recv_fds(self.ctl, 65536, 1)
+        if not fds or not data.endswith(b"\n"):
+            raise HandoffError("Malformed handoff header.")
+        self.listener = socket.socket(fileno=fds[0])
+        header = json.loads(data)
+        self.pid = header["pid"]
+        self.sockets = self._receive_sockets(header["sockets"])
+        if header["version"] != SNAPSHOT_VERSION:
+            self.refuse(f"Snapshot version {header['version']} is not {SNAPSHOT_VERSION}.")
+        if header["mode"] != mode:
+            self.refuse(f"The old process runs in {header['mode']} mode, not {mode}.")
+        self.snapshot = None
+        self.paused = None  # When receive() let the old process pause
+
+    def _receive_sockets(self, count):
+        sockets = []
+        while len(sockets) < count:
+            data, fds, flags, _ = socket.recv_fds(self.ctl, 1, MAX_FDS_PER_MESSAGE)
+            sockets.extend(socket.socket(fileno=fd) for fd in fds)
+            if not data:
+                raise HandoffError("The old process went away.")
+            if flags & socket.MSG_CTRUNC:
+                self.refuse("Out of file descriptors.")
+        return sockets
+
+    def receive(self):
+        """Tells the old process the sockets are wrapped and receives step 2. Returns the late sockets.
+
+        The old process is paused from here until ready().
+        """
+        self.paused = time.perf_counter()
+        _send_line(self.ctl, {"op": "prepared"})
+        count, size = SIZES.unpack(_read_exactly(self.ctl, SIZES.size))
+        late = self._receive_sockets(count)
+        self.snapshot = _PlainUnpickler(io.BytesIO(_read_exactly(self.ctl, size))).load()
+        return late
+
+    def refuse(self, reason):
+        """Tells the old process to carry on, and raises HandoffError."""
+        try:
+            _send_line(self.ctl, {"op": "refused", "error": reason})
+        except OSError:
+            pass
+        raise HandoffError(reason)
+
+    def ready(self):
+        """Tells the old process everything is rebuilt and waits until it has let go."""
+        _send_line(self.ctl, {"op": "ready"})
+        self.ctl.settimeout(None)  # It syncs its journal first
+        if _read_line(self.ctl).get("op") != "done":
+            raise HandoffError("The old process did not let go.")
+        self.ctl.close()
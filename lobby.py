@@ -0,0 +1,293 @@
+"""Lobby index: the games spectators can pick from, ready to page through.
+
+Every game in the registry has a LobbyEntry, and so does every player in
+the matchmaking queue: a "waiting" entry with "-" as the opponent. Entries are kept in lists sorted
+by start time, one for all games, one per status, one per time control and
+one per (status, time control), so a page for any filter is a binary search
+and a slice. The index has its own lock, held only for those few steps;
+listing never touches the registry or any game's lock.
+
+Each change bumps the index version. Clients that subscribed are sent a
+delta for it (ADD, UPD or DEL) through the spectator fan-out, which also
+delivered their first page, so a subscriber sees the page and then every
+later change in order.
+"""
+
+import bisect
+import threading
+import time
+
+import protocol
+
+STATUS_NAMES = {
+    "playing": "In Progress",
+    "reconnecting": "Waiting for a player to reconnect",
+    "recovered": "Recovered after restart",
+    "waiting": "Waiting for an opponent",
+}
+PAGE_SIZE = 50
+MAX_PAGE_SIZE = 200
+
+
+class LobbyEntry:
+    __slots__ = ("game_id", "white", "black", "time_control", "status", "started")
+
+    def __init__(self, game_id, white, black, time_control, status, started):
+        self.game_id = game_id
+        self.white = white  # "host:port"
+        self.black = black
+        self.time_control = time_control
+        self.status = status
+        self.started = started  # time.time(), comparable across worker processes
+
+    def key(self):
+        return (self.started, self.game_id)
+
+    def row(self):
+        return (
+            f"{self.game_id} {self.status} {self.time_control} "
+            f"{self.white} {self.black} {self.started:.3f}"
+        )
+
+    def summary(self):
+        """The JSON-friendly form used in cluster listings and the text lobby."""
+        return {
+            "id": self.game_id,
+            "white": self.white,
+            "black": self.black,
+            "status": self.status,
+            "tc": self.time_control,
+            "started": self.started,
+        }
+
+
+def format_cursor(key):
+    return f"{key[0]!r},{key[1]}"  # repr() round-trips the float exactly
+
+
+def parse_cursor(text):
+    """Returns the (started, game_id) a page continues after, or None to start at the top."""
+    if not text:
+        return None
+    started, _, game_id = text.partition(",")
+    try:
+        return (float(started), game_id)
+    except ValueError:
+        return None
+
+
+def parse_limit(text):
+    try:
+        limit = int(text) if text else PAGE_SIZE
+    except ValueError:
+        limit = PAGE_SIZE
+    return max(1, min(MAX_PAGE_SIZE, limit))
+
+
+class LobbyIndex:
+    """Games by status and start time, with paging and delta subscriptions."""
+
+    def __init__(self, publish):
+        self.publish = publish  # spectator_fanout.publish
+        self.lock = threading.Lock()
+        self.entries = {}  # game_id -> LobbyEntry
+        self.sorted = {}  # None, status, ("tc", tc) or (status, tc) -> sorted keys
+        self.version = 0
+        self.subscribers = ()  # Immutable, like a game's spectators
+
+    @staticmethod
+    def _lists_for(entry):
+        return (None, entry.status, ("tc", entry.time_control), (entry.status, entry.time_control))
+
+    def _insert(self, entry):
+        key = entry.key()
+        for name in self._lists_for(entry):
+            keys = self.sorted.get(name)
+            if keys is None:
+                keys = self.sorted[name] = []
+            if not keys or keys[-1] < key:
+                keys.append(key)  # The usual case: the newest game
+            else:
+                bisect.insort(keys, key)
+
+    def _delete(self, entry):
+        key = entry.key()
+        for name in self._lists_for(entry):
+            keys = self.sorted[name]
+            del keys[bisect.bisect_left(keys, key)]
+
+    def _changed(self, text):
+        self.version += 1
+        if self.subscribers:
+            self.publish(self.subscribers, [protocol.lobby(text)])
+
+    def __len__(self):
+        return len(self.entries)
+
+    def add(self, game_id, white, black, time_control, status="playing", started=None):
+        entry = LobbyEntry(
+            game_id, white, black, time_control, status,
+            time.time() if started is None else started,
+        )
+        with self.lock:
+            previous = self.entries.get(game_id)
+            if previous is not None:
+                self._delete(previous)
+            self.entries[game_id] = entry
+            self._insert(entry)
+            self._changed(f"ADD {self.version + 1} {entry.row()}")
+
+    def add_many(self, games, status):
+        """Adds (game_id, white, black, time_control) tuples at once, e.g. games recovered at startup.
+
+        They share one start time, so their order is the game IDs'. Nobody
+        can have subscribed yet, so no deltas are sent.
+        """
+        started = time.time()
+        with self.lock:
+            touched = set()
+            for game_id, white, black, time_control in games:
+                entry = LobbyEntry(game_id, white, black, time_control, status, started)
+                previous = self.entries.get(game_id)
+                if previous is not None:
+                    self._delete(previous)
+                self.entries[game_id] = entry
+                key = (started, game_id)
+                for name in self._lists_for(entry):
+                    keys = self.sorted.get(name)
+                    if keys is None:
+                        keys = self.sorted[name] = []
+                    keys.append(key)
+                    touched.add(name)
+            for name in touched:
+                self.sorted[name].sort()
+            self.version += 1
+
+    def snapshot(self):
+        """(version, every entry's summary oldest first), for a hot restart to restore()."""
+        with self.lock:
+            keys = self.sorted.get(None, ())
+            return self.version, [self.entries[game_id].summary() for _, game_id in keys]
+
+    def restore(self, version, games, subscribers=()):
+        """Loads what snapshot() returned in the process handing over, and its subscribers.
+
+        Subscribers compare versions with the pages they already have, so the
+        count carries on from the old process's.
+        """
+        with self.lock:
+            for game in games:  # Oldest first, so every key is appended
+                entry = LobbyEntry(
+                    game["id"], game["white"], game["black"], game["tc"], game["status"], game["started"]
+                )
+                self.entries[entry.game_id] = entry
+                self._insert(entry)
+            self.version = version
+            self.subscribers = tuple(subscribers)
+
+    def update(self, game_id, status):
+        with self.lock:
+            entry = self.entries.get(game_id)
+            if entry is None or entry.status == status:
+                return
+            self._delete(entry)
+            entry.status = status
+            self._insert(entry)
+            self._changed(f"UPD {self.version + 1} {game_id} {status}")
+
+    def remove(self, game_id):
+        with self.lock:
+            entry = self.entries.pop(game_id, None)
+            if entry is None:
+                return
+            self._delete(entry)
+            self._changed(f"DEL {self.version + 1} {game_id}")
+
+    def page(self, status=None, tc=None, after=None, limit=PAGE_SIZE):
+        """Returns {"version", "total", "games", "next"} for one page of matching games, oldest first.
+
+        ``after`` is the "next" cursor of the previous page. The arguments are
+        the keys of a query from parse_query(), so ``page(**query)`` works.
+        """
+        with self.lock:
+            return self._page(status, tc, parse_cursor(after), limit)
+
+    def _page(self, status, tc, after, limit):
+        if status and tc:
+            name = (status, tc)
+        elif tc:
+            name = ("tc", tc)
+        else:
+            name = status or None
+        keys = self.sorted.get(name, ())
+        start = bisect.bisect_right(keys, after) if after else 0
+        chosen = keys[start : start + limit]
+        return {
+            "version": self.version,
+            "total": len(keys),
+            "games": [self.entries[game_id].summary() for _, game_id in chosen],
+            "next": format_cursor(chosen[-1]) if start + limit < len(keys) else None,
+        }
+
+    def subscribe(self, conn, query):
+        """Adds a subscriber and sends it the first page for ``query``.
+
+        Both happen under the index lock and the page goes through the
+        fan-out, so the subscriber gets every change after the page, in order.
+        Deltas are not filtered; the page's version tells which ones are new.
+        """
+        with self.lock:
+            if conn not in self.subscribers:
+                self.subscribers = self.subscribers + (conn,)
+            page = self._page(query["status"], query["tc"], parse_cursor(query["after"]), query["limit"])
+            self.publish((conn,), page_messages(page))
+
+    def unsubscribe(self, conn):
+        with self.lock:
+            if conn in self.subscribers:
+                self.subscribers = tuple(sub for sub in self.subscribers if sub is not conn)
+
+
+def parse_query(params):
+    """A page query from a client's key=value options ("status", "tc", "after", "limit")."""
+    return {
+        "status": params.get("status") or None,
+        "tc": params.get("tc") or None,
+        "after": params.get("after") or None,
+        "limit": parse_limit(params.get("limit")),
+    }
+
+
+def merge_pages(pages, limit):
+    """Combines pages for the same query from several workers into one page.
+
+    Each worker returned its first ``limit`` games after the cursor, so the
+    first ``limit`` of them all, by start time, is the cluster's page.
+    """
+    games = sorted(
+        (game for page in pages for game in page["games"]),
+        key=lambda game: (game["started"], game["id"]),
+    )
+    more = len(games) > limit or any(page["next"] for page in pages)
+    games = games[:limit]
+    return {
+        "version": pages[0]["version"],  # This worker's, the only one whose deltas a subscriber gets
+        "total": sum(page["total"] for page in pages),
+        "games": games,
+        "next": format_cursor((games[-1]["started"], games[-1]["id"])) if more and games else None,
+    }
+
+
+def page_messages(page):
+    """LOBBY messages for a page: a PAGE header line, then one GAME line per game."""
+    messages = [
+        protocol.lobby(f"PAGE {page['version']} {page['total']} {page['next'] or '-'}")
+    ]
+    for game in page["games"]:
+        messages.append(
+            protocol.lobby(
+                f"GAME {game['id']} {game['status']} {game['tc']} "
+                f"{game['white']} {game['black']} {game['started']:.3f}"
+            )
+        )
+    return messages
@@ -0,0 +1,211 @@
+"""Matchmaking: rating-banded FIFO queues per time control, paired in batches.
+
+Players wait in a Pool per time control. Inside a pool they are bucketed by
+rating band (BAND_WIDTH points) in deques, so joining and pairing are O(1)
+per player. Cancelling only flags the ticket; flagged tickets are dropped
+when the pairing tick reaches them, or by a sweep of the pool once they
+outnumber the players still waiting, so a queue that never fills up enough
+to pair does not keep them forever.
+
+Pairing runs as a batch tick every TICK_INTERVAL seconds, not once per
+arrival. It first pairs players within each band in arrival order. The
+leftovers (at most one per band) are then paired with their nearest
+neighbour by rating when the two are within the spread either of them
+accepts. A ticket's spread widens the longer it waits, so outliers still
+get a game eventually.
+"""
+
+import collections
+import threading
+import time
+
+DEFAULT_RATING = 1500
+MIN_RATING = 0
+MAX_RATING = 4000
+DEFAULT_TIME_CONTROL = "untimed"
+TIME_CONTROLS = ("untimed", "1+0", "3+0", "3+2", "5+0", "10+0", "15+10")
+BAND_WIDTH = 100  # Rating points per bucket
+BASE_SPREAD = 150  # Rating difference accepted straight away
+SPREAD_GROWTH = 100  # Extra rating difference accepted per WIDEN_INTERVAL waited
+WIDEN_INTERVAL = 5.0  # Seconds
+MAX_SPREAD = MAX_RATING  # After long enough, anyone will do
+TICK_INTERVAL = 0.05  # Seconds between pairing passes
+
+
+class Ticket:
+    """One player waiting in a pool."""
+
+    __slots__ = ("player", "rating", "time_control", "enqueued_at", "active")
+
+    def __init__(self, player, rating, time_control, now):
+        self.player = player
+        self.rating = rating
+        self.time_control = time_control
+        self.enqueued_at = now
+        self.active = True
+
+    def spread(self, now):
+        waited = int((now - self.enqueued_at) / WIDEN_INTERVAL)
+        return min(MAX_SPREAD, BASE_SPREAD + SPREAD_GROWTH * waited)
+
+
+class Pool:
+    """The players waiting for one time control, bucketed by rating band."""
+
+    def __init__(self):
+        self.bands = {}  # band index -> deque of Tickets, oldest first
+        self.size = 0  # Active tickets
+        self.cancelled = 0  # Flagged tickets still in the bands
+
+    def add(self, ticket):
+        band = ticket.rating // BAND_WIDTH
+        queue = self.bands.get(band)
+        if queue is None:
+            queue = self.bands[band] = collections.deque()
+        queue.append(ticket)
+        self.size += 1
+
+    def ticket_cancelled(self):
+        """Forgets a ticket just flagged as cancelled."""
+        self.size -= 1
+        self.cancelled += 1
+        if self.cancelled > self.size:  # Amortized O(1): each sweep is paid for by the cancels before it
+            bands = {}
+            for band, queue in self.bands.items():
+                queue = collections.deque(waiting for waiting in queue if waiting.active)
+                if queue:
+                    bands[band] = queue
+            self.bands = bands
+            self.cancelled = 0
+
+    def pair(self, now):
+        """Removes and returns the (older, newer) ticket pairs that can play now."""
+        pairs = []
+        leftovers = []
+        for band in sorted(self.bands):
+            waiting = None
+            for ticket in self.bands[band]:
+                if not ticket.active:
+                    continue  # Cancelled; dropped here
+                if waiting is None:
+                    waiting = ticket
+                else:
+                    pairs.append((waiting, ticket))
+                    waiting = None
+            if waiting is not None:
+                leftovers.append(waiting)
+        self.bands = {}
+        self.cancelled = 0
+
+        # Leftovers are in rating order: pair neighbours whose spreads allow it
+        index = 0
+        while index < len(leftovers):
+            ticket = leftovers[index]
+            if index + 1 < len(leftovers):
+                other = leftovers[index + 1]
+                spread = max(ticket.spread(now), other.spread(now))
+                if abs(ticket.rating - other.rating) <= spread:
+                    older, newer = sorted((ticket, other), key=lambda t: t.enqueued_at)
+                    pairs.append((older, newer))
+                    index += 2
+                    continue
+            self.add_back(ticket)
+            index += 1
+        self.size -= 2 * len(pairs)
+        return pairs
+
+    def add_back(self, ticket):
+        band = ticket.rating // BAND_WIDTH
+        self.bands[band] = collections.deque((ticket,))
+
+
+class Matchmaker:
+    """Queues players per time control and pairs them on a background tick.
+
+    ``on_match(white, black, time_control)`` is called for each pair with the
+    players given to enqueue(); the longer-waiting player gets White. All
+    methods except start() expect the caller to hold ``lock``; the tick
+    takes it itself, so on_match also runs under it.
+    """
+
+    def __init__(self, lock, on_match, after_tick=None):
+        self.lock = lock
+        self.on_match = on_match
+        self.after_tick = after_tick  # Called (without the lock) after a tick that paired players
+        self.pools = {}
+        self.waiting = 0
+        self.thread = None
+
+    def enqueue(self, player, rating=DEFAULT_RATING, time_control=DEFAULT_TIME_CONTROL):
+        rating = max(MIN_RATING, min(MAX_RATING, rating))
+        ticket = Ticket(player, rating, time_control, time.monotonic())
+        pool = self.pools.get(time_control)
+        if pool is None:
+            pool = self.pools[time_control] = Pool()
+        pool.add(ticket)
+        self.waiting += 1
+        self.start()
+        return ticket
+
+    def cancel(self, ticket):
+        """Takes a waiting player out of the queue. Returns False if they were already paired."""
+        if not ticket.active:
+            return False
+        ticket.active = False
+        self.pools[ticket.time_control].ticket_cancelled()
+        self.waiting -= 1
+        return True
+
+    def __len__(self):
+        return self.waiting
+
+    def unpaired(self, time_control):
+        """True if a player waiting for time_control has nobody here to pair with.
+
+        An odd pool always leaves someone over; an even one pairs off, on this
+        tick or, once spreads have widened, a later one.
+        """
+        pool = self.pools.get(time_control)
+        return pool is not None and pool.size % 2 == 1
+
+    def tick(self, now=None):
+        """Pairs everyone who can be paired. Caller holds ``lock``. Returns the number of games."""
+        now = time.monotonic() if now is None else now
+        games = 0
+        for time_control, pool in self.pools.items():
+            if pool.size < 2:
+                continue
+            for older, newer in pool.pair(now):
+                older.active = newer.active = False
+                self.waiting -= 2
+                games += 1
+                self.on_match(older.player, newer.player, time_control)
+        return games
+
+    def start(self):
+        if self.thread is None:
+            self.thread = threading.Thread(target=self._run, daemon=True)
+            self.thread.start()
+
+    def _run(self):
+        while True:
+            time.sleep(TICK_INTERVAL)
+            if self.waiting < 2:
+                continue
+            with self.lock:
+                games = self.tick()
+            if games and self.after_tick:
+                self.after_tick()
+
+
+def parse_time_control(value):
+    """Returns the pool name for a "tc=" choice option, or None if it is not offered."""
+    value = (value or DEFAULT_TIME_CONTROL).lower()
+    return value if value in TIME_CONTROLS else None
+
+
+def parse_rating(value):
+    try:
+        return int(value) if value is not None else DEFAULT_RATING
+    except ValueError:
+        return DEFAULT_RATING
@@ -0,0 +1,252 @@
+"""In-process metrics, served over HTTP in the Prometheus text format.
+
+Counters and histograms are cheap enough for the move path: every thread
+updates its own cell, so an update is a thread-local lookup and an addition,
+with no lock and no contention. Cells are only summed when the endpoint is
+scraped. When a thread ends, its counts are folded into a retired cell, so
+thread-per-connection servers do not accumulate cells.
+
+Histograms use power-of-two buckets from 1 microsecond to about 17 seconds.
+Gauges are functions evaluated at scrape time.
+
+    python chess_server.py --metrics-port 9100
+    curl http://127.0.0.1:9100/metrics
+"""
+
+import http.server
+import math
+import threading
+import time
+import weakref
+
+BUCKET_BASE = 1e-6  # Upper bound of the first histogram bucket, in seconds
+BUCKET_COUNT = 25  # 1us * 2**24 is about 17s; anything slower lands in +Inf
+BUCKET_BOUNDS = tuple(BUCKET_BASE * 2**i for i in range(BUCKET_COUNT))
+
+
+class _ThreadToken:
+    """Lives in a thread's local storage; its finalizer retires the thread's cell."""
+
+    __slots__ = ("__weakref__",)
+
+
+class _Sharded:
+    """Per-thread cells of a metric, summed on demand."""
+
+    def __init__(self, size):
+        self.size = size
+        self.local = threading.local()
+        self.lock = threading.Lock()  # Only taken when a thread first updates, ends, or on scrape
+        self.cells = {}  # id(cell) -> cell; by identity, as equal counts are common
+        self.retired = [0] * size
+
+    def cell(self):
+        try:
+            return self.local.cell
+        except AttributeError:
+            cell = [0] * self.size
+            token = _ThreadToken()
+            self.local.cell = cell
+            self.local.token = token
+            with self.lock:
+                self.cells[id(cell)] = cell
+            weakref.finalize(token, self._retire, cell)
+            return cell
+
+    def _retire(self, cell):
+        with self.lock:
+            del self.cells[id(cell)]
+            for i, value in enumerate(cell):
+                self.retired[i] += value
+
+    def totals(self):
+        with self.lock:
+            totals = list(self.retired)
+            for cell in self.cells.values():
+                for i, value in enumerate(cell):
+                    totals[i] += value
+        return totals
+
+
+def _labels_text(labels):
+    if not labels:
+        return ""
+    return "{" + ",".join(f'{key}="{value}"' for key, value in labels.items()) + "}"
+
+
+class Counter:
+    def __init__(self, name, help_text, labels=None):
+        self.name = name
+        self.help = help_text
+        self.kind = "counter"
+        self.labels = labels or {}
+        self.shards = _Sharded(1)
+
+    def inc(self, amount=1):
+        self.shards.cell()[0] += amount
+
+    def value(self):
+        return self.shards.totals()[0]
+
+    def samples(self):
+        yield self.name, self.labels, self.value()
+
+
+class Gauge:
+    def __init__(self, name, help_text, function, labels=None):
+        self.name = name
+        self.help = help_text
+        self.kind = "gauge"
+        self.labels = labels or {}
+        self.function = function
+
+    def samples(self):
+        yield self.name, self.labels, self.function()
+
+
+class Histogram:
+    """Latencies in seconds, in power-of-two buckets."""
+
+    def __init__(self, name, help_text, labels=None):
+        self.name = name
+        self.help = help_text
+        self.kind = "histogram"
+        self.labels = labels or {}
+        # BUCKET_COUNT buckets, then +Inf, then the count and the sum
+        self.shards = _Sharded(BUCKET_COUNT + 3)
+
+    def observe(self, seconds):
+        cell = self.shards.cell()
+        # frexp gives the power of two just above seconds / BUCKET_BASE
+        index = math.frexp(seconds / BUCKET_BASE)[1] if seconds > BUCKET_BASE else 0
+        cell[index if index < BUCKET_COUNT else BUCKET_COUNT] += 1
+        cell[BUCKET_COUNT + 1] += 1
+        cell[BUCKET_COUNT + 2] += seconds
+
+    def time(self):
+        """Context manager that observes the time spent in its block."""
+        return _Timer(self)
+
+    def samples(self):
+        totals = self.shards.totals()
+        cumulative = 0
+        for bound, count in zip(BUCKET_BOUNDS, totals):
+            cumulative += count
+            yield self.name + "_bucket", dict(self.labels, le=f"{bound:.6g}"), cumulative
+        yield self.name + "_bucket", dict(self.labels, le="+Inf"), totals[BUCKET_COUNT + 1]
+        yield self.name + "_count", self.labels, totals[BUCKET_COUNT + 1]
+        yield self.name + "_sum", self.labels, totals[BUCKET_COUNT + 2]
+
+
+class _Timer:
+    __slots__ = ("histogram", "start")
+
+    def __init__(self, histogram):
+        self.histogram = histogram
+
+    def __enter__(self):
+        self.start = time.perf_counter()
+
+    def __exit__(self, *exc):
+        self.histogram.observe(time.perf_counter() - self.start)
+
+
+class TimedLock:
+    """A threading.Lock that records how long acquirers waited for it.
+
+    An uncontended acquire is a single non-blocking try and records nothing
+    but a count; only acquirers that have to wait are timed.
+    """
+
+    __slots__ = ("lock", "waits", "acquired")
+
+    def __init__(self, waits, acquired):
+        self.lock = threading.Lock()
+        self.waits = waits  # Histogram of waits by contended acquirers
+        self.acquired = acquired  # Counter of all acquisitions
+
+    def acquire(self, blocking=True, timeout=-1):
+        self.acquired.inc()
+        if self.lock.acquire(False):
+            return True
+        if not blocking:
+            return False
+        start = time.perf_counter()
+        got = self.lock.acquire(True, timeout)
+        self.waits.observe(time.perf_counter() - start)
+        return got
+
+    def release(self):
+        self.lock.release()
+
+    def locked(self):
+        return self.lock.locked()
+
+    def __enter__(self):
+        self.acquire()
+        return self
+
+    def __exit__(self, *exc):
+        self.lock.release()
+
+
+class Registry:
+    def __init__(self):
+        self.metrics = []
+
+    def register(self, metric):
+        self.metrics.append(metric)
+        return metric
+
+    def counter(self, name, help_text, labels=None):
+        return self.register(Counter(name, help_text, labels))
+
+    def gauge(self, name, help_text, function, labels=None):
+        return self.register(Gauge(name, help_text, function, labels))
+
+    def histogram(self, name, help_text, labels=None):
+        return self.register(Histogram(name, help_text, labels))
+
+    def exposition(self):
+        """All metrics in the Prometheus text format (version 0.0.4)."""
+        lines = []
+        described = set()
+        for metric in self.metrics:
+            if metric.name not in described:
+                # Metrics sharing a name (different labels) share one HELP and TYPE
+                described.add(metric.name)
+                lines.append(f"# HELP {metric.name} {metric.help}")
+                lines.append(f"# TYPE {metric.name} {metric.kind}")
+            try:
+                for name, labels, value in metric.samples():
+                    lines.append(f"{name}{_labels_text(labels)} {value}")
+            except Exception as e:  # A gauge racing a registry change; skip it this scrape
+                lines.append(f"# {metric.name} unavailable: {e}")
+        return "\n".join(lines) + "\n"
+
+
+registry = Registry()  # The process's metrics
+
+
+class _MetricsHandler(http.server.BaseHTTPRequestHandler):
+    def do_GET(self):
+        if self.path.split("?")[0] != "/metrics":
+            self.send_error(404)
+            return
+        body = registry.exposition().encode()
+        self.send_response(200)
+        self.send_header("Content-Type", "text/plain; version=0.0.4; charset=utf-8")
+        self.send_header("Content-Length", str(len(body)))
+        self.end_headers()
+        self.wfile.write(body)
+
+    def log_message(self, format, *args):
+        pass  # Scrapes every few seconds would drown the server log
+
+
+def serve(host, port):
+    """Serves /metrics on host:port from a daemon thread."""
+    server = http.server.ThreadingHTTPServer((host, port), _MetricsHandler)
+    server.daemon_threads = True
+    threading.Thread(target=server.serve_forever, daemon=True).start()
+    return server
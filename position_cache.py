@@ -0,0 +1,127 @@
+"""What the server works out about a position, shared by every game that reaches it.
+
+Thousands of games pass through the same openings, and each of them would
+otherwise probe for legal moves, check for insufficient material and build
+the FEN of every position afresh. A PositionCache keeps one Entry per
+position, keyed by termination.position_key (the repetition key every game
+computes once per ply anyway), holding:
+
+* the outcome: CHECKMATE, STALEMATE, INSUFFICIENT or None if play goes on,
+  worked out when the entry is made;
+* the FEN's first four fields, built the first time someone needs a FEN
+  there; the move counters are added per game;
+* the legal moves played or tried there so far; a move already in the set
+  needs no legality check.
+
+The cache holds at most ``max_bytes // ENTRY_BYTES`` entries and evicts
+with CLOCK (second chance): a hit only marks its entry as referenced, without
+a lock, and the insert that finds the cache full sweeps the ring for an
+unreferenced entry, clearing marks as it goes. New entries start unmarked, so
+the one-off positions of a middlegame go before the openings every game
+plays through.
+"""
+
+import threading
+
+import metrics
+
+DEFAULT_MAX_BYTES = 64 * 1024 * 1024
+ENTRY_BYTES = 1024  # Rough size of an entry with its key, FEN and a few moves, for the budget
+
+CHECKMATE = "checkmate"
+STALEMATE = "stalemate"
+INSUFFICIENT = "insufficient material"
+
+hits = metrics.registry.counter("chess_position_cache_hits_total", "Positions found in the position cache.")
+misses = metrics.registry.counter(
+    "chess_position_cache_misses_total", "Positions worked out afresh for the position cache."
+)
+evictions = metrics.registry.counter(
+    "chess_position_cache_evictions_total", "Positions evicted from the position cache."
+)
+
+
+class Entry:
+    """What holds for one position, whichever game reached it."""
+
+    __slots__ = ("outcome", "prefix", "legal", "referenced")
+
+    def __init__(self, board):
+        if not any(board.generate_legal_moves()):
+            self.outcome = CHECKMATE if board.is_check() else STALEMATE
+        elif board.is_insufficient_material():
+            self.outcome = INSUFFICIENT
+        else:
+            self.outcome = None
+        self.prefix = None  # Board, side to move, castling and en passant fields of the FEN
+        self.legal = None  # Set of legal moves seen here
+        self.referenced = False
+
+    def is_legal(self, board, move):
+        legal = self.legal
+        if legal is not None and move in legal:
+            return True
+        if not board.is_legal(move):
+            return False
+        if legal is None:
+            legal = self.legal = set()
+        legal.add(move)  # Only legal moves are kept, so the set stays as small as the position
+        return True
+
+    def fen(self, board):
+        """board.fen(), for a board in this position."""
+        if self.prefix is None:
+            self.prefix = board.epd()
+        return f"{self.prefix} {board.halfmove_clock} {board.fullmove_number}"
+
+
+class PositionCache:
+    """Entries of recently reached positions, up to a memory budget. Thread-safe."""
+
+    def __init__(self, max_bytes=DEFAULT_MAX_BYTES):
+        self.capacity = max_bytes // ENTRY_BYTES
+        self.entries = {}  # position_key -> Entry
+        self.ring = []  # Keys in CLOCK order, up to capacity
+        self.hand = 0  # Next ring slot the sweep looks at
+        self.lock = threading.Lock()
+
+    def __len__(self):
+        return len(self.entries)
+
+    def lookup(self, board, key):
+        """The Entry for board, whose termination.position_key is key."""
+        entry = self.entries.get(key)
+        if entry is not None:
+            entry.referenced = True
+            hits.inc()
+            return entry
+        misses.inc()
+        entry = Entry(board)
+        if self.capacity:
+            with self.lock:
+                present = self.entries.get(key)
+                if present is not None:  # Another thread got there first
+                    return present
+                self._insert(key, entry)
+        return entry
+
+    def _insert(self, key, entry):
+        """Caller holds the lock."""
+        ring = self.ring
+        if len(ring) < self.capacity:
+            ring.append(key)
+            self.entries[key] = entry
+            return
+        entries = self.entries
+        while True:
+            victim = entries[ring[self.hand]]
+            if not victim.referenced:
+                break
+            victim.referenced = False
+            self.hand = (self.hand + 1) % len(ring)
+        del entries[ring[self.hand]]
+        evictions.inc()
+        ring[self.hand] = key
+        entries[key] = entry
+        self.hand = (self.hand + 1) % len(ring)
+
@@ -0,0 +1,358 @@
+"""Wire protocol shared by the server front ends.
+
+Version 1 is the original newline-delimited text protocol ("BOARD:<fen>\\n").
+Version 2 uses length-prefixed binary frames:
+
+    opcode (1 byte) | payload length (unsigned LEB128 varint) | payload (UTF-8)
+
+A client asks for version 2 by adding "v2" to its lobby choice ("P v2"); the
+server advertises the versions it speaks in a HELLO line before the welcome
+prompt. Everything before and including the choice line is always text.
+
+Other tokens in the choice line turn on optional features. With "delta" the
+client gets one SNAPSHOT when it joins a game and then a DELTA per move
+instead of BOARD/INFO/TURN; every SYNC_INTERVAL plies the delta carries a
+Zobrist hash of the position so the client can detect desync and send RESYNC.
+
+With "hb" the server sends PING:<token> after a quiet spell and expects
+PONG:<token> (or any other traffic) before the heartbeat timeout; connections
+that stay silent are closed. Clients may PING the server the same way.
+
+Players may also pass matchmaking options as key=value tokens, e.g.
+"P v2 tc=5+0 rating=1620" (see matchmaking.py).
+
+With "resume" a player's game handshake ends with a resume token, and the
+game is held for a grace period if the connection drops. The client comes
+back by answering the welcome prompt with "R", the token and the seq of the
+last move it has ("R v2 delta resume token=<token> seq=14"); it then gets
+the DELTAs it missed, or a snapshot if they are no longer buffered.
+
+Spectators choosing a game ("S") get the first page of the lobby. While
+picking they may send "LIST status=playing tc=5+0 after=<cursor> limit=50"
+for another page or filter, "SUBSCRIBE" (same filters) to be pushed every
+change after the page, and "UNSUBSCRIBE". With the "lobby" feature pages
+come as LOBBY lines ("PAGE <version> <total> <next cursor|->" then one
+"GAME <id> <status> <tc> <white> <black> <started>" per game) and deltas as
+"ADD <version> <id> ...", "UPD <version> <id> <status>" and
+"DEL <version> <id>"; without it, pages are the plain "Active Games" text.
+
+Timed games (tc=5+0 and so on) send CLOCK:<white ms> <black ms> <w|b|->
+when they start, after every move and in every snapshot; clients count the
+running side down locally in between. A player whose time runs out loses
+with GAME_OVER. Clients that speak "hb" also get PING:clk<ns> probes after
+their opponent moves, and the round trip measured from their PONG is
+credited back to their clock (see game_clock.py).
+
+CHAT carries one or more chat lines. The server coalesces a game's chat
+into one CHAT per flush interval: in v2 that is a single frame whose payload
+holds the lines separated by newlines, in v1 one "CHAT:" line per chat line.
+Spectators get the game's recent chat after their snapshot (see chat.py).
+
+A server that is too busy answers with BUSY:<seconds> <reason> and closes
+the connection, either straight away (as text, before HELLO) or in reply to
+the choice line; the client should wait that many seconds before retrying.
+"""
+
+# --- Opcodes (keep in sync with chess_client_gui/constants.py) ---
+TEXT = 0x00  # Raw text, used for prompts and commands without a dedicated opcode
+INFO = 0x01
+BOARD = 0x02
+TURN = 0x03  # Payload "w" or "b"
+MOVE = 0x04  # Client->server: UCI. Server->client: "<uci> <w|b>" for an accepted move
+CHAT = 0x05
+GAME_OVER = 0x06
+INVALID_MOVE = 0x07
+YOUR_TURN = 0x08
+ERROR = 0x09
+QUIT = 0x0A
+SNAPSHOT = 0x0B  # "<seq> <fen>"
+DELTA = 0x0C  # "<seq> <uci>" or "<seq> <uci> <zobrist hex>"
+PING = 0x0D  # Either direction; payload is an opaque token echoed in the PONG
+PONG = 0x0E
+LOBBY = 0x0F  # Lobby page lines and subscription deltas, see lobby.py
+CLOCK = 0x10  # "<white ms> <black ms> <w|b|->": remaining times and whose is running
+BUSY = 0x11  # "<seconds> <reason>": refused for now, retry after that many seconds
+
+OPCODE_NAMES = {
+    INFO: "INFO",
+    BOARD: "BOARD",
+    TURN: "TURN",
+    MOVE: "MOVE",
+    CHAT: "CHAT",
+    GAME_OVER: "GAME_OVER",
+    INVALID_MOVE: "INVALID_MOVE",
+    YOUR_TURN: "YOUR_TURN",
+    ERROR: "ERROR",
+    QUIT: "QUIT",
+    SNAPSHOT: "SNAPSHOT",
+    DELTA: "DELTA",
+    PING: "PING",
+    PONG: "PONG",
+    LOBBY: "LOBBY",
+    CLOCK: "CLOCK",
+    BUSY: "BUSY",
+}
+
+SUPPORTED_VERSIONS = (1, 2)
+MAX_FRAME_PAYLOAD = 1 << 20  # Anything larger is treated as a broken or hostile peer
+MAX_LINE_LENGTH = 4096
+SYNC_INTERVAL = 8  # Plies between checksums in the delta stream
+
+
+class ProtocolError(ValueError):
+    """Raised when a peer sends bytes that cannot be parsed."""
+
+
+def _varint(n):
+    out = bytearray()
+    while True:
+        byte = n & 0x7F
+        n >>= 7
+        if n:
+            out.append(byte | 0x80)
+        else:
+            out.append(byte)
+            return bytes(out)
+
+
+def encode_frame(opcode, payload=""):
+    data = payload.encode()
+    return bytes((opcode,)) + _varint(len(data)) + data
+
+
+def pop_frame(buf):
+    """Removes and returns (opcode, payload) from the front of buf, or None if incomplete."""
+    length = 0
+    shift = 0
+    pos = 1
+    while True:
+        if pos >= len(buf):
+            return None  # Header not complete yet
+        byte = buf[pos]
+        length |= (byte & 0x7F) << shift
+        pos += 1
+        if not byte & 0x80:
+            break
+        shift += 7
+        if shift > 28:
+            raise ProtocolError("Frame length too long.")
+    if length > MAX_FRAME_PAYLOAD:
+        raise ProtocolError("Frame too large.")
+    end = pos + length
+    if len(buf) < end:
+        return None
+    opcode = buf[0]
+    payload = bytes(buf[pos:end]).decode(errors="replace")
+    del buf[:end]
+    return opcode, payload
+
+
+class Message:
+    """A server->client message that knows its text and framed encodings.
+
+    Encodings are computed lazily and cached, so a broadcast serializes each
+    message at most once per protocol version no matter how many recipients.
+    """
+
+    __slots__ = ("opcode", "payload", "text", "_encoded")
+
+    def __init__(self, opcode, payload="", text=None):
+        self.opcode = opcode
+        self.payload = payload
+        if text is None:
+            text = f"{OPCODE_NAMES[opcode]}:{payload}\n"
+        self.text = text
+        self._encoded = {}
+
+    def encode(self, version=1):
+        data = self._encoded.get(version)
+        if data is None:
+            if version == 1:
+                data = self.text.encode()
+            else:
+                data = encode_frame(self.opcode, self.payload)
+            self._encoded[version] = data
+        return data
+
+    def __repr__(self):
+        return f"Message({self.text!r})"
+
+
+def hello():
+    return Message(
+        TEXT, "", "HELLO:proto=" + ",".join(str(v) for v in SUPPORTED_VERSIONS) + "\n"
+    )
+
+
+def prompt(text):
+    """Raw prompt text with no message type and no trailing newline."""
+    return Message(TEXT, text, text)
+
+
+def info(text, newline=True):
+    return Message(INFO, text, f"INFO:{text}\n" if newline else f"INFO:{text}")
+
+
+def board(fen):
+    return Message(BOARD, fen)
+
+
+def turn(color):
+    return Message(TURN, color[0], f"TURN:{color}\n")
+
+
+def move_played(move_uci, color):
+    return Message(
+        MOVE, f"{move_uci} {color[0]}", f"INFO:Move {move_uci} by {color} was valid.\n"
+    )
+
+
+def snapshot(seq, fen):
+    return Message(SNAPSHOT, f"{seq} {fen}")
+
+
+def delta(seq, move_uci, checksum=None):
+    if checksum is None:
+        return Message(DELTA, f"{seq} {move_uci}")
+    return Message(DELTA, f"{seq} {move_uci} {checksum:016x}")
+
+
+def ping(token):
+    return Message(PING, token)
+
+
+def pong(token):
+    return Message(PONG, token)
+
+
+def lobby(text):
+    return Message(LOBBY, text)
+
+
+def clock(white, black, running):
+    """Remaining seconds of both sides; running is the color whose time is running, or None."""
+    return Message(
+        CLOCK, f"{int(white * 1000)} {int(black * 1000)} {running[0] if running else '-'}"
+    )
+
+
+def busy(retry_after, reason):
+    return Message(BUSY, f"{retry_after} {reason}")
+
+
+def chat(text):
+    return Message(CHAT, text)
+
+
+def chat_lines(lines):
+    """Several chat lines as one message: one frame (lines joined by newlines) in v2, one line each in v1."""
+    return Message(CHAT, "\n".join(lines), "".join(f"CHAT:{line}\n" for line in lines))
+
+
+def game_over(text):
+    return Message(GAME_OVER, text)
+
+
+def invalid_move(reason):
+    return Message(INVALID_MOVE, reason)
+
+
+def your_turn():
+    return Message(YOUR_TURN)
+
+
+def error(text):
+    return Message(ERROR, text)
+
+
+def parse_choice(line):
+    """Splits a lobby reply such as "P v2" into ("P", {"v2"})."""
+    tokens = line.split()
+    if not tokens:
+        return "", set()
+    return tokens[0].upper(), {token.lower() for token in tokens[1:]}
+
+
+def negotiated_version(options):
+    return 2 if "v2" in options else 1
+
+
+def negotiated_features(options):
+    """Optional features requested alongside the protocol version."""
+    return {option for option in options if option != "v2" and "=" not in option}
+
+
+def choice_params(options):
+    """The "key=value" options of a choice line, e.g. {"tc": "5+0", "rating": "1620"}."""
+    return dict(option.split("=", 1) for option in options if "=" in option)
+
+
+class LineDecoder:
+    """Incremental parser for version 1 (text) client input.
+
+    Complete lines are returned one at a time. Older clients never terminate
+    their commands, so until a connection has sent its first newline an
+    unterminated chunk is taken as a whole command, as the server always did.
+    """
+
+    def __init__(self, data=b""):
+        self.buffer = bytearray(data)
+        self.terminated = False
+
+    def feed(self, data):
+        self.buffer += data
+        if len(self.buffer) > MAX_LINE_LENGTH and b"\n" not in self.buffer:
+            raise ProtocolError("Line too long.")
+
+    def pop(self):
+        """Returns the next command (without its newline), or None if none is complete."""
+        index = self.buffer.find(b"\n")
+        if index < 0:
+            if self.terminated or not self.buffer:
+                return None
+            index = len(self.buffer)
+            line = bytes(self.buffer)
+            self.buffer.clear()
+        else:
+            self.terminated = True
+            line = bytes(self.buffer[:index])
+            del self.buffer[: index + 1]
+        return line.decode(errors="replace").strip("\r")
+
+    def take_buffer(self):
+        data = bytes(self.buffer)
+        self.buffer.clear()
+        return data
+
+
+class FrameDecoder:
+    """Incremental parser for version 2 client frames.
+
+    Frames are translated back into the equivalent text command ("MOVE:e2e4",
+    "QUIT", ...) so the session logic is the same for both versions.
+    """
+
+    def __init__(self, data=b""):
+        self.buffer = bytearray(data)
+
+    def feed(self, data):
+        self.buffer += data
+
+    def pop(self):
+        frame = pop_frame(self.buffer)
+        if frame is None:
+            return None
+        opcode, payload = frame
+        if opcode == TEXT:
+            return payload
+        if opcode == QUIT:
+            return "QUIT"
+        name = OPCODE_NAMES.get(opcode)
+        if name is None:
+            raise ProtocolError(f"Unknown opcode {opcode}.")
+        return f"{name}:{payload}"
+
+    def take_buffer(self):
+        data = bytes(self.buffer)
+        self.buffer.clear()
+        return data
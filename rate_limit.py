@@ -0,0 +1,128 @@
+"""Per-connection token-bucket rate limits on client commands.
+
+Every command a client sends is checked against two buckets of its own: one
+for all commands and one for the command's kind (move, chat, or any other
+command). A bucket holds up to ``burst`` tokens and refills at ``rate`` per
+second; a command that finds either bucket empty takes nothing from the
+other and is dropped before it is dispatched, so it is never parsed further,
+logged or broadcast, and costs no syscall. PONGs answering the server's own pings are never limited.
+
+Each dropped command also takes a token from the connection's "strikes"
+bucket. A client that keeps flooding after being told to slow down empties
+it and is disconnected.
+
+Limits are set as kind=rate/burst, e.g. "chat=1/5" (one message a second,
+bursts of five) or "chat=off".
+"""
+
+import metrics
+
+DEFAULT_LIMITS = {
+    "all": (20.0, 40),  # Every command, whatever its kind
+    "move": (10.0, 20),
+    "chat": (2.0, 5),
+    "command": (5.0, 20),  # Lobby, queue and game commands other than moves and chat
+    "strikes": (1.0, 30),  # Dropped commands tolerated before disconnecting
+}
+KINDS = ("move", "chat", "command")
+
+ALLOWED, DROPPED, ABUSIVE = range(3)
+
+dropped = {
+    kind: metrics.registry.counter(
+        "chess_rate_limited_total", "Client commands dropped by rate limits.", {"kind": kind}
+    )
+    for kind in KINDS
+}
+disconnects = metrics.registry.counter(
+    "chess_rate_limit_disconnects_total", "Connections closed for flooding."
+)
+
+
+_PREFIX_KINDS = {"MOVE:": "move", "CHAT:": "chat", "PONG:": None}
+
+
+def kind_of(command):
+    """The limit that applies to a decoded command, or None if it is exempt."""
+    return _PREFIX_KINDS.get(command[:5], "command")
+
+
+class TokenBucket:
+    """Up to burst tokens, refilled at rate per second. Limiter.check does the arithmetic."""
+
+    __slots__ = ("rate", "burst", "tokens", "updated")
+
+    def __init__(self, rate, burst, now):
+        self.rate = rate
+        self.burst = burst
+        self.tokens = float(burst)
+        self.updated = now
+
+
+class Limiter:
+    """One connection's buckets, created the first time each is needed."""
+
+    __slots__ = ("limits", "buckets", "dropping")
+
+    def __init__(self, limits):
+        self.limits = limits  # name -> (rate, burst); a missing name is unlimited
+        self.buckets = {}
+        self.dropping = False  # Set from the first dropped command until one gets through
+
+    def _refill(self, name, now):
+        """The bucket, refilled for the time since the last command, or None if name is unlimited."""
+        bucket = self.buckets.get(name)
+        if bucket is None:
+            limit = self.limits.get(name)
+            if limit is None:
+                return None
+            bucket = self.buckets[name] = TokenBucket(limit[0], limit[1], now)
+        tokens = bucket.tokens + (now - bucket.updated) * bucket.rate
+        bucket.tokens = bucket.burst if tokens > bucket.burst else tokens
+        bucket.updated = now
+        return bucket
+
+    def _take(self, name, now):
+        bucket = self._refill(name, now)
+        if bucket is None:
+            return True
+        if bucket.tokens < 1:
+            return False
+        bucket.tokens -= 1
+        return True
+
+    def check(self, command, now):
+        """ALLOWED, DROPPED, or ABUSIVE if the client should be disconnected."""
+        kind = kind_of(command)
+        if kind is None:
+            return ALLOWED
+        # Take from both buckets or neither, so flooding one kind leaves the shared budget to the others
+        every = self._refill("all", now)
+        own = self._refill(kind, now)
+        if (every is None or every.tokens >= 1) and (own is None or own.tokens >= 1):
+            if every is not None:
+                every.tokens -= 1
+            if own is not None:
+                own.tokens -= 1
+            self.dropping = False
+            return ALLOWED
+        dropped[kind].inc()
+        if not self._take("strikes", now):
+            disconnects.inc()
+            return ABUSIVE
+        return DROPPED
+
+
+def parse_limits(specs, limits=None):
+    """Applies ["chat=1/5", "move=off"] to a copy of limits (DEFAULT_LIMITS by default)."""
+    limits = dict(DEFAULT_LIMITS if limits is None else limits)
+    for spec in specs or ():
+        name, _, value = spec.partition("=")
+        if name not in limits and name not in KINDS:
+            raise ValueError(f"unknown rate limit {name!r}")
+        if value == "off":
+            limits.pop(name, None)
+            continue
+        rate, _, burst = value.partition("/")
+        limits[name] = (float(rate), max(1, int(burst or 1)))
+    return limits
@@ -0,0 +1,102 @@
+"""Spectator fan-out off the game's own thread.
+
+A game keeps its spectators in an immutable tuple that is replaced (under the
+game's own ``game["lock"]``) whenever someone joins or leaves, so publishing a
+message only hands that tuple to the SpectatorFanout: O(1) for the mover no
+matter how many people are watching. Delivery to each spectator's outbox happens on the
+fan-out thread, or on the event loop in asyncio mode.
+"""
+
+import collections
+import os
+import queue
+import threading
+
+
+def add_spectator(spectators, conn):
+    return spectators + (conn,)
+
+
+def remove_spectator(spectators, conn):
+    return tuple(spec for spec in spectators if spec is not conn)
+
+
+class SpectatorFanout:
+    """Delivers published messages to spectators in publication order."""
+
+    def __init__(self):
+        self.queue = queue.SimpleQueue()
+        self.thread = None
+        self.loop = None
+        self.pending = collections.deque()  # Published but not yet delivered, in asyncio mode
+        self.lock = threading.Lock()
+
+    def use_event_loop(self, loop):
+        """Delivers on the asyncio event loop instead of a dedicated thread."""
+        self.loop = loop
+
+    def publish(self, spectators, legacy, delta=None, low=False):
+        """Queues messages for a spectator tuple.
+
+        ``legacy`` is the list of messages for ordinary spectators; ``delta``,
+        if given, replaces them for spectators that negotiated move deltas.
+        ``low`` sends them at low priority (see fanout.Outbox.push_low).
+        """
+        if not spectators:
+            return
+        if self.loop is not None:
+            self.pending.append((spectators, legacy, delta, low))
+            self.loop.call_soon_threadsafe(self._deliver_next)
+            return
+        if self.thread is None:
+            with self.lock:
+                if self.thread is None:
+                    self.thread = threading.Thread(target=self._run, daemon=True)
+                    self.thread.start()
+        self.queue.put((spectators, legacy, delta, low))
+
+    def flush(self):
+        """Returns once everything published so far has been delivered.
+
+        In asyncio mode it delivers the backlog itself, so it must be called on
+        the event loop.
+        """
+        if self.loop is not None:
+            while self.pending:
+                self._deliver_next()
+        elif self.thread is not None:
+            delivered = threading.Event()
+            self.queue.put(delivered)
+            delivered.wait()
+
+    def _deliver_next(self):
+        if self.pending:  # flush() may have got there first
+            self._deliver(*self.pending.popleft())
+
+    def _run(self):
+        while True:
+            item = self.queue.get()
+            if isinstance(item, threading.Event):
+                item.set()  # A flush() marker
+            else:
+                self._deliver(*item)
+
+    @staticmethod
+    def _deliver(spectators, legacy, delta, low):
+        for conn in spectators:
+            try:
+                if low:
+                    for message in legacy:
+                        conn.send_low(message)
+                elif delta is not None and "delta" in conn.features:
+                    conn.send_message(delta)
+                else:
+                    for message in legacy:
+                        conn.send_message(message)
+            except Exception:  # Broken or lagging connection; its own thread cleans up
+                pass
+
+
+spectator_fanout = SpectatorFanout()  # Shared by every game in the process
+if hasattr(os, "register_at_fork"):
+    os.register_at_fork(after_in_child=spectator_fanout.__init__)
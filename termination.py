@@ -0,0 +1,108 @@
+"""Single-pass game termination for the move path.
+
+Asking python-chess is_checkmate(), is_stalemate(), is_seventyfive_moves()
+and is_fivefold_repetition() one after another generates legal moves more
+than once and walks the move stack for repetitions. A Position evaluates the
+new position once per ply instead: one legal-move probe (stopping at the first
+legal move) decides mate, stalemate and the 75-move rule, and a count of
+positions since the last capture or pawn move makes repetitions a dictionary
+lookup. Claimable draws (threefold, fifty moves) come out of the same state.
+
+Given a position_cache.PositionCache, the probe, the legality checks and the
+FEN are shared with every other game that reaches the same position.
+"""
+
+import chess
+
+import position_cache
+
+THREEFOLD = "threefold repetition"
+FIFTY_MOVES = "fifty-move rule"
+
+
+def position_key(board):
+    """What makes two positions the same for the repetition rules (FIDE 9.2)."""
+    return (
+        board.pawns,
+        board.knights,
+        board.bishops,
+        board.rooks,
+        board.queens,
+        board.kings,
+        board.occupied_co[chess.WHITE],
+        board.occupied_co[chess.BLACK],
+        board.turn,
+        board.clean_castling_rights(),
+        board.ep_square if board.has_legal_en_passant() else None,
+    )
+
+
+class Position:
+    """A game's board plus the repetition counts the termination rules need."""
+
+    __slots__ = ("board", "key", "repetitions", "cache", "entry")
+
+    def __init__(self, board, cache=None):
+        self.board = board
+        self.repetitions = {}
+        self.cache = cache
+        # Count the positions already on the board (none for a new game)
+        replay = board.root()
+        for move in board.move_stack:
+            self._count(replay)
+            replay.push(move)
+        self._count(board)
+        self._look_up()
+
+    def _count(self, board):
+        if board.halfmove_clock == 0:
+            # After a capture or pawn move no earlier position can come back
+            self.repetitions.clear()
+        self.key = position_key(board)
+        self.repetitions[self.key] = self.repetitions.get(self.key, 0) + 1
+
+    def _look_up(self):
+        """Finds (or works out) the current position's position_cache.Entry."""
+        if self.cache is None:
+            self.entry = position_cache.Entry(self.board)
+        else:
+            self.entry = self.cache.lookup(self.board, self.key)
+
+    def parse_move(self, move_uci):
+        """Returns the move if it is legal here, None if not. Raises ValueError for bad UCI."""
+        move = chess.Move.from_uci(move_uci)
+        return move if self.entry.is_legal(self.board, move) else None
+
+    def fen(self):
+        """The board's FEN."""
+        return self.entry.fen(self.board)
+
+    def push(self, move, mover):
+        """Plays a legal move and returns the game result message, or None if play continues.
+
+        ``mover`` is the color name of the side that moved, for the checkmate message.
+        """
+        board = self.board
+        board.push(move)
+        self._count(board)
+        self._look_up()
+        outcome = self.entry.outcome
+        if outcome == position_cache.CHECKMATE:
+            return f"Checkmate! Winner: {mover}"
+        if outcome == position_cache.STALEMATE:
+            return "Stalemate! It's a draw."
+        if outcome == position_cache.INSUFFICIENT:
+            return "Insufficient material! It's a draw."
+        if board.halfmove_clock >= 150:
+            return "75-move rule! It's a draw."
+        if self.repetitions[self.key] >= 5:
+            return "Fivefold repetition! It's a draw."
+        return None
+
+    def claimable_draw(self):
+        """The draw the side to move may claim right now (THREEFOLD or FIFTY_MOVES), or None."""
+        if self.repetitions[self.key] >= 3:
+            return THREEFOLD
+        if self.board.halfmove_clock >= 100:
+            return FIFTY_MOVES
+        return None
@@ -0,0 +1,102 @@
+"""Hashed timer wheel for per-connection deadlines.
+
+The wheel has a ring of ``slots`` buckets, each covering ``tick`` seconds. A
+deadline is filed in the bucket for its tick, modulo the ring size, so adding,
+moving and cancelling a deadline are all O(1). Each tick, only the one bucket
+that comes due is examined, so the cost of an idle server does not depend on
+how many connections it tracks.
+
+Pushing a deadline later, which is what happens every time a connection
+receives data, does not touch the buckets at all; only the stored deadline
+changes. When the old bucket comes due, the entry is filed again for its new
+deadline. Entries whose deadline is more than one turn of the ring away wait
+for later turns the same way.
+"""
+
+import math
+import threading
+import time
+
+from event_log import log
+
+
+class TimerWheel:
+    def __init__(self, tick=1.0, slots=64):
+        self.tick = tick
+        self.slots = [{} for _ in range(slots)]  # key -> tick number it is filed under
+        self.deadlines = {}  # key -> [deadline, tick number it is filed under]
+        self.current = math.floor(time.monotonic() / tick)  # Last tick processed
+        self.lock = threading.Lock()
+
+    def _file(self, key, entry, deadline):
+        at = max(math.ceil(deadline / self.tick), self.current + 1)
+        entry[1] = at
+        self.slots[at % len(self.slots)][key] = at
+
+    def schedule(self, key, deadline):
+        """Sets key's deadline (a time.monotonic() value), replacing any earlier one."""
+        with self.lock:
+            entry = self.deadlines.get(key)
+            if entry is None:
+                entry = self.deadlines[key] = [deadline, None]
+                self._file(key, entry, deadline)
+            else:
+                entry[0] = deadline
+                if math.ceil(deadline / self.tick) < entry[1]:
+                    # Sooner than where it is filed: move it now
+                    del self.slots[entry[1] % len(self.slots)][key]
+                    self._file(key, entry, deadline)
+
+    def cancel(self, key):
+        with self.lock:
+            entry = self.deadlines.pop(key, None)
+            if entry is not None:
+                self.slots[entry[1] % len(self.slots)].pop(key, None)
+
+    def deadline(self, key):
+        """Key's deadline, or None if it has none."""
+        with self.lock:
+            entry = self.deadlines.get(key)
+            return entry[0] if entry is not None else None
+
+    def __len__(self):
+        return len(self.deadlines)
+
+    def advance(self, now=None):
+        """Processes every tick up to now. Returns the keys whose deadline has passed."""
+        now = time.monotonic() if now is None else now
+        expired = []
+        with self.lock:
+            target = math.floor(now / self.tick)
+            # After a long stall, one turn of the ring covers every bucket
+            first = max(self.current + 1, target - len(self.slots) + 1)
+            for tick in range(first, target + 1):
+                slot = self.slots[tick % len(self.slots)]
+                due = [key for key, at in slot.items() if at <= tick]
+                for key in due:
+                    del slot[key]
+                    entry = self.deadlines[key]
+                    self.current = tick - 1  # So _file never picks a bucket already passed
+                    if entry[0] <= now:
+                        del self.deadlines[key]
+                        expired.append(key)
+                    else:
+                        self._file(key, entry, entry[0])
+            self.current = target
+        return expired
+
+    def run(self, on_expire):
+        """Advances the wheel every tick on a daemon thread, calling on_expire(key) for each expiry."""
+
+        def loop():
+            while True:
+                time.sleep(self.tick)
+                for key in self.advance():
+                    try:
+                        on_expire(key)
+                    except Exception as e:
+                        log.error("timer", "expiry handler failed", error=repr(e))
+
+        thread = threading.Thread(target=loop, daemon=True)
+        thread.start()
+        return thread
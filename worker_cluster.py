@@ -0,0 +1,217 @@
+"""Running the server as several worker processes on one port.
+
+Each worker accepts on its own SO_REUSEPORT socket and owns the games it
+creates; game ids start with the owner's index, so a reconnecting player or
+a spectator landing on another worker is handed to the owner over the
+control channel. Matchmaking stays per worker, so for each time control the
+workers share which of them has a player still needing an opponent, and a
+new player for that time control is sent there.
+"""
+
+import json
+import multiprocessing
+import os
+import signal
+import socket
+import tempfile
+import threading
+
+import matchmaking
+from event_log import log
+
+CONTROL_TIMEOUT = 1.0  # Seconds to wait on a peer worker before giving up on it
+NO_WAITING_WORKER = -1
+
+
+class WorkerCluster:
+    """Shared state and control channel for SO_REUSEPORT worker processes.
+
+    Every worker listens on the same TCP port and owns the games it creates.
+    Workers reach each other over one Unix stream socket per worker: a request
+    is a single JSON line, optionally carrying a client socket (SCM_RIGHTS) that
+    the receiving worker adopts. ``waiting_workers`` holds, per time control,
+    which worker (if any) has a player left without an opponent, so new
+    players for it can be routed there instead of waiting forever in separate
+    shards.
+    """
+
+    def __init__(self, count, port, socket_dir=None):
+        self.count = count
+        self.index = None  # Set in each worker by attach()
+        self.socket_dir = socket_dir or tempfile.gettempdir()
+        self.port = port
+        self.waiting_workers = multiprocessing.get_context("fork").Array(
+            "i", [NO_WAITING_WORKER] * len(matchmaking.TIME_CONTROLS)
+        )
+
+    def control_path(self, index):
+        return os.path.join(self.socket_dir, f"chess-{self.port}-worker{index}.sock")
+
+    def attach(self, index):
+        self.index = index
+
+    # --- Game ownership ---
+
+    def game_id_prefix(self):
+        return f"{self.index:02x}"
+
+    def owner_of(self, game_id):
+        """Worker index that owns game_id, or None if the id is not a sharded one."""
+        try:
+            owner = int(game_id[:2], 16)
+        except ValueError:
+            return None
+        return owner if owner < self.count else None
+
+    # --- Cross-worker matchmaking ---
+
+    def claim_waiting(self, time_control, join_locally):
+        """Routes a new player: returns None if they were joined here, or the worker to forward to.
+
+        ``join_locally()`` runs under the cluster-wide lock and must return True
+        if this worker then has a player for time_control without an opponent.
+        """
+        slot = matchmaking.TIME_CONTROLS.index(time_control)
+        with self.waiting_workers.get_lock():
+            owner = self.waiting_workers[slot]
+            if owner not in (NO_WAITING_WORKER, self.index):
+                self.waiting_workers[slot] = NO_WAITING_WORKER
+                return owner
+            still_waiting = join_locally()
+            self.waiting_workers[slot] = self.index if still_waiting else NO_WAITING_WORKER
+            return None
+
+    def waiting_changed(self, unpaired):
+        """Publishes {time_control: whether a player here has no opponent}, e.g. after a pairing tick."""
+        with self.waiting_workers.get_lock():
+            for time_control, still_waiting in unpaired.items():
+                slot = matchmaking.TIME_CONTROLS.index(time_control)
+                if still_waiting:
+                    self.waiting_workers[slot] = self.index
+                elif self.waiting_workers[slot] == self.index:
+                    self.waiting_workers[slot] = NO_WAITING_WORKER
+
+    # --- Control channel ---
+
+    def _request(self, index, header, fd=None):
+        with socket.socket(socket.AF_UNIX, socket.SOCK_STREAM) as ctl:
+            ctl.settimeout(CONTROL_TIMEOUT)
+            ctl.connect(self.control_path(index))
+            payload = (json.dumps(header) + "\n").encode()
+            if fd is None:
+                ctl.sendall(payload)
+            else:
+                socket.send_fds(ctl, [payload], [fd])
+            ctl.shutdown(socket.SHUT_WR)
+            chunks = []
+            while True:
+                chunk = ctl.recv(65536)
+                if not chunk:
+                    break
+                chunks.append(chunk)
+        reply = b"".join(chunks)
+        return json.loads(reply) if reply else None
+
+    def forward(self, index, sock, header):
+        """Hands a client socket to another worker. The caller still closes its own copy."""
+        return self._request(index, header, fd=sock.fileno())
+
+    def peer_pages(self, query):
+        """Collects a lobby page for ``query`` from every other worker, skipping unreachable ones."""
+        pages = []
+        for index in range(self.count):
+            if index == self.index:
+                continue
+            try:
+                page = self._request(index, {"op": "list", "query": query})
+            except (OSError, ValueError) as e:
+                log.warning("cluster", "list request failed", peer=index, error=str(e))
+                continue
+            if page:
+                pages.append(page)
+        return pages
+
+    def serve_control(self, on_adopt, on_list):
+        """Starts the control listener thread for this worker.
+
+        on_adopt(sock, header) takes ownership of a forwarded client socket;
+        on_list(query) returns this worker's lobby page for a query (see lobby.py).
+        """
+        path = self.control_path(self.index)
+        if os.path.exists(path):
+            os.unlink(path)
+        listener = socket.socket(socket.AF_UNIX, socket.SOCK_STREAM)
+        listener.bind(path)
+        listener.listen()
+
+        def loop():
+            while True:
+                ctl, _ = listener.accept()
+                try:
+                    self._handle_control(ctl, on_adopt, on_list)
+                except Exception as e:
+                    log.warning("cluster", "control request failed", error=str(e))
+                finally:
+                    ctl.close()
+
+        threading.Thread(target=loop, daemon=True).start()
+
+    def _handle_control(self, ctl, on_adopt, on_list):
+        ctl.settimeout(CONTROL_TIMEOUT)
+        data, fds, _, _ = socket.recv_fds(ctl, 65536, 1)
+        while not data.endswith(b"\n"):
+            chunk = ctl.recv(65536)
+            if not chunk:
+                break
+            data += chunk
+        header = json.loads(data)
+        reply = None
+        if header["op"] == "adopt" and fds:
+            on_adopt(socket.socket(fileno=fds[0]), header)
+        elif header["op"] == "list":
+            reply = on_list(header.get("query", {}))
+        else:
+            for fd in fds:
+                os.close(fd)
+        if reply is not None:
+            ctl.sendall(json.dumps(reply).encode())
+
+
+def reuseport_listener(host, port, backlog=socket.SOMAXCONN):
+    """Creates a listening socket that shares host:port with the other workers."""
+    if not hasattr(socket, "SO_REUSEPORT"):
+        raise RuntimeError("SO_REUSEPORT is not supported on this platform.")
+    server_socket = socket.socket(socket.AF_INET, socket.SOCK_STREAM)
+    server_socket.setsockopt(socket.SOL_SOCKET, socket.SO_REUSEADDR, 1)
+    server_socket.setsockopt(socket.SOL_SOCKET, socket.SO_REUSEPORT, 1)
+    server_socket.bind((host, port))
+    server_socket.listen(backlog)
+    return server_socket
+
+
+def run_workers(cluster, worker_main):
+    """Forks cluster.count workers running worker_main(index) and waits for them."""
+    ctx = multiprocessing.get_context("fork")
+    workers = [
+        ctx.Process(target=worker_main, args=(index,), daemon=True)
+        for index in range(cluster.count)
+    ]
+    for worker in workers:
+        worker.start()
+
+    def stop(signum, frame):
+        for worker in workers:
+            if worker.is_alive():
+                worker.terminate()
+
+    signal.signal(signal.SIGTERM, stop)
+    try:
+        for worker in workers:
+            worker.join()
+    except KeyboardInterrupt:
+        stop(None, None)
+    finally:
+        for index in range(cluster.count):
+            path = cluster.control_path(index)
+            if os.path.exists(path):
+                os.unlink(path)